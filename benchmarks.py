@@ -0,0 +1,671 @@
+#!/usr/bin/env python
+
+# Benchmarks for pushover_client_python; they run offline.
+#
+# usage: python benchmarks.py [benchmark_name ...]
+
+import itertools
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from pushover_client_python import JSON_DECODER_BACKENDS
+from pushover_client_python import MESSAGE_STORE_CAPACITY
+from pushover_client_python import PushoverAttachmentCache
+from pushover_client_python import PushoverAttachmentFetcher
+from pushover_client_python import PushoverCallbackSink
+from pushover_client_python import PushoverCommand
+from pushover_client_python import PushoverCommandDispatcher
+from pushover_client_python import PushoverCommandExecutor
+from pushover_client_python import PushoverDedupIndex
+from pushover_client_python import PushoverOpenClient
+from pushover_client_python import PushoverOpenClientRealTime
+from pushover_client_python import PushoverJSONDecoder
+from pushover_client_python import PushoverMessageHistory
+from pushover_client_python import PushoverMessageStore
+from pushover_client_python import PushoverMetrics
+from pushover_client_python import PushoverRotatingFileSink
+
+from pushover_fake_server import PushoverFakeServer
+
+# `import pushover_client_python` should take less than this.
+IMPORT_TIME_BUDGET = 25  # milliseconds
+
+# modules which importing pushover_client_python must not import.
+IMPORT_DEFERRED_MODULES = ("requests", "urllib3", "websocket", "asyncio",
+                           "aiohttp", "sqlite3", "html.parser", "inspect")
+
+def get_resident_memory():
+    """Current resident memory of this process, in bytes."""
+
+    # /proc is linux-only; elsewhere use the peak resident memory.
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def generate_message_dict(message_id):
+    message_dict = {
+        "id": message_id,
+        "id_str": str(message_id),
+        "umid": message_id,
+        "umid_str": str(message_id),
+        "title": "Benchmark",
+        "message": "benchmark message number {message_id}"\
+            .format(message_id=message_id),
+        "app": "benchmarks",
+        "aid": 1,
+        "aid_str": "1",
+        "icon": "pushover",
+        "date": 1600000000 + message_id,
+        "priority": 0,
+        "acked": 0
+    }
+
+    return message_dict
+
+def get_percentiles(values, percentiles=(50, 90, 99)):
+    """Returns `{ "p50": value, ... }`, in milliseconds."""
+
+    if len(values) < 2:
+        return {"p{percentile}_ms".format(percentile=percentile): None
+                for percentile in percentiles}
+
+    quantiles = statistics.quantiles(values, n=100, method="inclusive")
+
+    return {"p{percentile}_ms".format(percentile=percentile):
+                round(quantiles[percentile - 1] * 1000, 2)
+            for percentile in percentiles}
+
+def print_result(name, **results):
+    print(name)
+
+    for key, value in results.items():
+        print("  {key}: {value}".format(key=key, value=value))
+
+def generate_messages_payload(count):
+    """Body of a messages.json response with `count` messages, as bytes."""
+
+    response_dict = {
+        "messages": [generate_message_dict(message_id)
+                     for message_id in range(1, count + 1)],
+        "user": {"quiet_hours": False, "is_android_licensed": True},
+        "device": {"name": "benchmarks"},
+        "status": 1,
+        "request": "00000000-0000-0000-0000-000000000000"
+    }
+
+    return json.dumps(response_dict).encode("utf-8")
+
+def time_function(function, repeat):
+    """Best time of `repeat` calls to `function`, in seconds."""
+
+    best_time = None
+
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start_time
+
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+
+    return best_time
+
+def benchmark_json_decoders(count=10000, repeat=10):
+    """Decoding a messages response of `count` messages, per backend."""
+
+    payload = generate_messages_payload(count)
+
+    # how responses were decoded before: bytes -> str -> dicts
+    results = {
+        "json_from_text_ms":
+            time_function(lambda: json.loads(payload.decode("utf-8")),
+                          repeat=repeat) * 1000
+    }
+
+    for backend in JSON_DECODER_BACKENDS:
+        if not PushoverJSONDecoder.is_available(backend):
+            results.update({backend: "not installed"})
+            continue
+
+        json_decoder = PushoverJSONDecoder(backend=backend)
+
+        results.update({
+            "{backend}_ms".format(backend=backend):
+                time_function(lambda: json_decoder.decode(payload),
+                              repeat=repeat) * 1000,
+            "{backend}_typed_records_ms".format(backend=backend):
+                time_function(lambda: json_decoder.decode_messages(payload),
+                              repeat=repeat) * 1000
+        })
+
+    results = {key: round(value, 2) if isinstance(value, float) else value
+               for key, value in results.items()}
+
+    print_result("json_decoders", messages=count,
+                 payload_kb=len(payload) // 1024, **results)
+
+def benchmark_message_store(count=1000000, capacity=MESSAGE_STORE_CAPACITY):
+    """Resident memory after `count` messages went through the store."""
+
+    memory_before = get_resident_memory()
+
+    message_store = PushoverMessageStore(capacity=capacity)
+
+    start_time = time.perf_counter()
+
+    for message_id in range(1, count + 1):
+        message_store.add(generate_message_dict(message_id))
+
+    elapsed = time.perf_counter() - start_time
+
+    memory_after = get_resident_memory()
+
+    print_result("message_store",
+                 messages_processed=count,
+                 messages_kept=len(message_store),
+                 highest_message_id=message_store.highest_message_id,
+                 messages_per_second=int(count / elapsed),
+                 resident_memory_growth_mb=\
+                     round((memory_after - memory_before) / 2**20, 2))
+
+def benchmark_frame_dispatch(count=1000000):
+    """Websocket frames per second through the realtime `_on_message()`."""
+
+    pushover_open_client = PushoverOpenClient()
+    pushover_open_client.secret = "benchmark"
+    pushover_open_client.device_id = "benchmark"
+
+    realtime = PushoverOpenClientRealTime(
+        pushover_open_client=pushover_open_client)
+
+    on_message = realtime._on_message
+    results = dict()
+
+    # keep-alives alone, keep-alives with syncs, and coalesced frames
+    for name, frame in (("keep_alive", b'#'), ("sync", b'!'),
+                        ("coalesced_4", b'##!#')):
+
+        start_time = time.perf_counter()
+
+        for _ in range(count // len(frame)):
+            on_message(None, frame)
+
+        elapsed = time.perf_counter() - start_time
+
+        results.update({"{name}_frames_per_second".format(name=name):
+                            int(count / elapsed)})
+
+    print_result("frame_dispatch", frames=count, **results)
+
+def benchmark_dedup_index(count=1000000, capacity=10000,
+                          bloom_capacity=1000000, redownloads=3):
+    """
+    Resident memory and throughput of a `PushoverDedupIndex` after `count`
+    messages, each seen `redownloads` times, and its false positive rate.
+    """
+
+    memory_before = get_resident_memory()
+
+    dedup_index = PushoverDedupIndex(capacity=capacity,
+                                     bloom_capacity=bloom_capacity)
+
+    new_messages = 0
+    start_time = time.perf_counter()
+
+    # each message is downloaded again by the next syncs until it is
+    # acknowledged.
+    for message_id in range(1, count + 1):
+        for redownload in range(redownloads):
+            if dedup_index.add(max(message_id - redownload, 1)):
+                new_messages += 1
+
+    elapsed = time.perf_counter() - start_time
+
+    memory_after = get_resident_memory()
+
+    # messages never seen, which the Bloom filters take for duplicates
+    false_positives = sum(1 for message_id in range(count + 1, count + 100001)
+                          if message_id in dedup_index)
+
+    print_result("dedup_index",
+                 messages=count,
+                 new_messages=new_messages,
+                 lookups_per_second=int(count * redownloads / elapsed),
+                 false_positive_rate=false_positives / 100000,
+                 resident_memory_growth_mb=\
+                     round((memory_after - memory_before) / 2**20, 2))
+
+def benchmark_client_load(requests=1000, backlog=100, latency=0.0,
+                          error_rate=0.0):
+    """
+    `PushoverOpenClient.download_messages()` against the fake server, with
+    `backlog` messages waiting; latency percentiles and throughput.
+    """
+
+    with PushoverFakeServer(latency=latency, error_rate=error_rate) \
+            as pushover_fake_server:
+
+        device = pushover_fake_server.add_device()
+
+        for message_number in range(backlog):
+            pushover_fake_server.push_message(
+                "backlog {message_number}".format(
+                    message_number=message_number))
+
+        pushover_open_client =\
+            PushoverOpenClient(api_url=pushover_fake_server.api_url)
+        pushover_open_client.secret = device.secret
+        pushover_open_client.device_id = device.device_id
+
+        durations = list()
+        errors = 0
+
+        start_time = time.perf_counter()
+
+        for _ in range(requests):
+            request_start_time = time.perf_counter()
+
+            if pushover_open_client.download_messages() is False:
+                errors += 1
+
+            durations.append(time.perf_counter() - request_start_time)
+
+        elapsed = time.perf_counter() - start_time
+
+    print_result("client_load", requests=requests, backlog=backlog,
+                 errors=errors, requests_per_second=int(requests / elapsed),
+                 **get_percentiles(durations),
+                 connection_reuse_rate=\
+                     round(pushover_open_client.connection_stats.reuse_rate,
+                           3))
+
+def benchmark_realtime_load(messages=500, interval=0.002, sync_debounce=0.01,
+                            sync_max_delay=0.05):
+    """
+    Notification-to-handler latency of `PushoverOpenClientRealTime`, with
+    `messages` pushed by the fake server every `interval` seconds.
+    """
+
+    latencies = list()
+    received = threading.Event()
+
+    def benchmark(sent_time: float):
+        latencies.append(time.time() - sent_time)
+
+        if len(latencies) == messages:
+            received.set()
+
+    command_dispatcher = PushoverCommandDispatcher(
+        registry={"benchmark": PushoverCommand(benchmark)},
+        executor=PushoverCommandExecutor())
+
+    with PushoverFakeServer() as pushover_fake_server:
+        device = pushover_fake_server.add_device()
+
+        pushover_open_client =\
+            PushoverOpenClient(api_url=pushover_fake_server.api_url)
+        pushover_open_client.secret = device.secret
+        pushover_open_client.device_id = device.device_id
+
+        realtime = PushoverOpenClientRealTime(
+            pushover_open_client=pushover_open_client,
+            pushover_websocket_server_url=pushover_fake_server.websocket_url,
+            sync_debounce=sync_debounce, sync_max_delay=sync_max_delay,
+            ack_interval=sync_max_delay,
+            command_dispatcher=command_dispatcher)
+
+        realtime_thread = threading.Thread(target=realtime.run_forever,
+                                           daemon=True)
+        realtime_thread.start()
+
+        while not realtime.connected:
+            time.sleep(0.01)
+
+        start_time = time.perf_counter()
+
+        for _ in range(messages):
+            pushover_fake_server.push_message(
+                "benchmark {sent_time}".format(sent_time=time.time()),
+                device_id=device.device_id)
+            time.sleep(interval)
+
+        received.wait(timeout=30)
+
+        elapsed = time.perf_counter() - start_time
+
+        realtime.stop()
+        realtime_thread.join()
+
+    print_result("realtime_load", messages=messages,
+                 handled=len(latencies),
+                 messages_per_second=int(len(latencies) / elapsed),
+                 syncs=realtime.sync_scheduler.syncs,
+                 **get_percentiles(latencies))
+
+def benchmark_metrics(count=1000000):
+    """Cost of recording a request timing, with metrics off and on."""
+
+    results = dict()
+
+    for name, metrics in (("disabled", None), ("enabled", PushoverMetrics())):
+        pushover_open_client = PushoverOpenClient(metrics=metrics)
+        record_request_time = pushover_open_client._record_request_time
+
+        start_time = time.perf_counter()
+
+        for _ in range(count):
+            record_request_time("messages", start_time)
+
+        elapsed = time.perf_counter() - start_time
+
+        results.update({"{name}_ns_per_call".format(name=name):
+                            int(elapsed / count * 1e9)})
+
+    print_result("metrics", calls=count, **results)
+
+def benchmark_import_time(repeat=10, budget=IMPORT_TIME_BUDGET):
+    """
+    Time to import pushover_client_python in a fresh interpreter (as told by
+    `python -X importtime`), and heavy modules which it imported anyway.
+    """
+
+    import_times = list()
+
+    for _ in range(repeat):
+        completed_process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import sys, pushover_client_python; "
+             "print(' '.join(sorted(sys.modules)))"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+        # "import time: self [us] | cumulative | module"
+        for line in completed_process.stderr.splitlines():
+            fields = [field.strip() for field in line.split("|")]
+
+            if fields[-1] == "pushover_client_python":
+                import_times.append(int(fields[1]) / 1000)
+
+        imported_modules = completed_process.stdout.split()
+
+    import_time = min(import_times)
+
+    print_result("import_time", import_time_ms=round(import_time, 2),
+                 budget_ms=budget, within_budget=import_time <= budget,
+                 deferred_modules_imported=\
+                     [module for module in IMPORT_DEFERRED_MODULES
+                      if module in imported_modules])
+
+def benchmark_priority_flood(messages=2000, emergency_every=100, batch=100,
+                             batch_interval=0.02, work_time=0.002):
+    """
+    Emergency message latency (dispatch to command start) while a flood of
+    normal messages outruns the executor, with and without priority lanes.
+    """
+
+    results = dict()
+
+    for lanes in (False, True):
+        latencies = {"emergency": list(), "normal": list()}
+        done = threading.Event()
+
+        def work(kind: str, sent_time: float):
+            latencies[kind].append(time.monotonic() - sent_time)
+
+            if sum(map(len, latencies.values())) == messages:
+                done.set()
+
+            time.sleep(work_time)
+
+        executor = PushoverCommandExecutor(
+            queue_size=messages, reserved_workers=1 if lanes else 0)
+        command_dispatcher = PushoverCommandDispatcher(
+            registry={"work": PushoverCommand(work)}, executor=executor)
+
+        for batch_start in range(0, messages, batch):
+            batch_messages = list()
+
+            for message_number in range(batch_start, batch_start + batch):
+                kind = "emergency" if message_number % emergency_every == 0 \
+                    else "normal"
+                priority = 2 if kind == "emergency" and lanes else 0
+
+                batch_messages.append({
+                    "message": "work {kind} {sent_time}".format(
+                        kind=kind, sent_time=time.monotonic()),
+                    "priority": priority})
+
+            command_dispatcher.dispatch_all(batch_messages)
+            time.sleep(batch_interval)
+
+        done.wait(timeout=60)
+        executor.stop()
+
+        name = "lanes" if lanes else "fifo"
+
+        for kind, kind_latencies in latencies.items():
+            for percentile, value in get_percentiles(kind_latencies,
+                                                     (50, 99)).items():
+                results.update({"{name}_{kind}_{percentile}".format(
+                    name=name, kind=kind, percentile=percentile): value})
+
+    print_result("priority_flood", messages=messages, **results)
+
+def benchmark_attachment_prefetch(messages=200, icons=20, latency=0.02,
+                                  workers=4):
+    """
+    Time until the icons and attachments of `messages` downloaded messages
+    are on disk, fetched one by one and prefetched by `workers` threads, and
+    the time of the same lookups once cached.
+    """
+
+    results = dict()
+
+    with PushoverFakeServer(latency=latency) as pushover_fake_server:
+        message_dicts = [
+            {"id": message_id,
+             "icon": "icon{number}".format(number=message_id % icons),
+             "attachment": pushover_fake_server.get_attachment_url(
+                 "{message_id}.jpg".format(message_id=message_id))}
+            for message_id in range(1, messages + 1)]
+
+        for name, prefetch in (("sequential", False), ("prefetch", True)):
+            with tempfile.TemporaryDirectory() as cache_directory:
+                attachment_fetcher = PushoverAttachmentFetcher(
+                    PushoverAttachmentCache(cache_directory),
+                    icon_url=pushover_fake_server.icon_url,
+                    workers=workers)
+
+                file_requests = pushover_fake_server.file_requests
+                start_time = time.perf_counter()
+
+                if prefetch:
+                    for future in attachment_fetcher.prefetch(
+                            message_dicts).values():
+                        future.result()
+
+                for message_dict in message_dicts:
+                    attachment_fetcher.get_icon_path(message_dict)
+                    attachment_fetcher.get_attachment_paths(message_dict)
+
+                results.update({"{name}_ms".format(name=name): round(
+                    (time.perf_counter() - start_time) * 1000, 1)})
+
+                start_time = time.perf_counter()
+
+                for message_dict in message_dicts:
+                    attachment_fetcher.get_icon_path(message_dict)
+                    attachment_fetcher.get_attachment_paths(message_dict)
+
+                results.update({
+                    "{name}_cached_ms".format(name=name): round(
+                        (time.perf_counter() - start_time) * 1000, 1),
+                    "{name}_requests".format(name=name):
+                        pushover_fake_server.file_requests - file_requests})
+
+                attachment_fetcher.close()
+
+    print_result("attachment_prefetch", messages=messages, **results)
+
+def benchmark_sink_fanout(messages=100000, batch=100, stalled_time=1.0):
+    """
+    Time spent forwarding batches of downloaded messages to a rotating file
+    sink and a stalled one (which takes `stalled_time` seconds per write),
+    the time until the file has them all, and the stalled sink's drops.
+    """
+
+    stalled_sink = PushoverCallbackSink(
+        lambda messages: time.sleep(stalled_time), name="stalled")
+
+    with tempfile.TemporaryDirectory() as sink_directory:
+        # the stalled sink keeps the default buffer size, and drops
+        file_sink = PushoverRotatingFileSink(
+            os.path.join(sink_directory, "messages.ndjson"),
+            buffer_size=messages)
+
+        durations = list()
+        start_time = time.perf_counter()
+
+        for batch_start in range(1, messages + 1, batch):
+            message_dicts = [generate_message_dict(message_id)
+                             for message_id in range(batch_start,
+                                                     batch_start + batch)]
+
+            put_start_time = time.perf_counter()
+
+            for sink in (file_sink, stalled_sink):
+                sink.put(message_dicts)
+
+            durations.append(time.perf_counter() - put_start_time)
+
+        while file_sink.sent + file_sink.dropped < messages:
+            time.sleep(0.01)
+
+        elapsed = time.perf_counter() - start_time
+
+        file_sink.stop()
+        stalled_sink.stop(timeout=0)
+
+    print_result("sink_fanout",
+                 messages=messages,
+                 **{"put_{percentile}".format(percentile=percentile): value
+                    for percentile, value in get_percentiles(
+                        durations, (50, 99)).items()},
+                 file_messages_per_second=int(messages / elapsed),
+                 file_dropped=file_sink.dropped,
+                 stalled_dropped=stalled_sink.dropped)
+
+def benchmark_message_history(messages=2000000, batch=100, apps=50,
+                              titles=500, repeat=20):
+    """
+    Inserting `messages` in batches of `batch` into a `PushoverMessageHistory`,
+    then the latency of typical queries (the 100 newest matches) on it.
+    """
+
+    random_generator = random.Random(0)
+
+    # a vocabulary with a few frequent words and many rare ones
+    words = ["word{number}".format(number=number) for number in range(5000)]
+    cumulative_word_weights = list(itertools.accumulate(
+        1 / (rank + 1) for rank in range(len(words))))
+
+    start_date = 1600000000
+
+    with tempfile.TemporaryDirectory() as history_directory:
+        message_history = PushoverMessageHistory(
+            os.path.join(history_directory, "history.db"))
+
+        insert_elapsed = 0
+
+        for batch_start in range(1, messages + 1, batch):
+            message_dicts = list()
+
+            for message_id in range(batch_start, batch_start + batch):
+                message_dict = generate_message_dict(message_id)
+                message_dict.update({
+                    "app": "app{number}".format(
+                        number=random_generator.randrange(apps)),
+                    "title": "title{number}".format(
+                        number=random_generator.randrange(titles)),
+                    "message": " ".join(random_generator.choices(
+                        words, cum_weights=cumulative_word_weights, k=12)),
+                    "priority": random_generator.choice((-1, 0, 0, 0, 1, 2)),
+                    "date": start_date + message_id * 10})
+                message_dicts.append(message_dict)
+
+            start_time = time.perf_counter()
+            message_history.add(message_dicts)
+            insert_elapsed += time.perf_counter() - start_time
+
+        queries = {
+            "newest": {},
+            "app": {"app": "app7"},
+            "title": {"title": "title42"},
+            "priority": {"priority": 2},
+            "date_range": {"since": start_date + messages * 5,
+                           "until": start_date + messages * 5 + 86400},
+            "text_frequent": {"text": "word1"},
+            "text_rare": {"text": "word4321"},
+            "text_and_app": {"text": "word3 word50", "app": "app7"},
+        }
+
+        results = dict()
+
+        for name, query in queries.items():
+            durations = list()
+
+            for _ in range(repeat):
+                query_start_time = time.perf_counter()
+                message_history.search(**query)
+                durations.append(time.perf_counter() - query_start_time)
+
+            results.update({"{name}_p50_ms".format(name=name):
+                                get_percentiles(durations, (50,))["p50_ms"]})
+
+        message_history.close()
+
+        database_size = sum(
+            os.path.getsize(os.path.join(history_directory, file_name))
+            for file_name in os.listdir(history_directory))
+
+    print_result("message_history",
+                 messages=messages,
+                 inserts_per_second=int(messages / insert_elapsed),
+                 database_size_mb=round(database_size / 2**20, 1),
+                 **results)
+
+BENCHMARKS = {
+    "message_store": benchmark_message_store,
+    "json_decoders": benchmark_json_decoders,
+    "frame_dispatch": benchmark_frame_dispatch,
+    "dedup_index": benchmark_dedup_index,
+    "client_load": benchmark_client_load,
+    "realtime_load": benchmark_realtime_load,
+    "metrics": benchmark_metrics,
+    "import_time": benchmark_import_time,
+    "priority_flood": benchmark_priority_flood,
+    "attachment_prefetch": benchmark_attachment_prefetch,
+    "sink_fanout": benchmark_sink_fanout,
+    "message_history": benchmark_message_history,
+}
+
+def main(benchmark_names):
+    if not benchmark_names:
+        benchmark_names = list(BENCHMARKS)
+
+    for benchmark_name in benchmark_names:
+        BENCHMARKS[benchmark_name]()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
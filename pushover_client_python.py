@@ -3,27 +3,168 @@
 # Pushover Open Client API
 # specification: https://pushover.net/api/client
 
-import datetime
+import bisect
+import codecs
+import collections
 import functools
+import importlib.util
 import json
+import logging
+import math
 import os
-import requests
+import random
+import re
+import threading
+import time
 
-import websocket
+# `requests`, `websocket`, `asyncio` and other heavy modules are imported
+# where they are used, so that importing this module stays fast for one-shot
+# scripts (see `benchmark_import_time` in benchmarks.py.)
 
 PUSHOVER_API_URL = "https://api.pushover.net/1"
 
-ENDPOINT_LOGIN = "{api_url}/users/login.json".format(api_url=PUSHOVER_API_URL)
-ENDPOINT_DEVICES = "{api_url}/devices.json".format(api_url=PUSHOVER_API_URL)
-ENDPOINT_MESSAGES = "{api_url}/messages.json".format(api_url=PUSHOVER_API_URL)
+# endpoints are formatted with the client's `api_url`, so that a local
+# stand-in server can be used instead of the real API.
+ENDPOINT_LOGIN = "{api_url}/users/login.json"
+ENDPOINT_DEVICES = "{api_url}/devices.json"
+ENDPOINT_MESSAGES = "{api_url}/messages.json"
 ENDPOINT_UPDATE_HIGHEST_MESSAGE = \
         "{api_url}/devices/{device_id}/update_highest_message.json"
+ENDPOINT_ACKNOWLEDGE_EMERGENCY = \
+        "{api_url}/receipts/{receipt}/acknowledge.json"
+
+# HTTP connection pooling; connections to the API are kept alive between
+# calls, so that each sync doesn't pay a new TCP + TLS handshake.
+HTTP_POOL_CONNECTIONS = 4  # number of hosts to keep pools for
+HTTP_POOL_MAXSIZE = 10  # connections kept alive per host
+
+HTTP_RETRY_TOTAL = 3
+HTTP_RETRY_BACKOFF_FACTOR = 0.5  # seconds; doubles on each retry
+HTTP_RETRY_STATUS_FORCELIST = (429, 500, 502, 503, 504)
+
+# (connect timeout, read timeout), in seconds
+HTTP_DEFAULT_TIMEOUT = (5, 30)
+HTTP_TIMEOUTS = {
+    "login": (5, 15),
+    "devices": (5, 15),
+    "messages": (5, 30),
+    "update_highest_message": (5, 15),
+    "acknowledge_emergency": (5, 15),
+    "attachment": (5, 30),
+    "webhook": (5, 10),
+}
 
 PUSHOVER_WEBSOCKET_SERVER_URL = "wss://client.pushover.net/push"
 PUSHOVER_WEBSOCKET_LOGIN = "login:{device_id}:{secret}\n"
 
 CREDENTIALS_FILENAME = os.path.expanduser("~/.pushover-open-client-creds.json")
 
+# `!` frames arriving within `SYNC_DEBOUNCE` seconds of each other are served
+# by a single sync, which is never postponed more than `SYNC_MAX_DELAY`.
+SYNC_DEBOUNCE = 0.25  # seconds
+SYNC_MAX_DELAY = 2.0  # seconds
+
+# backends to decode JSON responses, fastest first; by default the first one
+# installed is used. `json` is the standard library's.
+JSON_DECODER_BACKENDS = ("orjson", "msgspec", "json")
+
+# size of the chunks read when streaming downloaded messages.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes
+
+# icons and attachments of messages are cached on disk, up to
+# `ATTACHMENT_CACHE_MAX_SIZE`, and fetched by `ATTACHMENT_PREFETCH_WORKERS`
+# threads; see `PushoverAttachmentFetcher`.
+ICON_URL = "https://api.pushover.net/icons/{icon}.png"
+ATTACHMENT_CACHE_DIRECTORY =\
+    os.path.expanduser("~/.cache/pushover-open-client")
+ATTACHMENT_CACHE_MAX_SIZE = 100 * 2**20  # bytes
+ATTACHMENT_PREFETCH_WORKERS = 4
+
+# new messages are forwarded to sinks (see `PushoverSink`) in batches of up
+# to `SINK_BATCH_SIZE`, at most `SINK_FLUSH_INTERVAL` seconds after they
+# arrive; while its consumer is slow or away, a sink buffers up to
+# `SINK_BUFFER_SIZE` messages, dropping the oldest beyond.
+SINK_BATCH_SIZE = 100
+SINK_FLUSH_INTERVAL = 0.5  # seconds
+SINK_BUFFER_SIZE = 10000
+SINK_RETRY_BACKOFF_INITIAL = 0.5  # seconds
+SINK_RETRY_BACKOFF_MAX = 30.0  # seconds
+SINK_WRITE_TIMEOUT = 10.0  # seconds, for sockets
+SINK_STOP_TIMEOUT = 5.0  # seconds to write the buffered messages
+SINK_FILE_MAX_SIZE = 10 * 2**20  # bytes
+SINK_FILE_BACKUP_COUNT = 5
+
+# messages kept in memory by each client; the oldest are evicted first.
+MESSAGE_STORE_CAPACITY = 10000
+MESSAGE_STORE_TTL = None  # seconds; None keeps messages until evicted
+
+# the dedup index remembers the `DEDUP_INDEX_CAPACITY` most recently seen
+# message keys; older ones go to an optional Bloom filter, which may take a
+# new message for a duplicate with probability `DEDUP_BLOOM_ERROR_RATE`.
+DEDUP_INDEX_CAPACITY = 10000
+DEDUP_BLOOM_ERROR_RATE = 0.001
+
+# the message journal commits appended messages and processed ids at most
+# `JOURNAL_COMMIT_INTERVAL` seconds after they are written, or after
+# `JOURNAL_COMMIT_MAX_PENDING` messages; it is fsync'ed before each
+# acknowledgement.
+JOURNAL_COMMIT_INTERVAL = 1.0  # seconds
+JOURNAL_COMMIT_MAX_PENDING = 1000
+
+# searchable history of the downloaded messages; see `PushoverMessageHistory`.
+HISTORY_FILENAME = os.path.expanduser("~/.pushover-open-client-history.db")
+
+# command functions are run by a pool of `EXECUTOR_WORKERS` threads, from a
+# queue of at most `EXECUTOR_QUEUE_SIZE` commands; when the queue is full, the
+# `EXECUTOR_POLICY` is "drop" (the new command), "oldest" (drop the oldest
+# queued command) or "block" (wait for room in the queue.)
+EXECUTOR_WORKERS = 4
+EXECUTOR_QUEUE_SIZE = 1000
+EXECUTOR_POLICY = "drop"
+EXECUTOR_TIMEOUT = None  # seconds; see `PushoverCommandExecutor`
+
+# message priorities, highest first; see https://pushover.net/api#priority.
+# Emergency messages are retried by the server until acknowledged.
+PRIORITY_EMERGENCY = 2
+PRIORITY_HIGH = 1
+MESSAGE_PRIORITIES = (2, 1, 0, -1, -2)
+
+# queued commands run in priority order; `EXECUTOR_RESERVED_WORKERS` more
+# workers only run commands of messages with priority of at least
+# `EXECUTOR_RESERVED_PRIORITY`, so that a flood of lower priority messages
+# doesn't hold them up.
+EXECUTOR_RESERVED_WORKERS = 1
+EXECUTOR_RESERVED_PRIORITY = PRIORITY_HIGH
+
+# downloaded messages are acknowledged (deleted from the server) at most once
+# every `ACK_INTERVAL` seconds, or after `ACK_MAX_DOWNLOADS` downloads.
+ACK_INTERVAL = 5.0  # seconds
+ACK_MAX_DOWNLOADS = 10
+
+# after a network error, the websocket is reconnected after a random delay of
+# up to `RECONNECT_BACKOFF_INITIAL` seconds, multiplied by
+# `RECONNECT_BACKOFF_FACTOR` on each failed attempt, up to
+# `RECONNECT_BACKOFF_MAX`. Reload requests (`R` frames) reconnect at once.
+RECONNECT_BACKOFF_INITIAL = 1.0  # seconds
+RECONNECT_BACKOFF_FACTOR = 2.0
+RECONNECT_BACKOFF_MAX = 300.0  # seconds
+
+# the server sends a keep-alive (`#`) frame every few dozen seconds; a
+# connection with no frame for `KEEP_ALIVE_TIMEOUT` seconds is considered
+# stalled (for example, half-open) and is reconnected.
+KEEP_ALIVE_TIMEOUT = 90.0  # seconds
+WATCHDOG_CHECK_INTERVAL = 5.0  # seconds
+
+SUPERVISOR_RESTART_DELAY = 5  # seconds before reconnecting a device
+
+# upper bounds of the buckets of timing histograms; see `PushoverMetrics`.
+METRICS_TIMING_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                          5.0, 10.0)  # seconds
+METRICS_EXPORT_INTERVAL = 15.0  # seconds
+
+STATSD_HOST = "127.0.0.1"
+STATSD_PORT = 8125
+
 PUSHOVER_WEBSOCKET_SERVER_MESSAGES_MEANING = {
     b'#': "Keep-alive packet, no response needed.",
     b'!': "A new message has arrived; you should perform a sync.",
@@ -35,452 +176,6516 @@ PUSHOVER_WEBSOCKET_SERVER_MESSAGES_MEANING = {
           "session is being closed. Do not automatically re-connect."
 }
 
+logger = logging.getLogger(__name__)
+
 COMMAND_FUNCTIONS_REGISTRY = {}
 PARSING_FUNCTIONS_REGISTRY = {}
 
 def generate_new_device_name():
     # device name is up to 25 chars, [A-Za-z0-9_-]
 
+    import datetime
+
     now = datetime.datetime.now()
     current_time = now.strftime("%Y%m%d_%H%M%S")
     new_device_name = "python-{current_time}".format(current_time=current_time)
 
     return new_device_name
 
-def print_data_errors(errors):
+def print_data_errors(errors, file=None):
     # errors can be a list or a dict
     if isinstance(errors, list):
-        for error in errors: print(error)
+        for error in errors: print(error, file=file)
     elif isinstance(errors, dict):
         for key, error_list in errors.items():
             for error in error_list:
-                print("ERROR:", key, "-", error)
+                print("ERROR:", key, "-", error, file=file)
     else:  # this doesn't ever happen, only list or dict, but I'm unsure.
-        print("ERROR:", errors)
+        print("ERROR:", errors, file=file)
 
-def register_command(f, *args, **kwargs):
-    """Decorator who register command functions.
+def get_default_http_retry():
+    """
+    Returns the default retry policy for requests to the API.
 
-    Commands execute user-defined functions. The name of the function is the
-    command, ie., the first word of the received notification; the other words
-    of the notification are the parameters.
+    Only idempotent methods are retried after the request was sent, so that,
+    for example, a device is never registered twice; failed connection
+    attempts are retried for every method, since nothing was sent yet.
     """
-    pass
 
-def register_parser(f, *args, **kwargs):
-    """Decorator who register perser functions.
+    import urllib3.util.retry
 
-    Parser functions receive raw data received from each notification from the
-    pushover server, and parses it."""
-    pass
+    retry = urllib3.util.retry.Retry(
+        total=HTTP_RETRY_TOTAL,
+        backoff_factor=HTTP_RETRY_BACKOFF_FACTOR,
+        status_forcelist=HTTP_RETRY_STATUS_FORCELIST,
+        raise_on_status=False  # we want the response to read API's errors
+    )
 
-class PushoverOpenClient:
+    return retry
 
-    credentials_filename = CREDENTIALS_FILENAME
+def create_aiohttp_session(pool_connections=HTTP_POOL_CONNECTIONS,
+                           pool_maxsize=HTTP_POOL_MAXSIZE):
+    """
+    Creates a connection-pooled `aiohttp.ClientSession` for
+    `AsyncPushoverOpenClient`; it must be called from inside a running event
+    loop. Needs the `aiohttp` package.
+    """
 
-    email = str()
-    password = str()
-    device_id = str()
-    secret = str()
+    import aiohttp
 
-    twofa: str = None  # two-factor authentication
+    connector = aiohttp.TCPConnector(limit=pool_connections * pool_maxsize,
+                                     limit_per_host=pool_maxsize)
 
-    needs_twofa = False
+    return aiohttp.ClientSession(connector=connector)
 
-    messages = dict()  # { message_id: {message_dict...}, }
+def _get_timed_connection_pool_class(connection_pool_class, stats):
+    # urllib3 creates the connections from the pool's `ConnectionCls`, so we
+    # subclass both to time the connection setup (TCP + TLS handshake.)
 
-    login_response = None  # requests.Response
-    login_response_data = dict()
-    login_errors = None
+    connection_class = connection_pool_class.ConnectionCls
 
-    device_registration_response = None  # requests.Response
-    device_registration_response_data = dict()
-    device_registration_errors = None
+    class TimedConnection(connection_class):
 
+        def connect(self):
+            start_time = time.perf_counter()
+            super().connect()
+            stats.record_connection(time.perf_counter() - start_time)
 
-    message_downloading_response = None  # requests.Response
-    message_downloading_response_data = dict()
-    message_downloading_errors = None
+    class TimedConnectionPool(connection_pool_class):
+        ConnectionCls = TimedConnection
 
-    update_highest_message_response = None  # requests.Response
-    update_highest_message_response_data = dict()
-    update_highest_message_errors = None
+    return TimedConnectionPool
 
-    def __init__(self):
-        #self.load_from_credentials_file()
-        pass
+def register_command(f=None, *, name=None, aliases=()):
+    """Decorator who register command functions.
 
-    def load_from_credentials_file(self, file_path=CREDENTIALS_FILENAME):
+    Commands execute user-defined functions. The name of the function is the
+    command, ie., the first word of the received notification; the other words
+    of the notification are the parameters.
 
-        if not os.path.isfile(file_path):
-            raise Exception("Credentials file '{credentials_file_path}'"
-                            " not found. Please create."\
-                            .format(credentials_file_path=file_path))
+    Can be used as `@register_command`, or as
+    `@register_command(name="...", aliases=("...",))` to choose the command
+    name and its aliases. Commands are matched case-insensitively. Parameters
+    annotated with `int`, `float` or `bool` are converted; a keyword-only
+    parameter named `message` receives the whole message.
+    """
 
-        with open(file_path, "r") as credentials_file:
-            credentials = json.load(credentials_file)
+    def decorator(f):
+        command = PushoverCommand(f, name=name, aliases=aliases)
 
-        self.credentials_filename = file_path
+        for command_name in (command.name,) + command.aliases:
+            COMMAND_FUNCTIONS_REGISTRY.update({command_name: command})
 
-        self.email = credentials["email"]
-        self.password = credentials["password"]
+        return f
 
-        if "client_id" in credentials.keys():
-            self.client_id = credentials["client_id"]
+    if f is None:
+        return decorator
 
-        if "secret" in credentials.keys():
-            self.client_id = credentials["secret"]
+    return decorator(f)
 
-        return self
+def register_parser(f=None, *, name=None, order=0):
+    """Decorator who register parser functions.
 
-    def login(self, email=None, password=None, twofa=None,
-              rewrite_creds_file=True):
-        """
-        Logs in with email and password, achieving a `secret` from the API.
+    Parser functions receive raw data received from each notification from the
+    pushover server, and parses it.
 
-        As specified in https://pushover.net/api/client#login
-        """
+    Each parser is a stage of `PushoverParserPipeline`: a generator function
+    which receives an iterable of message dicts and yields the messages for
+    the next stage, changed or not. A message which is not yielded is dropped;
+    returning stops the pipeline for the rest of the batch. Stages run by
+    ascending `order`, then by registration.
+    """
 
-        if not email:
-            email = self.email
+    def decorator(f):
+        parser = PushoverParser(f, name=name, order=order)
 
-        if not password:
-            password = self.password
+        PARSING_FUNCTIONS_REGISTRY.update({parser.name: parser})
 
-        if self.needs_twofa:
-            if not twofa and not self.twofa:
-                return False
-            if twofa: twofa = twofa
-            elif self.needs_twofa: twofa = self.twofa
+        return f
 
-        self.login_response = None
-        self.login_response_data = None
-        self.login_errors = None
+    if f is None:
+        return decorator
 
-        login_payload = self._get_login_payload(email=email, password=password,
-                                                twofa=twofa)
+    return decorator(f)
 
-        login_response = requests.post(ENDPOINT_LOGIN, data=login_payload)
-        login_response_dict = json.loads(login_response.text)
+URL_REGEX = re.compile(r"https?://[^\s<>\"']+")
 
-        self.login_response = login_response
-        self.login_response_data = login_response_dict
+@functools.lru_cache(maxsize=None)
+def _get_html_text_extractor_class():
+    import html.parser
 
-        # If this `self.login()` method fails and `self.needs_twofa` is True,
-        # the implementor should ask the user for the 2-factor auth code,
-        # set it in `self.twofa`, and run this method again.
-        if login_response.status_code == 412:
-            self.needs_twofa = True
-            return None
-        else:
-            self.needs_twofa = False
+    class _HTMLTextExtractor(html.parser.HTMLParser):
 
-        if not login_response_dict["status"] == 1:
-            self.login_errors = login_response_dict["errors"]
-            return None
+        def __init__(self):
+            super().__init__(convert_charrefs=True)
+            self.parts = list()
 
-        # else...
-        self.secret = login_response_dict["secret"]
+        def handle_data(self, data):
+            self.parts.append(data)
 
-        if rewrite_creds_file:
-            self.write_credentials_file()
+    return _HTMLTextExtractor
 
-        return self.secret
+def parse_json_stage(messages):
+    """Parser stage: message text which is a JSON object goes to `json`."""
 
-    def set_twofa(self, twofa):
-        """
-        Sets the code for two-factor authentication,
-        if the user has it enabled. After this, `self.login()` should be
-        executed again.
-        """
-        self.twofa = twofa
+    for message in messages:
+        text = message.get("message") or ""
 
-    def register_device(self, device_name=None,
-                        secret=None, rewrite_creds_file=True):
-        """
-        Registers a new client device on the Pushover account.
+        if text.startswith("{"):
+            try:
+                message["json"] = json.loads(text)
+            except ValueError:
+                pass
 
-        As specified in https://pushover.net/api/client#register
-        """
+        yield message
 
-        if not device_name:
-            device_name = generate_new_device_name()
+def strip_html_stage(messages):
+    """Parser stage: the text of HTML messages, without tags, goes to `text`."""
 
-        if not secret:
-            secret = self.secret
+    html_text_extractor_class = None
 
-        self.device_registration_response = None
-        self.device_registration_response_data = None
-        self.device_registration_errors = None
+    for message in messages:
+        if message.get("html"):
+            if html_text_extractor_class is None:
+                html_text_extractor_class = _get_html_text_extractor_class()
 
-        device_registration_payload =\
-            self._get_device_registration_payload(device_name=device_name,
-                                                  secret=secret)
-        device_registration_response =\
-            requests.post(ENDPOINT_DEVICES, data=device_registration_payload)
+            extractor = html_text_extractor_class()
+            extractor.feed(message.get("message") or "")
+            extractor.close()
+            message["text"] = "".join(extractor.parts)
 
-        device_registration_response_dict =\
-            json.loads(device_registration_response.text)
+        yield message
 
-        self.device_registration_response = device_registration_response
-        self.device_registration_response_data =\
-                 device_registration_response_dict
+def extract_urls_stage(messages):
+    """Parser stage: URLs in the message (and its `url`) go to `urls`."""
 
-        if not device_registration_response_dict["status"] == 1:
-            self.device_registration_errors =\
-                device_registration_response_dict["errors"]
-            return None
+    for message in messages:
+        urls = URL_REGEX.findall(message.get("message") or "")
 
-        # else...
-        self.device_id = device_registration_response_dict["id"]
+        if message.get("url"):
+            urls.insert(0, message["url"])
 
-        if rewrite_creds_file:
-            self.write_credentials_file()
+        message["urls"] = urls
 
-        return self.device_id
+        yield message
 
-    def download_messages(self, secret=None, device_id=None):
-        """
-        Downloads all messages currently on this device.
+def get_priority_filter_stage(minimum_priority):
+    """Returns a parser stage dropping messages below `minimum_priority`."""
 
-        As specified in https://pushover.net/api/client#download
-        """
+    def priority_filter_stage(messages):
+        for message in messages:
+            if (message.get("priority") or 0) >= minimum_priority:
+                yield message
 
-        if not secret:
-            secret = self.secret
+    return priority_filter_stage
 
-        if not device_id:
-            device_id = self.device_id
+def get_routing_stage(handler, app=None, title=None, consume=True):
+    """
+    Returns a parser stage calling `handler(message)` for messages from `app`
+    and/or with `title`; with `consume`, those are not passed on.
+    """
 
-        self.message_downloading_response = None
-        self.message_downloading_response_data = None
-        self.message_downloading_errors = None
+    def routing_stage(messages):
+        for message in messages:
+            if (app is None or message.get("app") == app) and \
+                    (title is None or message.get("title") == title):
+                handler(message)
 
-        message_downloading_params =\
-            self._get_message_downloading_params(secret=secret,
-                                                 device_id=device_id)
-        message_downloading_response =\
-            requests.get(ENDPOINT_MESSAGES, params=message_downloading_params)
+                if consume:
+                    continue
 
-        message_downloading_dict =\
-            json.loads(message_downloading_response.text)
+            yield message
 
-        self.message_downloading_response = message_downloading_response
-        self.message_downloading_response_data = message_downloading_dict
+    return routing_stage
 
-        if not message_downloading_dict["status"] == 1:
-            self.message_downloading_errors =\
-                message_downloading_dict["errors"]
-            return False
+class PushoverHistogram:
+    """Counts of observed values in buckets with the given upper bounds."""
 
-        messages = message_downloading_dict["messages"]
+    def __init__(self, buckets=METRICS_TIMING_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
 
-        # else...
-        for message in messages:
-            message_id = message["id"]
-            self.messages.update({message_id: message})
+        # the last count is for values above the highest bound.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
 
-        return messages
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
 
-    def delete_all_messages(self, device_id=None, secret=None,
-                            last_message_id=None):
-        """
-        Deletes all messages for this device. If not deleted, tey keep
-        being downloaded again.
-        
-        As specified in https://pushover.net/api/client#delete
-        """
+    def get_cumulative_counts(self):
+        """Returns `[(upper_bound, count of values <= upper_bound), ...]`."""
 
-        if not device_id:
-            device_id = self.device_id
+        cumulative_counts = list()
+        cumulative_count = 0
 
-        if not secret:
-            secret = self.secret
+        for upper_bound, count in zip(self.buckets + (float("inf"),),
+                                      self.counts):
+            cumulative_count += count
+            cumulative_counts.append((upper_bound, cumulative_count))
 
-        if not last_message_id:
-            last_message_id = self.get_highest_message_id(redownload=False)
+        return cumulative_counts
 
-        self.update_highest_message_response = None
-        self.update_highest_message_response_data = None
-        self.update_highest_message_errors = None
+    def as_dict(self):
+        histogram_dict = {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": self.get_cumulative_counts()
+        }
 
-        delete_messages_payload =\
-            self._get_delete_messages_payload(secret=secret,
-                                              message=last_message_id)
+        return histogram_dict
 
-        update_highest_message_endpoint =\
-            ENDPOINT_UPDATE_HIGHEST_MESSAGE.format(api_url=PUSHOVER_API_URL,
-                                                   device_id=self.device_id)
+class PushoverMetrics:
+    """
+    Timing histograms and counters recorded by the clients, plus gauges
+    read from them only when exported, and the exporters they are sent to.
 
-        update_highest_message_response =\
-            requests.post(update_highest_message_endpoint,
-                          data=delete_messages_payload)
+    Pass the same instance as `metrics` to `PushoverOpenClient` and
+    `PushoverOpenClientRealTime`; without it, nothing is recorded. Frame
+    counts, queue depths and reconnections are kept by the clients anyway,
+    so they are collected at export time and cost nothing on the hot path.
 
-        update_highest_message_dict =\
-            json.loads(update_highest_message_response.text)
+    Exporters get each timing and counter as it is recorded, and the
+    collected values on `export()`, which `start()` runs every `interval`
+    seconds in a background thread.
+    """
 
-        self.update_highest_message_response = update_highest_message_response
-        self.update_highest_message_data = update_highest_message_dict
+    def __init__(self, exporters=None, buckets=METRICS_TIMING_BUCKETS):
+        self.exporters = list(exporters or [])
+        self.buckets = buckets
 
-        if not update_highest_message_dict["status"] == 1:
-            self.update_highest_message_errors =\
-                update_highest_message_dict["errors"]
-            return False
+        self.lock = threading.Lock()
 
-        # else...
-        return True
+        # keyed by `(name, ((label, value), ...))`
+        self.counters = collections.Counter()
+        self.histograms = dict()
 
-    def get_highest_message_id(self, redownload=False):
+        self.collectors = list()  # functions returning `[(name, labels,
+                                  # value), ...]`
 
-        if redownload:
-            self.download_messages()
+        self.stop_event = threading.Event()
+        self.thread = None
 
-        if not self.messages:
-            return False
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
 
-        highest_message_id = max(self.messages.keys())
+    def add_collector(self, collector):
+        self.collectors.append(collector)
 
-        self.highest_message_id = highest_message_id
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
 
-        return self.highest_message_id
+        with self.lock:
+            self.counters[key] += value
 
-    def write_credentials_file(self, file_path=None):
+        self._emit("counter", name, value, labels)
 
-        if not file_path:
-            file_path = self.credentials_filename
+    def observe(self, name, value, **labels):
+        """Records `value` (in seconds, for timings) in a histogram."""
 
-        credentials = self._get_credentials_dict()
+        key = (name, tuple(sorted(labels.items())))
 
-        with open(file_path, "w") as credentials_file:
-            json.dump(credentials, credentials_file, indent=2)
+        with self.lock:
+            histogram = self.histograms.get(key)
 
-    def get_websocket_login_string(self):
-        websocket_login_string = PUSHOVER_WEBSOCKET_LOGIN \
-            .format(device_id=self.device_id, secret=self.secret)
-        return websocket_login_string
+            if histogram is None:
+                histogram = PushoverHistogram(buckets=self.buckets)
+                self.histograms[key] = histogram
 
-    def set_twofa(self, twofa):
-        self.twofa = twofa
+            histogram.observe(value)
 
-    def _get_credentials_dict(self):
-        credentials_dict = dict()
+        self._emit("timing", name, value, labels)
 
-        if self.email: credentials_dict.update({"email": self.email})
-        if self.password: credentials_dict.update({"password": self.password})
-        if self.secret: credentials_dict.update({"secret": self.secret})
-        if self.device_id: credentials_dict.update({"device_id":
-                                                        self.device_id})
+    def collect(self):
+        """Returns `[(name, labels, value), ...]` from the collectors."""
 
-        return credentials_dict
+        collected = list()
 
-    def _get_login_payload(self, email, password, twofa):
-        login_payload = {
-            "email": email,
-            "password": password
-        }
+        for collector in self.collectors:
+            try:
+                collected.extend(collector())
+            except Exception:
+                logger.exception("Error collecting metrics.")
 
-        if twofa:
-            login_payload({"twofa": twofa})
+        return collected
 
-        return login_payload
+    def export(self):
+        for exporter in self.exporters:
+            try:
+                exporter.export(self)
+            except Exception:
+                logger.exception("Error exporting metrics to %r.", exporter)
 
-    def _get_device_registration_payload(self, device_name, secret):
+    def start(self, interval=METRICS_EXPORT_INTERVAL):
+        self.stop_event.clear()
 
-        device_registration_payload = {
-            "name": device_name,
-            "os": "O",
-            "secret": secret
-        }
+        self.thread = threading.Thread(target=self._run, args=(interval,),
+                                       name="pushover-metrics-exporter",
+                                       daemon=True)
+        self.thread.start()
 
-        return device_registration_payload
+    def stop(self):
+        self.stop_event.set()
 
-    def _get_message_downloading_params(self, secret, device_id):
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
 
-        message_downloading_params = {
-            "secret": secret,
-            "device_id": device_id
-        }
+        self.export()
 
-        return message_downloading_params
+    def as_dict(self):
+        """
+        Returns `{ "counters": { name: [(labels, value), ...] }, "histograms":
+        { name: [(labels, histogram_dict), ...] }, "gauges": { name:
+        [(labels, value), ...] } }`.
+        """
 
-    def _get_delete_messages_payload(self, message, secret):
+        metrics_dict = {"counters": dict(), "histograms": dict(),
+                        "gauges": dict()}
 
-        delete_messages_payload = {
-            "message": message,
-            "secret": secret
-        }
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                metrics_dict["counters"].setdefault(name, list())\
+                    .append((dict(labels), value))
 
-        return delete_messages_payload
+            for (name, labels), histogram in self.histograms.items():
+                metrics_dict["histograms"].setdefault(name, list())\
+                    .append((dict(labels), histogram.as_dict()))
 
-class PushoverOpenClientRealTime:
+        for name, labels, value in self.collect():
+            metrics_dict["gauges"].setdefault(name, list())\
+                .append((labels, value))
 
-    pushover_websocket_server_commands = dict()
+        return metrics_dict
 
-    def __init__(self, pushover_open_client=None,
-                 pushover_websocket_server_url=PUSHOVER_WEBSOCKET_SERVER_URL):
+    def _emit(self, kind, name, value, labels):
+        for exporter in self.exporters:
+            try:
+                exporter.record(kind, name, value, labels)
+            except Exception:
+                logger.exception("Error exporting metrics to %r.", exporter)
 
-        if not pushover_open_client:
-            pushover_open_client =\
-                PushoverOpenClient().load_from_credentials_file()
-        self.pushover_open_client = pushover_open_client
+    def _run(self, interval):
+        while not self.stop_event.wait(interval):
+            self.export()
 
-        self.pushover_websocket_server_commands =\
-        {
-            b'#': self.message_keep_alive,
-            b'!': self.message_do_sync,
+class PushoverMetricsExporter:
+    """
+    Base class of the exporters of `PushoverMetrics`. `record()` is called
+    for each timing and counter increment, and `export()` periodically; by
+    default, `export()` records each collected value as a "gauge".
+    """
+
+    def record(self, kind, name, value, labels):
+        pass
+
+    def export(self, metrics):
+        for name, labels, value in metrics.collect():
+            self.record("gauge", name, value, labels)
+
+class PushoverCallbackExporter(PushoverMetricsExporter):
+    """
+    Calls `function(kind, name, value, labels)` for each metric, in the
+    thread which recorded it; `kind` is "timing", "counter" or "gauge".
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def record(self, kind, name, value, labels):
+        self.function(kind, name, value, labels)
+
+class PushoverStatsDExporter(PushoverMetricsExporter):
+    """
+    Sends metrics to a StatsD server over UDP, named `prefix.name.label...`
+    (with the label values); timings are sent in milliseconds.
+    """
+
+    STATSD_TYPES = {"timing": "ms", "counter": "c", "gauge": "g"}
+
+    def __init__(self, host=STATSD_HOST, port=STATSD_PORT, prefix="pushover"):
+        self.address = (host, port)
+        self.prefix = prefix
+
+        import socket
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, kind, name, value, labels):
+        if kind == "timing":
+            value = round(value * 1000, 3)
+
+        if name.startswith("pushover_"):
+            name = name[len("pushover_"):]
+
+        statsd_name = ".".join([self.prefix, name] +
+                               [re.sub(r"[^\w-]", "_", str(label_value))
+                                for label_value in labels.values()])
+
+        statsd_line = "{statsd_name}:{value}|{statsd_type}".format(
+            statsd_name=statsd_name, value=value,
+            statsd_type=self.STATSD_TYPES[kind])
+
+        try:
+            self.socket.sendto(statsd_line.encode(), self.address)
+        except OSError:  # nobody listening; metrics are best effort
+            pass
+
+    def close(self):
+        self.socket.close()
+
+class PushoverPrometheusFileExporter(PushoverMetricsExporter):
+    """
+    Writes all metrics, in the Prometheus text format, to `file_path` on each
+    export; for example, for node_exporter's textfile collector. The file is
+    replaced atomically, so it is never read half-written.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def export(self, metrics):
+        temporary_file_path = "{file_path}.tmp".format(
+            file_path=self.file_path)
+
+        with open(temporary_file_path, "w") as prometheus_file:
+            prometheus_file.write(self.render(metrics))
+
+        os.replace(temporary_file_path, self.file_path)
+
+    def render(self, metrics):
+        metrics_dict = metrics.as_dict()
+        lines = list()
+
+        for name, samples in sorted(metrics_dict["counters"].items()):
+            lines.append("# TYPE {name} counter".format(name=name))
+
+            for labels, value in samples:
+                lines.append(self._format_sample(name, labels, value))
+
+        for name, samples in sorted(metrics_dict["histograms"].items()):
+            lines.append("# TYPE {name} histogram".format(name=name))
+
+            for labels, histogram_dict in samples:
+                for upper_bound, count in histogram_dict["buckets"]:
+                    if upper_bound == float("inf"):
+                        upper_bound = "+Inf"
+
+                    bucket_labels = dict(labels, le=str(upper_bound))
+                    lines.append(self._format_sample(name + "_bucket",
+                                                     bucket_labels, count))
+
+                lines.append(self._format_sample(name + "_sum", labels,
+                                                 histogram_dict["sum"]))
+                lines.append(self._format_sample(name + "_count", labels,
+                                                 histogram_dict["count"]))
+
+        for name, samples in sorted(metrics_dict["gauges"].items()):
+            # collected counters keep the Prometheus `_total` suffix
+            metric_type = "counter" if name.endswith("_total") else "gauge"
+            lines.append("# TYPE {name} {metric_type}".format(
+                name=name, metric_type=metric_type))
+
+            for labels, value in samples:
+                lines.append(self._format_sample(name, labels, value))
+
+        return "\n".join(lines) + "\n"
+
+    def _format_sample(self, name, labels, value):
+        if not labels:
+            return "{name} {value}".format(name=name, value=value)
+
+        formatted_labels = ",".join(
+            '{label}="{label_value}"'.format(
+                label=label,
+                label_value=str(label_value).replace("\\", "\\\\")
+                    .replace('"', '\\"').replace("\n", "\\n"))
+            for label, label_value in labels.items())
+
+        return "{name}{{{formatted_labels}}} {value}".format(
+            name=name, formatted_labels=formatted_labels, value=value)
+
+class PushoverConnectionStats:
+    """
+    Counters of HTTP requests and of new connections made to the API.
+
+    `reuse_rate` is the fraction of requests which were sent through an
+    already open connection.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.requests = 0
+        self.connections = 0
+        self.handshake_time_total = 0.0  # seconds
+        self.handshake_time_max = 0.0  # seconds
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def record_connection(self, handshake_time):
+        with self.lock:
+            self.connections += 1
+            self.handshake_time_total += handshake_time
+            self.handshake_time_max = max(self.handshake_time_max,
+                                          handshake_time)
+
+    @property
+    def reuse_rate(self):
+        if not self.requests:
+            return 0.0
+
+        reused = max(self.requests - self.connections, 0)
+
+        return reused / self.requests
+
+    @property
+    def handshake_time_average(self):
+        if not self.connections:
+            return 0.0
+
+        return self.handshake_time_total / self.connections
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.connections = 0
+            self.handshake_time_total = 0.0
+            self.handshake_time_max = 0.0
+
+    def as_dict(self):
+        stats_dict = {
+            "requests": self.requests,
+            "connections": self.connections,
+            "reuse_rate": self.reuse_rate,
+            "handshake_time_average": self.handshake_time_average,
+            "handshake_time_max": self.handshake_time_max
+        }
+
+        return stats_dict
+
+@functools.lru_cache(maxsize=None)
+def _get_http_classes():
+    # `PushoverHTTPAdapter` and `PushoverHTTPSession` subclass `requests`
+    # classes, so they are created (and `requests` imported) on first use;
+    # the module's `__getattr__()` gives them by name.
+
+    import requests
+    import requests.adapters
+
+    class PushoverHTTPAdapter(requests.adapters.HTTPAdapter):
+        """
+        `HTTPAdapter` which records requests and connection handshakes into a
+        `PushoverConnectionStats`.
+        """
+
+        __attrs__ = requests.adapters.HTTPAdapter.__attrs__ + ["stats"]
+
+        def __init__(self, stats=None, **kwargs):
+            if stats is None:
+                stats = PushoverConnectionStats()
+            self.stats = stats
+
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+
+            pool_classes_by_scheme = dict()
+
+            for scheme, connection_pool_class in \
+                    self.poolmanager.pool_classes_by_scheme.items():
+                timed_connection_pool_class =\
+                    _get_timed_connection_pool_class(connection_pool_class,
+                                                     stats=self.stats)
+                pool_classes_by_scheme.update({scheme:
+                                                   timed_connection_pool_class})
+
+            self.poolmanager.pool_classes_by_scheme = pool_classes_by_scheme
+
+        def send(self, request, *args, **kwargs):
+            self.stats.record_request()
+            return super().send(request, *args, **kwargs)
+
+    class PushoverHTTPSession(requests.Session):
+        """
+        Connection-pooled HTTP session to talk with the Pushover API.
+
+        Connections are kept alive and reused between calls; `timeouts` maps
+        endpoint names (see `HTTP_TIMEOUTS`) to `(connect, read)` timeouts, and
+        `max_retries` is an `urllib3.util.retry.Retry` or a number of retries.
+
+        The session can be shared between many `PushoverOpenClient` instances.
+        """
+
+        def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS,
+                     pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=None,
+                     timeouts=None):
+
+            super().__init__()
+
+            if max_retries is None:
+                max_retries = get_default_http_retry()
+
+            self.timeouts = dict(HTTP_TIMEOUTS)
+
+            if timeouts:
+                self.timeouts.update(timeouts)
+
+            self.stats = PushoverConnectionStats()
+
+            self.adapter = PushoverHTTPAdapter(
+                stats=self.stats, pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize, max_retries=max_retries)
+
+            self.mount("https://", self.adapter)
+            self.mount("http://", self.adapter)
+
+        def get_timeout(self, endpoint_name):
+            return self.timeouts.get(endpoint_name, HTTP_DEFAULT_TIMEOUT)
+
+    http_classes = {"PushoverHTTPAdapter": PushoverHTTPAdapter,
+                    "PushoverHTTPSession": PushoverHTTPSession}
+
+    for class_name, http_class in http_classes.items():
+        http_class.__qualname__ = class_name  # so that they can be pickled
+
+    return http_classes
+
+def __getattr__(name):
+    if name in ("PushoverHTTPAdapter", "PushoverHTTPSession"):
+        return _get_http_classes()[name]
+
+    raise AttributeError("module {module_name!r} has no attribute {name!r}"
+                         .format(module_name=__name__, name=name))
+
+class PushoverMessage:
+    """
+    Compact record of a message downloaded from the API.
+
+    The fields described by https://pushover.net/api/client#download are
+    kept in slots; unknown fields, if any, are kept in `extra`.
+    """
+
+    FIELDS = ("id", "id_str", "umid", "umid_str", "title", "message", "app",
+              "aid", "aid_str", "icon", "date", "queued_date",
+              "dispatched_date", "priority", "sound", "url", "url_title",
+              "acked", "receipt", "html")
+
+    # types of the fields, used to validate downloaded messages; see
+    # `PushoverJSONDecoder.decode_messages()`.
+    FIELD_TYPES = {
+        "id": int, "id_str": str, "umid": int, "umid_str": str,
+        "title": str, "message": str, "app": str, "aid": int, "aid_str": str,
+        "icon": str, "date": int, "queued_date": int, "dispatched_date": int,
+        "priority": int, "sound": str, "url": str, "url_title": str,
+        "acked": int, "receipt": str, "html": int
+    }
+
+    __slots__ = FIELDS + ("extra", "received_time")
+
+    FIELD_SET = frozenset(FIELDS)
+
+    def __init__(self, **fields):
+        self.extra = None
+        self.received_time = time.monotonic()
+
+        for field in self.FIELDS:
+            setattr(self, field, fields.pop(field, None))
+
+        if fields:
+            self.extra = fields
+
+    @classmethod
+    def from_dict(cls, message_dict):
+        # as `cls(**message_dict)`, without copying the dict; every
+        # downloaded message goes through here.
+
+        message = cls.__new__(cls)
+        message.received_time = time.monotonic()
+
+        get = message_dict.get
+
+        for field in cls.FIELDS:
+            setattr(message, field, get(field))
+
+        if message_dict.keys() <= cls.FIELD_SET:
+            message.extra = None
+        else:
+            message.extra = {field: value
+                             for field, value in message_dict.items()
+                             if field not in cls.FIELD_SET}
+
+        return message
+
+    def to_dict(self):
+        message_dict = {field: getattr(self, field) for field in self.FIELDS
+                        if getattr(self, field) is not None}
+
+        if self.extra:
+            message_dict.update(self.extra)
+
+        return message_dict
+
+    def __getitem__(self, key):
+        # lets records be read like the dicts they were made from.
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        elif self.extra and key in self.extra:
+            return self.extra[key]
+
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return "PushoverMessage({message_dict!r})"\
+            .format(message_dict=self.to_dict())
+
+class PushoverDecodeError(Exception):
+    """A response from the API could not be decoded or validated."""
+
+class PushoverJSONDecoder:
+    """
+    Decodes API responses straight from the response body's bytes, with the
+    fastest backend installed (see `JSON_DECODER_BACKENDS`), or with the
+    given `backend`.
+
+    `decode_messages()` decodes a messages response into validated
+    `PushoverMessage` records, unknown fields included. Validating and
+    building the records costs several times the decoding itself, so it is
+    meant for callers who want the messages checked; `decode()` is the fast
+    path.
+    """
+
+    def __init__(self, backend=None):
+
+        if backend is None:
+            backend = next(backend for backend in JSON_DECODER_BACKENDS
+                           if self.is_available(backend))
+
+        if backend not in JSON_DECODER_BACKENDS:
+            raise ValueError("Unknown JSON backend '{backend}'; should be one "
+                             "of {backends}."
+                             .format(backend=backend,
+                                     backends=JSON_DECODER_BACKENDS))
+
+        self.backend = backend
+        self.decode = self._get_decode_function(backend)
+
+    @staticmethod
+    def is_available(backend):
+        if backend == "json":
+            return True
+
+        return importlib.util.find_spec(backend) is not None
+
+    @staticmethod
+    def _get_decode_function(backend):
+        if backend == "orjson":
+            import orjson
+            return orjson.loads
+
+        if backend == "msgspec":
+            import msgspec
+            return msgspec.json.Decoder().decode
+
+        # `json.loads()` detects the encoding of bytes by itself
+        return json.loads
+
+    def decode_messages(self, data):
+        """
+        Decodes the body of a messages.json response into a list of
+        `PushoverMessage`; raises `PushoverDecodeError` if the response is an
+        error or the messages don't have the expected types.
+        """
+
+        try:
+            response_dict = self.decode(data)
+        except ValueError as exception:
+            raise PushoverDecodeError(str(exception)) from exception
+
+        if not isinstance(response_dict, dict) or \
+                response_dict.get("status") != 1:
+            raise PushoverDecodeError("Error response: {response!r}"
+                                      .format(response=response_dict))
+
+        messages = response_dict.get("messages", [])
+
+        for message in messages:
+            self._validate_message(message)
+
+        return [PushoverMessage.from_dict(message) for message in messages]
+
+    @staticmethod
+    def _validate_message(message):
+        if not isinstance(message, dict) or \
+                not isinstance(message.get("id"), int):
+            raise PushoverDecodeError("Invalid message: {message!r}"
+                                      .format(message=message))
+
+        field_types = PushoverMessage.FIELD_TYPES
+
+        for field, value in message.items():
+            field_type = field_types.get(field)
+
+            # `type() is` spares the `isinstance()` call for most values.
+            if field_type is not None and value is not None and \
+                    type(value) is not field_type and \
+                    not isinstance(value, field_type):
+                raise PushoverDecodeError("Invalid '{field}' in message "
+                                          "{message_id}: {value!r}"
+                                          .format(field=field,
+                                                  message_id=message["id"],
+                                                  value=value))
+
+class PushoverMessagesStreamParser:
+    """
+    Incremental parser of a messages.json response body.
+
+    `feed()` takes the body's bytes as they arrive and yields each message
+    dict as soon as it is complete; `close()` returns the rest of the
+    response (status, errors, etc.) with an empty `messages` list.
+    """
+
+    MESSAGES_ARRAY_REGEX = re.compile(r'"messages"\s*:\s*\[')
+
+    SEPARATORS = " \t\r\n,"
+
+    def __init__(self):
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+
+        self.state = "header"  # "header", "messages" or "trailer"
+        self.buffer = str()
+
+        self.header = str()  # text before the messages array
+        self.trailer = str()  # text after the messages array
+
+    def feed(self, data):
+        self.buffer += self.text_decoder.decode(data)
+
+        if self.state == "header":
+            match = self.MESSAGES_ARRAY_REGEX.search(self.buffer)
+
+            if not match:
+                return
+
+            self.header = self.buffer[:match.start()]
+            self.buffer = self.buffer[match.end():]
+            self.state = "messages"
+
+        if self.state == "messages":
+            yield from self._parse_messages()
+
+        if self.state == "trailer":
+            self.trailer += self.buffer
+            self.buffer = str()
+
+    def close(self):
+        self.buffer += self.text_decoder.decode(b"", final=True)
+
+        try:
+            if self.state == "header":  # no messages: an error response
+                return json.loads(self.buffer)
+
+            if self.state == "messages":
+                raise PushoverDecodeError("Messages response was truncated.")
+
+            return json.loads(self.header + '"messages":[]' + self.trailer)
+
+        except ValueError as exception:
+            raise PushoverDecodeError(str(exception)) from exception
+
+    def _parse_messages(self):
+        buffer = self.buffer
+        position = 0
+
+        while True:
+            while position < len(buffer) and buffer[position] in \
+                    self.SEPARATORS:
+                position += 1
+
+            if position == len(buffer):
+                break
+
+            if buffer[position] == "]":
+                self.state = "trailer"
+                position += 1
+                break
+
+            try:
+                message, position =\
+                    self.json_decoder.raw_decode(buffer, position)
+            except ValueError:  # the message is not complete yet
+                break
+
+            yield message
+
+        self.buffer = buffer[position:]
+
+class PushoverMessageStore:
+    """
+    Bounded in-memory store of messages, `{ message_id: PushoverMessage }`.
+
+    Keeps at most `capacity` messages, evicting the oldest stored first, and,
+    if `ttl` is set, drops messages stored more than `ttl` seconds ago. Can be
+    used as the dict it replaces: `update()`, `clear()`, `keys()`, `len()`,
+    `in`, etc.
+    """
+
+    def __init__(self, capacity=MESSAGE_STORE_CAPACITY, ttl=MESSAGE_STORE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+
+        self.lock = threading.Lock()
+        self.messages = collections.OrderedDict()
+
+        self.highest_message_id = 0  # highest id ever stored
+        self.evictions = 0
+
+    def add(self, message):
+        """Stores a message given as a dict or as a `PushoverMessage`."""
+
+        if not isinstance(message, PushoverMessage):
+            message = PushoverMessage.from_dict(message)
+
+        with self.lock:
+            message_id = message.id
+
+            self.messages.pop(message_id, None)
+            self.messages[message_id] = message
+
+            if message_id > self.highest_message_id:
+                self.highest_message_id = message_id
+
+            self._evict()
+
+        return message
+
+    def update(self, messages):
+        for message in messages.values():
+            self.add(message)
+
+    def expire(self):
+        with self.lock:
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.messages.clear()
+
+    def get(self, message_id, default=None):
+        return self.messages.get(message_id, default)
+
+    def keys(self):
+        return self.messages.keys()
+
+    def values(self):
+        return self.messages.values()
+
+    def items(self):
+        return self.messages.items()
+
+    def __getitem__(self, message_id):
+        return self.messages[message_id]
+
+    def __contains__(self, message_id):
+        return message_id in self.messages
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __repr__(self):
+        return "PushoverMessageStore({messages!r})"\
+            .format(messages=dict(self.messages))
+
+    def _evict(self):
+        # messages are ordered by the time they were stored, so the ones to
+        # evict are always at the beginning.
+
+        messages = self.messages
+
+        while self.capacity is not None and len(messages) > self.capacity:
+            messages.popitem(last=False)
+            self.evictions += 1
+
+        if self.ttl is None:
+            return
+
+        oldest_time = time.monotonic() - self.ttl
+
+        while messages:
+            message = next(iter(messages.values()))
+
+            if message.received_time >= oldest_time:
+                break
+
+            messages.popitem(last=False)
+            self.evictions += 1
+
+class PushoverBloomFilter:
+    """
+    Set of keys in bounded memory, which may answer that a key it never got
+    is in it, with probability `error_rate` while it holds up to `capacity`
+    keys. Keys are never removed.
+    """
+
+    def __init__(self, capacity, error_rate=DEDUP_BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        # optimal number of bits and of hash functions for the error rate
+        self.size = max(8, int(-capacity * math.log(error_rate)
+                               / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0  # keys added
+
+    def _get_positions(self, key):
+        import hashlib
+
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).digest()
+
+        # double hashing: the i-th position is `first + i * second`
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+
+        return [(first + index * second) % self.size
+                for index in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self._get_positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._get_positions(key))
+
+class PushoverDedupIndex:
+    """
+    Keys of the messages already seen, so that each message is handled once,
+    however many times it is downloaded (it is, until acknowledged) or by
+    however many clients; share one index between the clients of a process
+    to deduplicate across devices.
+
+    Messages are keyed by `umid` (the same for all devices of the account),
+    or by `id`. The `capacity` most recent keys are kept exactly; with
+    `bloom_capacity`, older keys go to a `PushoverBloomFilter`, replaced by an
+    empty one (after the one before it is dropped) each time it is full, so
+    memory stays bounded.
+    """
+
+    def __init__(self, capacity=DEDUP_INDEX_CAPACITY, bloom_capacity=None,
+                 bloom_error_rate=DEDUP_BLOOM_ERROR_RATE):
+
+        self.capacity = capacity
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+
+        self.lock = threading.Lock()
+        self.recent_keys = collections.OrderedDict()  # { key: None }
+
+        # the filter being filled, and the full one before it
+        self.bloom_filter = None
+        self.previous_bloom_filter = None
+
+        if bloom_capacity:
+            self.bloom_filter = PushoverBloomFilter(
+                capacity=bloom_capacity, error_rate=bloom_error_rate)
+
+        self.duplicates = 0
+        self.bloom_duplicates = 0  # duplicates found by the Bloom filters
+
+    @staticmethod
+    def get_message_key(message):
+        umid = message.get("umid")
+
+        if umid is not None:
+            return umid
+
+        return ("id", message.get("id"))
+
+    def add(self, key):
+        """Adds a key; returns True if it was not seen before."""
+
+        with self.lock:
+            if key in self.recent_keys:
+                self.recent_keys.move_to_end(key)
+                self.duplicates += 1
+                return False
+
+            if self._in_bloom_filters(key):
+                self.duplicates += 1
+                self.bloom_duplicates += 1
+                return False
+
+            self.recent_keys[key] = None
+
+            if len(self.recent_keys) > self.capacity:
+                evicted_key, _ = self.recent_keys.popitem(last=False)
+                self._add_to_bloom_filter(evicted_key)
+
+            return True
+
+    def add_message(self, message):
+        return self.add(self.get_message_key(message))
+
+    def filter_new(self, messages):
+        """Returns the messages not seen before, which are now seen."""
+
+        return [message for message in messages if self.add_message(message)]
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.recent_keys or self._in_bloom_filters(key)
+
+    def __len__(self):
+        return len(self.recent_keys)
+
+    def _in_bloom_filters(self, key):
+        return any(key in bloom_filter
+                   for bloom_filter in (self.bloom_filter,
+                                        self.previous_bloom_filter)
+                   if bloom_filter is not None)
+
+    def _add_to_bloom_filter(self, key):
+        if self.bloom_filter is None:
+            return
+
+        if self.bloom_filter.count >= self.bloom_capacity:
+            self.previous_bloom_filter = self.bloom_filter
+            self.bloom_filter = PushoverBloomFilter(
+                capacity=self.bloom_capacity, error_rate=self.bloom_error_rate)
+
+        self.bloom_filter.add(key)
+
+    def as_dict(self):
+        stats_dict = {
+            "recent_keys": len(self.recent_keys),
+            "bloom_keys": sum(bloom_filter.count
+                              for bloom_filter in (self.bloom_filter,
+                                                   self.previous_bloom_filter)
+                              if bloom_filter is not None),
+            "duplicates": self.duplicates,
+            "bloom_duplicates": self.bloom_duplicates
+        }
+
+        return stats_dict
+
+class PushoverMessageJournal:
+    """
+    Append-only on-disk journal of downloaded messages, kept in a SQLite
+    database in WAL mode.
+
+    Each downloaded message is appended, and the id up to which messages
+    were processed and the id acknowledged to the server are recorded, so
+    that, after a restart, `resume()` returns the messages which were not
+    processed yet, and already processed messages can be skipped when
+    downloaded again.
+
+    Writes are committed in batches, to keep writes low at high message
+    rates: `commit_max_pending` appended messages, or a timer, commit them
+    at most `commit_interval` seconds after they were made. Once committed,
+    they survive a crash of the process; they are fsync'ed, and so survive
+    a crash of the system, before messages are deleted from the server (see
+    `prepare_ack()`). A crash may thus replay the messages processed in the
+    last `commit_interval` seconds.
+    """
+
+    def __init__(self, file_path, commit_interval=JOURNAL_COMMIT_INTERVAL,
+                 commit_max_pending=JOURNAL_COMMIT_MAX_PENDING):
+
+        import sqlite3
+
+        self.file_path = file_path
+        self.commit_interval = commit_interval
+        self.commit_max_pending = commit_max_pending
+
+        self.lock = threading.RLock()
+
+        # transactions are handled explicitly, see `_begin()`
+        self.connection = sqlite3.connect(file_path, isolation_level=None,
+                                          check_same_thread=False)
+
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        self.connection.execute("CREATE TABLE IF NOT EXISTS messages ("
+                                "id INTEGER PRIMARY KEY, "
+                                "data TEXT NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS state ("
+                                "key TEXT PRIMARY KEY, "
+                                "value INTEGER NOT NULL)")
+
+        self.in_transaction = False
+        self.pending = 0
+        self.last_commit_time = time.monotonic()
+
+        self.commit_timer = None  # commits the open transaction
+
+        self.last_acked_id = self._get_state("last_acked_id")
+        self.last_processed_id = self._get_state("last_processed_id")
+
+    def append(self, messages):
+        """Appends message dicts which are not in the journal yet."""
+
+        with self.lock:
+            self._begin()
+
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO messages (id, data) VALUES (?, ?)",
+                ((message["id"], json.dumps(message)) for message in messages))
+
+            self.pending += len(messages)
+
+            if self.pending >= self.commit_max_pending or \
+                    time.monotonic() - self.last_commit_time >= \
+                    self.commit_interval:
+                self.commit()
+
+    def is_processed(self, message_id):
+        return message_id <= self.last_processed_id
+
+    def mark_processed(self, message_id):
+        """Records that messages up to `message_id` were processed."""
+
+        with self.lock:
+            if message_id <= self.last_processed_id:
+                return
+
+            self._begin()
+            self._set_state("last_processed_id", message_id)
+            self.last_processed_id = message_id
+
+    def prepare_ack(self):
+        """
+        Writes the journal durably to disk; should be called before deleting
+        messages from the server.
+        """
+
+        with self.lock:
+            self.commit()
+
+            # with synchronous=NORMAL, commits are only fsync'ed by
+            # checkpoints.
+            self.connection.execute("PRAGMA wal_checkpoint(FULL)")
+
+    def record_ack(self, message_id):
+        """
+        Records that messages up to `message_id` were deleted from the
+        server; should be called once the server confirmed it.
+        """
+
+        with self.lock:
+            if message_id <= self.last_acked_id:
+                return
+
+            self._begin()
+
+            self._set_state("last_acked_id", message_id)
+            self.last_acked_id = message_id
+
+            # acknowledged and processed messages are no longer needed.
+            self.connection.execute("DELETE FROM messages WHERE id <= ?",
+                                    (min(self.last_acked_id,
+                                         self.last_processed_id),))
+
+            self.commit()
+
+    def resume(self):
+        """
+        Returns the message dicts journaled but not processed yet, ordered by
+        id; to be called on startup.
+        """
+
+        with self.lock:
+            self.commit()
+
+            cursor = self.connection.execute(
+                "SELECT data FROM messages WHERE id > ? ORDER BY id",
+                (self.last_processed_id,))
+
+            messages = [json.loads(data) for data, in cursor]
+
+        return messages
+
+    def get_highest_message_id(self):
+        with self.lock:
+            cursor = self.connection.execute("SELECT MAX(id) FROM messages")
+            highest_message_id, = cursor.fetchone()
+
+        return max(highest_message_id or 0, self.last_processed_id,
+                   self.last_acked_id)
+
+    def commit(self):
+        with self.lock:
+            if self.commit_timer is not None:
+                self.commit_timer.cancel()
+                self.commit_timer = None
+
+            if self.in_transaction:
+                self.connection.execute("COMMIT")
+                self.in_transaction = False
+
+            self.pending = 0
+            self.last_commit_time = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.connection.close()
+
+    def _begin(self):
+        if self.in_transaction:
+            return
+
+        self.connection.execute("BEGIN")
+        self.in_transaction = True
+
+        # so that writes are committed even if no other write follows.
+        self.commit_timer = threading.Timer(self.commit_interval,
+                                            self._commit_on_timer)
+        self.commit_timer.daemon = True
+        self.commit_timer.start()
+
+    def _commit_on_timer(self):
+        with self.lock:
+            # closed, or committed since the timer fired.
+            if self.commit_timer is None:
+                return
+
+            self.commit_timer = None
+            self.commit()
+
+    def _get_state(self, key):
+        cursor = self.connection.execute("SELECT value FROM state "
+                                         "WHERE key = ?", (key,))
+        row = cursor.fetchone()
+
+        if not row:
+            return 0
+
+        return row[0]
+
+    def _set_state(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO state (key, value) "
+                                "VALUES (?, ?)", (key, value))
+
+class PushoverMessageHistory:
+    """
+    Searchable on-disk history of downloaded messages, kept in a SQLite
+    database in WAL mode.
+
+    Messages are indexed by app, title, priority and date, and their titles
+    and bodies by full-text search (FTS5; when SQLite is built without it,
+    text searches scan the messages instead.) A message downloaded again,
+    or by another device, is stored once, by its umid. Each batch of
+    downloaded messages is inserted in a single transaction.
+    """
+
+    COLUMNS = ("umid", "id", "app", "title", "message", "priority", "date",
+               "data")
+
+    def __init__(self, file_path=HISTORY_FILENAME):
+
+        import sqlite3
+
+        self.file_path = file_path
+
+        self.lock = threading.RLock()
+
+        # transactions are handled explicitly, see `add()`
+        self.connection = sqlite3.connect(file_path, isolation_level=None,
+                                          check_same_thread=False)
+
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        self.connection.execute("CREATE TABLE IF NOT EXISTS messages ("
+                                "umid INTEGER PRIMARY KEY, "
+                                "id INTEGER NOT NULL, "
+                                "app TEXT, "
+                                "title TEXT, "
+                                "message TEXT, "
+                                "priority INTEGER NOT NULL, "
+                                "date INTEGER NOT NULL, "
+                                "data TEXT NOT NULL)")
+
+        # indexes implicitly end with the umid, so that the messages of an
+        # app (for example) come out of its index newest first, unsorted.
+        for column in ("app", "title", "priority", "date"):
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS messages_{column} ON messages "
+                "({column})".format(column=column))
+
+        self.full_text_search = self._create_full_text_index()
+
+    def add(self, messages):
+        """
+        Inserts message dicts which are not in the history yet; returns how
+        many were inserted. Messages without a umid (the API always sends
+        it) are skipped: ids are per device, so they can't stand in for it.
+        """
+
+        rows = [(message["umid"], message["id"],
+                 message.get("app"), message.get("title"),
+                 message.get("message"), message.get("priority", 0),
+                 message.get("date", 0), json.dumps(message))
+                for message in messages
+                if message.get("umid") is not None]
+
+        if not rows:
+            return 0
+
+        with self.lock:
+            self.connection.execute("BEGIN")
+
+            try:
+                cursor = self.connection.executemany(
+                    "INSERT OR IGNORE INTO messages ({columns}) VALUES "
+                    "({placeholders})".format(
+                        columns=", ".join(self.COLUMNS),
+                        placeholders=", ".join("?" * len(self.COLUMNS))),
+                    rows)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+            self.connection.execute("COMMIT")
+
+        return cursor.rowcount
+
+    def search(self, text=None, app=None, title=None, priority=None,
+               minimum_priority=None, since=None, until=None, limit=100):
+        """
+        Returns the message dicts matching all the criteria given, newest
+        (by umid, the order the server received them in) first, up to
+        `limit` of them: all the words of `text` in their title or body,
+        their `app`, `title` or `priority`, a priority of at least
+        `minimum_priority`, and a date (unix timestamp) from `since` until
+        `until`, included.
+        """
+
+        tables = "messages"
+        order = "messages.umid"
+        conditions = list()
+        parameters = list()
+
+        if text and self.full_text_search:
+            # the full-text index returns its matches newest first, so the
+            # query stops after `limit` of them instead of sorting them all;
+            # CROSS JOIN makes SQLite start from it.
+            tables = "messages_fts CROSS JOIN messages "\
+                "ON messages.umid = messages_fts.rowid"
+            order = "messages_fts.rowid"
+            conditions.append("messages_fts MATCH ?")
+            parameters.append(self._get_match_query(text))
+
+        elif text:
+            for word in text.split():
+                pattern = "%{word}%".format(
+                    word=re.sub(r"([\\%_])", r"\\\1", word))
+
+                conditions.append("(messages.title LIKE ? ESCAPE '\\' OR "
+                                  "messages.message LIKE ? ESCAPE '\\')")
+                parameters.extend([pattern, pattern])
+
+        for column, value in (("app", app), ("title", title),
+                              ("priority", priority)):
+            if value is not None:
+                conditions.append("messages.{column} = ?".format(
+                    column=column))
+                parameters.append(value)
+
+        for condition, value in (("messages.priority >= ?", minimum_priority),
+                                 ("messages.date >= ?", since),
+                                 ("messages.date <= ?", until)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+
+        query = "SELECT messages.data FROM {tables}{where} "\
+            "ORDER BY {order} DESC LIMIT ?".format(
+                tables=tables, order=order,
+                where=" WHERE " + " AND ".join(conditions)
+                if conditions else "")
+        parameters.append(limit)
+
+        with self.lock:
+            cursor = self.connection.execute(query, parameters)
+            messages = [json.loads(data) for data, in cursor]
+
+        return messages
+
+    def __len__(self):
+        with self.lock:
+            cursor = self.connection.execute("SELECT COUNT(*) FROM messages")
+            count, = cursor.fetchone()
+
+        return count
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _create_full_text_index(self):
+        # returns whether SQLite has FTS5; the index is kept up to date by
+        # triggers, so that it always matches the messages table.
+
+        import sqlite3
+
+        try:
+            self.connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                "title, message, content='messages', content_rowid='umid')")
+        except sqlite3.OperationalError:
+            logger.info("SQLite has no FTS5; text searches will scan the "
+                        "messages.")
+            return False
+
+        self.connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT "
+            "ON messages BEGIN "
+            "INSERT INTO messages_fts (rowid, title, message) "
+            "VALUES (new.umid, new.title, new.message); END")
+        self.connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE "
+            "ON messages BEGIN "
+            "INSERT INTO messages_fts (messages_fts, rowid, title, message) "
+            "VALUES ('delete', old.umid, old.title, old.message); END")
+
+        return True
+
+    def _get_match_query(self, text):
+        # each word is quoted, so that it is matched as is rather than as
+        # FTS5 query syntax; all of them must match.
+
+        return " ".join('"{word}"'.format(word=word.replace('"', '""'))
+                        for word in text.split())
+
+class PushoverAttachmentCache:
+    """
+    Content-addressed disk cache of downloaded icons and attachments.
+
+    Contents are stored once, named by their SHA-256 digest, whatever the
+    URLs they were fetched from; each URL maps to the digest of its content.
+    When the contents take more than `max_size` bytes, the least recently
+    used are deleted first.
+    """
+
+    def __init__(self, directory=ATTACHMENT_CACHE_DIRECTORY,
+                 max_size=ATTACHMENT_CACHE_MAX_SIZE):
+
+        self.directory = directory
+        self.max_size = max_size
+
+        self.objects_directory = os.path.join(directory, "objects")
+        self.urls_directory = os.path.join(directory, "urls")
+
+        os.makedirs(self.objects_directory, exist_ok=True)
+        os.makedirs(self.urls_directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+
+        # { digest: size }, least recently used first
+        self.objects = collections.OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._load_objects()
+
+    def get(self, url):
+        """Returns the path of the cached content of `url`, or None."""
+
+        digest = self._read_url_digest(url)
+
+        with self.lock:
+            if digest is None or digest not in self.objects:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.objects.move_to_end(digest)
+
+        object_path = self._get_object_path(digest)
+
+        try:
+            os.utime(object_path)  # the order of use survives restarts
+        except FileNotFoundError:  # deleted behind our back
+            with self.lock:
+                self.size -= self.objects.pop(digest, 0)
+            return None
+
+        return object_path
+
+    def put(self, url, content):
+        """Stores `content` (bytes) fetched from `url`; returns its path."""
+
+        import hashlib
+
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self._get_object_path(digest)
+
+        with self.lock:
+            is_stored = digest in self.objects
+
+        if not is_stored:
+            self._write_file(object_path, content)
+
+        self._write_file(self._get_url_path(url), digest.encode())
+
+        with self.lock:
+            if digest in self.objects:
+                self.objects.move_to_end(digest)
+            else:
+                self.objects[digest] = len(content)
+                self.size += len(content)
+
+            self._evict(keep=digest)
+
+        return object_path
+
+    def __contains__(self, url):
+        digest = self._read_url_digest(url)
+
+        return digest is not None and digest in self.objects
+
+    def as_dict(self):
+        stats_dict = {
+            "objects": len(self.objects),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+        return stats_dict
+
+    def _load_objects(self):
+        objects = list()
+
+        for prefix_entry in os.scandir(self.objects_directory):
+            if not prefix_entry.is_dir():
+                continue
+
+            for object_entry in os.scandir(prefix_entry.path):
+                if object_entry.name.startswith("."):  # unfinished write
+                    continue
+
+                object_stat = object_entry.stat()
+                objects.append((object_stat.st_mtime, object_entry.name,
+                                object_stat.st_size))
+
+        for _, digest, size in sorted(objects):
+            self.objects[digest] = size
+            self.size += size
+
+        with self.lock:
+            self._evict()
+
+    def _evict(self, keep=None):
+        # called with `self.lock` held; `keep` is never evicted.
+
+        while self.size > self.max_size and len(self.objects) > 1:
+            digest, size = next(iter(self.objects.items()))
+
+            if digest == keep:
+                self.objects.move_to_end(digest)
+                continue
+
+            del self.objects[digest]
+            self.size -= size
+            self.evictions += 1
+
+            try:
+                os.unlink(self._get_object_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _read_url_digest(self, url):
+        # URLs whose content was evicted are left behind; `get()` misses.
+        try:
+            with open(self._get_url_path(url), "r") as url_file:
+                return url_file.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _get_object_path(self, digest):
+        return os.path.join(self.objects_directory, digest[:2], digest)
+
+    def _get_url_path(self, url):
+        import hashlib
+
+        url_digest = hashlib.sha256(url.encode()).hexdigest()
+
+        return os.path.join(self.urls_directory, url_digest[:2], url_digest)
+
+    def _write_file(self, file_path, content):
+        # written to a temporary file first, so that a crash never leaves a
+        # partial file under the final name.
+
+        import tempfile
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        file_descriptor, temporary_file_path = tempfile.mkstemp(
+            dir=os.path.dirname(file_path), prefix=".")
+
+        try:
+            with os.fdopen(file_descriptor, "wb") as cache_file:
+                cache_file.write(content)
+
+            os.replace(temporary_file_path, file_path)
+        except BaseException:
+            os.unlink(temporary_file_path)
+            raise
+
+def get_attachment_urls(message):
+    """
+    Default `attachment_url_getter` of `PushoverAttachmentFetcher`: the
+    message's `attachment` field, if it is a URL.
+    """
+
+    attachment = message.get("attachment")
+
+    if isinstance(attachment, str) and attachment.startswith(("http://",
+                                                              "https://")):
+        return [attachment]
+
+    return []
+
+class PushoverAttachmentFetcher:
+    """
+    Fetches the icons and attachments of messages into a
+    `PushoverAttachmentCache`, from `workers` threads.
+
+    `prefetch()` is called by `PushoverOpenClient` after each download (see
+    its `attachment_fetcher`), so that `get_icon_path()` and
+    `get_attachment_paths()` are usually served from the cache; a URL is
+    only fetched once at a time. `icon_url` is formatted with the message's
+    `icon`, and `attachment_url_getter(message)` returns the URLs of its
+    attachments.
+    """
+
+    def __init__(self, cache=None, session=None, icon_url=ICON_URL,
+                 attachment_url_getter=get_attachment_urls,
+                 workers=ATTACHMENT_PREFETCH_WORKERS):
+
+        if cache is None:
+            cache = PushoverAttachmentCache()
+        self.cache = cache
+
+        if session is None:
+            session = _get_http_classes()["PushoverHTTPSession"]()
+        self.session = session
+
+        self.icon_url = icon_url
+        self.attachment_url_getter = attachment_url_getter
+        self.workers = workers
+
+        self.lock = threading.Lock()
+        self.thread_pool = None
+        self.pending = dict()  # { url: concurrent.futures.Future }
+
+        self.fetches = 0
+        self.errors = 0
+
+    def get_icon_url(self, message):
+        icon = message.get("icon")
+
+        if not icon:
+            return None
+
+        return self.icon_url.format(icon=icon)
+
+    def get_message_urls(self, message):
+        icon_url = self.get_icon_url(message)
+        attachment_urls = self.attachment_url_getter(message)
+
+        return ([icon_url] if icon_url else []) + list(attachment_urls)
+
+    def prefetch(self, messages):
+        """
+        Starts fetching the icons and attachments of `messages` which are
+        not cached; returns `{ url: concurrent.futures.Future }`.
+        """
+
+        futures = dict()
+
+        for message in messages:
+            for url in self.get_message_urls(message):
+                if url not in futures and url not in self.cache:
+                    futures[url] = self._submit(url)
+
+        return futures
+
+    def fetch(self, url):
+        """Returns the path of the content of `url`, fetching it if needed."""
+
+        path = self.cache.get(url)
+
+        if path is not None:
+            return path
+
+        return self._submit(url).result()
+
+    def get_icon_path(self, message):
+        icon_url = self.get_icon_url(message)
+
+        if not icon_url:
+            return None
+
+        return self.fetch(icon_url)
+
+    def get_attachment_paths(self, message):
+        return [self.fetch(url) for url in self.attachment_url_getter(message)]
+
+    def close(self):
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown(wait=True)
+            self.thread_pool = None
+
+    def _submit(self, url):
+        # returns the future of the fetch of `url`, sharing the one running.
+
+        import concurrent.futures
+
+        with self.lock:
+            future = self.pending.get(url)
+
+            if future is not None:
+                return future
+
+            if self.thread_pool is None:
+                self.thread_pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="pushover-attachment-fetcher")
+
+            future = self.thread_pool.submit(self._fetch, url)
+            self.pending[url] = future
+
+        return future
+
+    def _fetch(self, url):
+        try:
+            # fetched meanwhile; checked first so as not to count a miss
+            if url in self.cache:
+                path = self.cache.get(url)
+
+                if path is not None:
+                    return path
+
+            response = self.session.get(
+                url, timeout=HTTP_TIMEOUTS.get("attachment",
+                                               HTTP_DEFAULT_TIMEOUT))
+            response.raise_for_status()
+
+            self.fetches += 1
+
+            return self.cache.put(url, response.content)
+
+        except Exception:
+            self.errors += 1
+            logger.warning("Could not fetch '%s'.", url, exc_info=True)
+            return None
+
+        finally:
+            with self.lock:
+                self.pending.pop(url, None)
+
+def _encode_ndjson(messages):
+    # one JSON document per line, as `fetch` writes them.
+
+    return "".join(json.dumps(message, separators=(",", ":"), default=str)
+                   + "\n" for message in messages).encode("utf-8")
+
+class PushoverSink:
+    """
+    Base class of the sinks which forward downloaded messages to a local
+    consumer; pass them as `sinks` to `PushoverOpenClient`.
+
+    `put()` never blocks: messages are buffered, and written by the sink's
+    own thread in batches of up to `batch_size`, at most `flush_interval`
+    seconds after they arrived, so a slow or absent consumer holds up
+    neither receiving messages nor the other sinks. Beyond `buffer_size`
+    buffered messages, the oldest are dropped. When `write()` fails, the
+    batch is buffered again and retried after a backoff.
+
+    Subclasses implement `write(messages)`, raising on failure, and
+    `close()`, which is also called after a failure so that the next
+    `write()` reconnects.
+    """
+
+    def __init__(self, name=None, batch_size=SINK_BATCH_SIZE,
+                 flush_interval=SINK_FLUSH_INTERVAL,
+                 buffer_size=SINK_BUFFER_SIZE):
+
+        self.name = name or self.__class__.__name__
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+
+        self.condition = threading.Condition()
+        self.buffer = collections.deque()
+        self.thread = None
+        self.running = False
+
+        self.backoff = PushoverReconnectBackoff(
+            initial=SINK_RETRY_BACKOFF_INITIAL,
+            maximum=SINK_RETRY_BACKOFF_MAX)
+
+        self.sent = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0  # because the buffer was full, or when stopping
+
+    def __repr__(self):
+        return "<{class_name} {name!r}>".format(
+            class_name=self.__class__.__name__, name=self.name)
+
+    def put(self, messages):
+        """Buffers `messages`, starting the sink's thread if needed."""
+
+        with self.condition:
+            self.buffer.extend(messages)
+            self._drop_overflow()
+
+            if not self.running:
+                self._start()
+            elif len(self.buffer) >= self.batch_size:
+                self.condition.notify_all()
+
+    def start(self):
+        with self.condition:
+            if not self.running:
+                self._start()
+
+    def stop(self, timeout=SINK_STOP_TIMEOUT):
+        """
+        Writes the buffered messages, waiting up to `timeout` seconds, then
+        closes the sink; messages which could not be written are dropped.
+        """
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+        with self.condition:
+            self.dropped += len(self.buffer)
+            self.buffer.clear()
+
+        if not (self.thread and self.thread.is_alive()):
+            self.close()  # else it's stuck writing; it is a daemon thread
+
+    def write(self, messages):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    @property
+    def buffered(self):
+        return len(self.buffer)
+
+    def as_dict(self):
+        stats_dict = {
+            "name": self.name,
+            "sent": self.sent,
+            "batches": self.batches,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "buffered": len(self.buffer)
+        }
+
+        return stats_dict
+
+    def _start(self):
+        # called with `self.condition` held.
+
+        self.running = True
+
+        self.thread = threading.Thread(
+            target=self._run, name="pushover-sink-{name}".format(
+                name=self.name), daemon=True)
+        self.thread.start()
+
+    def _drop_overflow(self):
+        # called with `self.condition` held.
+
+        while len(self.buffer) > self.buffer_size:
+            self.buffer.popleft()
+            self.dropped += 1
+
+    def _take_batch(self):
+        # waits for a full batch, or for `flush_interval` seconds after the
+        # first buffered message; returns None once stopped and empty.
+
+        with self.condition:
+            deadline = None
+
+            while self.running and len(self.buffer) < self.batch_size:
+                if not self.buffer:
+                    deadline = None
+                    self.condition.wait()
+                    continue
+
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                self.condition.wait(remaining)
+
+            if not self.buffer:
+                return None
+
+            return [self.buffer.popleft()
+                    for _ in range(min(self.batch_size, len(self.buffer)))]
+
+    def _wait_before_retry(self):
+        # returns False if stopped meanwhile.
+
+        deadline = time.monotonic() + self.backoff.next_delay()
+
+        with self.condition:
+            while self.running:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                self.condition.wait(remaining)
+
+            return self.running
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+
+            if batch is None:
+                return
+
+            try:
+                self.write(batch)
+            except Exception as error:
+                # consumers which are away are expected; no traceback
+                self.errors += 1
+                logger.warning("Could not write %d messages to %r: %s",
+                               len(batch), self, error)
+
+                try:
+                    self.close()
+                except Exception:
+                    pass
+
+                with self.condition:
+                    self.buffer.extendleft(reversed(batch))
+                    self._drop_overflow()
+
+                if not self._wait_before_retry():
+                    return  # stopping; `stop()` drops what is left
+
+                continue
+
+            self.sent += len(batch)
+            self.batches += 1
+            self.backoff.reset()
+
+class PushoverCallbackSink(PushoverSink):
+    """Calls `function(messages)` with each batch, in the sink's thread."""
+
+    def __init__(self, function, **sink_arguments):
+        super().__init__(**sink_arguments)
+
+        self.function = function
+
+    def write(self, messages):
+        self.function(messages)
+
+class PushoverUnixSocketSink(PushoverSink):
+    """
+    Writes messages as lines of JSON to the Unix domain (stream) socket at
+    `socket_path`, connecting when needed.
+    """
+
+    def __init__(self, socket_path, timeout=SINK_WRITE_TIMEOUT,
+                 **sink_arguments):
+
+        sink_arguments.setdefault("name", "socket:{socket_path}".format(
+            socket_path=socket_path))
+        super().__init__(**sink_arguments)
+
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.socket = None
+
+    def write(self, messages):
+        if self.socket is None:
+            import socket
+
+            unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            unix_socket.settimeout(self.timeout)
+
+            try:
+                unix_socket.connect(self.socket_path)
+            except OSError:
+                unix_socket.close()
+                raise
+
+            self.socket = unix_socket
+
+        self.socket.sendall(_encode_ndjson(messages))
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+class PushoverNamedPipeSink(PushoverSink):
+    """
+    Writes messages as lines of JSON to the named pipe at `pipe_path`,
+    creating it if needed. Until a reader opens the pipe, writes fail and
+    are retried.
+    """
+
+    def __init__(self, pipe_path, **sink_arguments):
+        sink_arguments.setdefault("name", "pipe:{pipe_path}".format(
+            pipe_path=pipe_path))
+        super().__init__(**sink_arguments)
+
+        self.pipe_path = pipe_path
+        self.file_descriptor = None
+
+    def write(self, messages):
+        if self.file_descriptor is None:
+            if not os.path.exists(self.pipe_path):
+                os.mkfifo(self.pipe_path, 0o600)
+
+            # opening without O_NONBLOCK would wait for a reader; with it,
+            # it fails right away (ENXIO).
+            self.file_descriptor = os.open(self.pipe_path,
+                                           os.O_WRONLY | os.O_NONBLOCK)
+            os.set_blocking(self.file_descriptor, True)
+
+        data = memoryview(_encode_ndjson(messages))
+
+        while data:
+            data = data[os.write(self.file_descriptor, data):]
+
+    def close(self):
+        if self.file_descriptor is not None:
+            os.close(self.file_descriptor)
+            self.file_descriptor = None
+
+class PushoverRotatingFileSink(PushoverSink):
+    """
+    Appends messages as lines of JSON to `file_path`. Before it grows beyond
+    `max_size` bytes, it is renamed to `file_path.1` (`file_path.1` to
+    `file_path.2`, and so on), keeping `backup_count` of them.
+    """
+
+    def __init__(self, file_path, max_size=SINK_FILE_MAX_SIZE,
+                 backup_count=SINK_FILE_BACKUP_COUNT, **sink_arguments):
+
+        sink_arguments.setdefault("name", "file:{file_path}".format(
+            file_path=file_path))
+        super().__init__(**sink_arguments)
+
+        self.file_path = file_path
+        self.max_size = max_size
+        self.backup_count = backup_count
+        self.file = None
+
+    def write(self, messages):
+        data = _encode_ndjson(messages)
+
+        if self.file is None:
+            self.file = open(self.file_path, "ab")
+
+        if self.file.tell() and self.file.tell() + len(data) > self.max_size:
+            self._rotate()
+
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _rotate(self):
+        self.close()
+
+        for backup_number in range(self.backup_count - 1, 0, -1):
+            backup_file_path = "{file_path}.{backup_number}".format(
+                file_path=self.file_path, backup_number=backup_number)
+
+            if os.path.exists(backup_file_path):
+                os.replace(backup_file_path, "{file_path}.{backup_number}"
+                           .format(file_path=self.file_path,
+                                   backup_number=backup_number + 1))
+
+        if self.backup_count:
+            os.replace(self.file_path, "{file_path}.1".format(
+                file_path=self.file_path))
+        else:
+            os.unlink(self.file_path)
+
+        self.file = open(self.file_path, "ab")
+
+class PushoverWebhookSink(PushoverSink):
+    """
+    POSTs each batch to `url`, as JSON: `{"messages": [message, ...]}`; any
+    response other than 2xx is a failure, and the batch is retried.
+    """
+
+    def __init__(self, url, session=None, **sink_arguments):
+        sink_arguments.setdefault("name", "webhook:{url}".format(url=url))
+        super().__init__(**sink_arguments)
+
+        self.url = url
+        self.session = session
+
+    def write(self, messages):
+        if self.session is None:
+            self.session = _get_http_classes()["PushoverHTTPSession"]()
+
+        response = self.session.post(
+            self.url, data=json.dumps({"messages": messages}, default=str),
+            headers={"Content-Type": "application/json"},
+            timeout=HTTP_TIMEOUTS.get("webhook", HTTP_DEFAULT_TIMEOUT))
+        response.raise_for_status()
+
+class _ProgressiveAcknowledger:
+    # acknowledges messages every `ack_every` messages, for `iter_messages()`;
+    # `before_ack()` is called first, if given.
+
+    def __init__(self, pushover_open_client, ack_every, before_ack=None):
+        self.pushover_open_client = pushover_open_client
+        self.ack_every = ack_every
+        self.before_ack = before_ack
+
+        self.unacked = 0
+        self.last_message_id = None
+
+    def note_message(self, message_id):
+        if not self.ack_every:
+            return
+
+        self.unacked += 1
+        self.last_message_id = message_id
+
+        if self.unacked >= self.ack_every:
+            self.flush()
+
+    def flush(self):
+        if not self.unacked:
+            return
+
+        if self.before_ack is not None:
+            self.before_ack()
+
+        self.pushover_open_client.delete_all_messages(
+            last_message_id=self.last_message_id)
+        self.unacked = 0
+
+class _AsyncProgressiveAcknowledger(_ProgressiveAcknowledger):
+    # as `_ProgressiveAcknowledger`, for `AsyncPushoverOpenClient`;
+    # `before_ack()` is a coroutine function.
+
+    async def note_message(self, message_id):
+        if not self.ack_every:
+            return
+
+        self.unacked += 1
+        self.last_message_id = message_id
+
+        if self.unacked >= self.ack_every:
+            await self.flush()
+
+    async def flush(self):
+        if not self.unacked:
+            return
+
+        if self.before_ack is not None:
+            await self.before_ack()
+
+        await self.pushover_open_client.delete_all_messages(
+            last_message_id=self.last_message_id)
+        self.unacked = 0
+
+class PushoverOpenClient:
+
+    credentials_filename = CREDENTIALS_FILENAME
+
+    email = str()
+    password = str()
+    device_id = str()
+    secret = str()
+
+    twofa: str = None  # two-factor authentication
+
+    needs_twofa = False
+
+    # when the API rejects the secret, log in again (with the stored email
+    # and password) and retry the call once.
+    relogin_on_secret_error = True
+    relogins = 0
+
+    login_response = None  # requests.Response
+    login_response_data = dict()
+    login_errors = None
+
+    device_registration_response = None  # requests.Response
+    device_registration_response_data = dict()
+    device_registration_errors = None
+
+
+    message_downloading_response = None  # requests.Response
+    message_downloading_response_data = dict()
+    message_downloading_errors = None
+
+    update_highest_message_response = None  # requests.Response
+    update_highest_message_response_data = dict()
+    update_highest_message_errors = None
+
+    emergency_acknowledgement_response = None  # requests.Response
+    emergency_acknowledgement_response_data = dict()
+    emergency_acknowledgement_errors = None
+
+    # highest message id downloaded, and highest message id acknowledged to
+    # the server (by `delete_all_messages()`), both tracked as they change.
+    highest_message_id = 0
+    acked_message_id = 0
+
+    def __init__(self, session=None, api_url=PUSHOVER_API_URL,
+                 messages=None, journal=None, json_decoder=None,
+                 metrics=None, dedup_index=None, attachment_fetcher=None,
+                 sinks=None, history=None):
+        """
+        `session` is the HTTP session used for all calls to the API; it can
+        be shared between clients, or replaced by any `requests.Session`
+        (for example to test against a local stand-in server, whose address
+        is then given as `api_url`.)
+
+        `messages` is the `PushoverMessageStore` keeping downloaded messages.
+
+        `journal`, if given, is a `PushoverMessageJournal` where downloaded
+        messages are recorded; see `resume_from_journal()`.
+
+        `json_decoder` is the `PushoverJSONDecoder` for the API's responses.
+
+        `metrics`, if given, is a `PushoverMetrics` where the time taken by
+        each call to the API, and its errors, are recorded.
+
+        `dedup_index` is the `PushoverDedupIndex` of the messages already
+        handled; pass the same one to many clients to handle each message
+        once across their devices.
+
+        `attachment_fetcher`, if given, is a `PushoverAttachmentFetcher`
+        which starts fetching the icons and attachments of the messages as
+        soon as they are downloaded.
+
+        `history`, if given, is a `PushoverMessageHistory` where downloaded
+        messages are inserted.
+
+        `sinks` are the `PushoverSink`s which new messages (of a higher id
+        than the ones downloaded before) are forwarded to; stop them with
+        `stop_sinks()`.
+        """
+
+        #self.load_from_credentials_file()
+
+        if not session:
+            session = self._create_session()
+
+        if messages is None:
+            messages = PushoverMessageStore()
+
+        self.session = session
+        self.api_url = api_url
+        if json_decoder is None:
+            json_decoder = PushoverJSONDecoder()
+
+        self.messages = messages  # { message_id: PushoverMessage, }
+        self.journal = journal
+        self.json_decoder = json_decoder
+
+        if dedup_index is None:
+            dedup_index = PushoverDedupIndex()
+        self.dedup_index = dedup_index
+
+        self.attachment_fetcher = attachment_fetcher
+
+        self.sinks = list(sinks or [])
+
+        self.history = history
+
+        self.metrics = metrics
+
+        if metrics is not None:
+            metrics.add_collector(self._collect_metrics)
+
+    def _create_session(self):
+        return _get_http_classes()["PushoverHTTPSession"]()
+
+    @property
+    def connection_stats(self):
+        """`PushoverConnectionStats` of this client's session, if any."""
+        return getattr(self.session, "stats", None)
+
+    def load_from_credentials_file(self, file_path=CREDENTIALS_FILENAME):
+
+        if not os.path.isfile(file_path):
+            raise Exception("Credentials file '{credentials_file_path}'"
+                            " not found. Please create."\
+                            .format(credentials_file_path=file_path))
+
+        with open(file_path, "r") as credentials_file:
+            credentials = json.load(credentials_file)
+
+        self.credentials_filename = file_path
+
+        self.email = credentials["email"]
+        self.password = credentials["password"]
+
+        if "device_id" in credentials.keys():
+            self.device_id = credentials["device_id"]
+
+        if "secret" in credentials.keys():
+            self.secret = credentials["secret"]
+
+        return self
+
+    def login(self, email=None, password=None, twofa=None,
+              rewrite_creds_file=True):
+        """
+        Logs in with email and password, achieving a `secret` from the API.
+
+        As specified in https://pushover.net/api/client#login
+        """
+
+        login_payload = self._prepare_login(email=email, password=password,
+                                            twofa=twofa)
+
+        if not login_payload:
+            return False
+
+        start_time = time.perf_counter()
+
+        login_response =\
+            self.session.post(self._get_endpoint_url(ENDPOINT_LOGIN),
+                              data=login_payload,
+                              timeout=self._get_timeout("login"))
+        login_response_dict = self.json_decoder.decode(login_response.content)
+
+        self._record_request_time("login", start_time)
+
+        return self._process_login_response(
+            login_response=login_response,
+            login_response_dict=login_response_dict,
+            status_code=login_response.status_code,
+            rewrite_creds_file=rewrite_creds_file)
+
+    def set_twofa(self, twofa):
+        """
+        Sets the code for two-factor authentication,
+        if the user has it enabled. After this, `self.login()` should be
+        executed again.
+        """
+        self.twofa = twofa
+
+    def ensure_device(self, device_name=None, rewrite_creds_file=True):
+        """
+        Logs in and registers a device only if there is no stored `secret`
+        and `device_id`, so restarting with the credentials file makes no
+        call to the API; stored credentials are checked by the first real
+        call, which logs in again if the secret was rejected.
+
+        Returns whether the client has both a `secret` and a `device_id`.
+        """
+
+        if not self.secret:
+            self.login(rewrite_creds_file=rewrite_creds_file)
+
+        if self.secret and not self.device_id:
+            self.register_device(device_name=device_name,
+                                 rewrite_creds_file=rewrite_creds_file)
+
+        return bool(self.secret and self.device_id)
+
+    def register_device(self, device_name=None,
+                        secret=None, rewrite_creds_file=True):
+        """
+        Registers a new client device on the Pushover account.
+
+        As specified in https://pushover.net/api/client#register
+        """
+
+        device_id = self._register_device(device_name=device_name,
+                                          secret=secret,
+                                          rewrite_creds_file=\
+                                              rewrite_creds_file)
+
+        if not device_id and not secret and\
+                self._relogin_after_secret_error(
+                    self.device_registration_errors):
+
+            device_id = self._register_device(device_name=device_name,
+                                              secret=secret,
+                                              rewrite_creds_file=\
+                                                  rewrite_creds_file)
+
+        return device_id
+
+    def _register_device(self, device_name, secret, rewrite_creds_file):
+
+        device_registration_payload =\
+            self._prepare_device_registration(device_name=device_name,
+                                              secret=secret)
+
+        start_time = time.perf_counter()
+
+        device_registration_response =\
+            self.session.post(self._get_endpoint_url(ENDPOINT_DEVICES),
+                              data=device_registration_payload,
+                              timeout=self._get_timeout("devices"))
+
+        device_registration_response_dict =\
+            self.json_decoder.decode(device_registration_response.content)
+
+        self._record_request_time("devices", start_time)
+
+        return self._process_device_registration_response(
+            device_registration_response=device_registration_response,
+            device_registration_response_dict=\
+                device_registration_response_dict,
+            rewrite_creds_file=rewrite_creds_file)
+
+    def download_messages(self, secret=None, device_id=None):
+        """
+        Downloads all messages currently on this device.
+
+        As specified in https://pushover.net/api/client#download
+        """
+
+        messages = self._download_messages(secret=secret, device_id=device_id)
+
+        if messages is False and not secret and\
+                self._relogin_after_secret_error(
+                    self.message_downloading_errors):
+
+            messages = self._download_messages(secret=secret,
+                                               device_id=device_id)
+
+        return messages
+
+    def _download_messages(self, secret, device_id):
+
+        message_downloading_params =\
+            self._prepare_message_downloading(secret=secret,
+                                              device_id=device_id)
+
+        start_time = time.perf_counter()
+
+        message_downloading_response =\
+            self.session.get(self._get_endpoint_url(ENDPOINT_MESSAGES),
+                             params=message_downloading_params,
+                             timeout=self._get_timeout("messages"))
+
+        message_downloading_dict =\
+            self.json_decoder.decode(message_downloading_response.content)
+
+        self._record_request_time("messages", start_time)
+
+        return self._process_message_downloading_response(
+            message_downloading_response=message_downloading_response,
+            message_downloading_dict=message_downloading_dict)
+
+    def iter_messages(self, secret=None, device_id=None, ack_every=None,
+                      chunk_size=DOWNLOAD_CHUNK_SIZE, before_ack=None):
+        """
+        Downloads the messages like `download_messages()`, but yields each
+        message as soon as it is read from the response, so that a large
+        backlog is handled in bounded memory.
+
+        With `ack_every`, messages are deleted from the server each time
+        `ack_every` messages were consumed, and when the download ends.
+        `before_ack`, if given, is called before each of these deletions,
+        for example to flush the output where the messages were written; if
+        it raises, the messages are left on the server. On errors, nothing
+        is yielded and `self.message_downloading_errors` is set.
+        """
+
+        is_downloaded = yield from self._iter_messages(
+            secret=secret, device_id=device_id, ack_every=ack_every,
+            chunk_size=chunk_size, before_ack=before_ack)
+
+        # a rejected secret comes with no messages, so none were yielded.
+        if not is_downloaded and not secret and\
+                self._relogin_after_secret_error(
+                    self.message_downloading_errors):
+
+            yield from self._iter_messages(
+                secret=secret, device_id=device_id, ack_every=ack_every,
+                chunk_size=chunk_size, before_ack=before_ack)
+
+    def _iter_messages(self, secret, device_id, ack_every, chunk_size,
+                       before_ack):
+        # yields the messages; returns whether they were all downloaded.
+
+        message_downloading_params =\
+            self._prepare_message_downloading(secret=secret,
+                                              device_id=device_id)
+
+        start_time = time.perf_counter()
+
+        message_downloading_response =\
+            self.session.get(self._get_endpoint_url(ENDPOINT_MESSAGES),
+                             params=message_downloading_params,
+                             timeout=self._get_timeout("messages"),
+                             stream=True)
+
+        self.message_downloading_response = message_downloading_response
+
+        messages_parser = PushoverMessagesStreamParser()
+        message_acknowledger = _ProgressiveAcknowledger(self, ack_every,
+                                                        before_ack=before_ack)
+
+        with message_downloading_response:
+            for chunk in message_downloading_response.iter_content(chunk_size):
+                # the messages of each chunk are journaled, stored and
+                # forwarded together, in a single batch.
+                messages = self._accept_downloaded_messages(
+                    list(messages_parser.feed(chunk)))
+
+                for message in messages:
+                    yield message
+
+                    message_acknowledger.note_message(message["id"])
+
+            message_downloading_dict = messages_parser.close()
+
+        # includes the time the caller took to consume the messages.
+        self._record_request_time("messages", start_time)
+
+        self.message_downloading_response_data = message_downloading_dict
+
+        if not message_downloading_dict.get("status") == 1:
+            self.message_downloading_errors =\
+                message_downloading_dict.get("errors")
+            self._record_error("messages")
+            return False
+
+        message_acknowledger.flush()
+
+        return True
+
+    def delete_all_messages(self, device_id=None, secret=None,
+                            last_message_id=None):
+        """
+        Deletes all messages for this device. If not deleted, tey keep
+        being downloaded again.
+        
+        As specified in https://pushover.net/api/client#delete
+        """
+
+        if not last_message_id:
+            last_message_id = self.get_highest_message_id(redownload=False)
+
+        is_deleted = self._delete_all_messages(device_id=device_id,
+                                               secret=secret,
+                                               last_message_id=last_message_id)
+
+        if not is_deleted and not secret and\
+                self._relogin_after_secret_error(
+                    self.update_highest_message_errors):
+
+            is_deleted = self._delete_all_messages(
+                device_id=device_id, secret=secret,
+                last_message_id=last_message_id)
+
+        return is_deleted
+
+    def _delete_all_messages(self, device_id, secret, last_message_id):
+
+        update_highest_message_endpoint, delete_messages_payload =\
+            self._prepare_delete_messages(device_id=device_id, secret=secret,
+                                          last_message_id=last_message_id)
+
+        start_time = time.perf_counter()
+
+        update_highest_message_response =\
+            self.session.post(update_highest_message_endpoint,
+                              data=delete_messages_payload,
+                              timeout=\
+                                  self._get_timeout("update_highest_message"))
+
+        update_highest_message_dict =\
+            self.json_decoder.decode(update_highest_message_response.content)
+
+        self._record_request_time("update_highest_message", start_time)
+
+        return self._process_update_highest_message_response(
+            update_highest_message_response=update_highest_message_response,
+            update_highest_message_dict=update_highest_message_dict,
+            last_message_id=last_message_id)
+
+    def acknowledge_emergency_message(self, receipt, secret=None):
+        """
+        Acknowledges an emergency-priority message (one with priority 2, by
+        its `receipt`), so that the server stops retrying it.
+
+        As specified in https://pushover.net/api/client#p2
+        """
+
+        acknowledge_emergency_endpoint, acknowledge_emergency_payload =\
+            self._prepare_emergency_acknowledgement(receipt=receipt,
+                                                    secret=secret)
+
+        start_time = time.perf_counter()
+
+        emergency_acknowledgement_response =\
+            self.session.post(acknowledge_emergency_endpoint,
+                              data=acknowledge_emergency_payload,
+                              timeout=\
+                                  self._get_timeout("acknowledge_emergency"))
+
+        emergency_acknowledgement_dict = self.json_decoder.decode(
+            emergency_acknowledgement_response.content)
+
+        self._record_request_time("acknowledge_emergency", start_time)
+
+        return self._process_emergency_acknowledgement_response(
+            emergency_acknowledgement_response=\
+                emergency_acknowledgement_response,
+            emergency_acknowledgement_dict=emergency_acknowledgement_dict)
+
+    def resume_from_journal(self):
+        """
+        Restores the message pointers from `self.journal` after a restart,
+        and returns the messages which were journaled but not processed.
+        """
+
+        if not self.journal:
+            return list()
+
+        messages = self.journal.resume()
+
+        for message in messages:
+            self.messages.add(message)
+
+        self.highest_message_id = max(self.highest_message_id,
+                                      self.journal.get_highest_message_id())
+        self.acked_message_id = max(self.acked_message_id,
+                                    self.journal.last_acked_id)
+
+        return messages
+
+    def get_highest_message_id(self, redownload=False):
+
+        if redownload:
+            self.download_messages()
+
+        return self._get_highest_message_id()
+
+    def _get_highest_message_id(self):
+
+        if not self.highest_message_id:
+            return False
+
+        return self.highest_message_id
+
+    # The `_prepare_*()` and `_process_*_response()` methods hold everything
+    # but the HTTP request itself, so that they are shared with
+    # `AsyncPushoverOpenClient`.
+
+    def _prepare_login(self, email, password, twofa):
+
+        if not email:
+            email = self.email
+
+        if not password:
+            password = self.password
+
+        if self.needs_twofa:
+            if not twofa and not self.twofa:
+                return False
+            if twofa: twofa = twofa
+            elif self.needs_twofa: twofa = self.twofa
+
+        self.login_response = None
+        self.login_response_data = None
+        self.login_errors = None
+
+        login_payload = self._get_login_payload(email=email, password=password,
+                                                twofa=twofa)
+
+        return login_payload
+
+    def _process_login_response(self, login_response, login_response_dict,
+                                status_code, rewrite_creds_file):
+
+        self.login_response = login_response
+        self.login_response_data = login_response_dict
+
+        # If this `self.login()` method fails and `self.needs_twofa` is True,
+        # the implementor should ask the user for the 2-factor auth code,
+        # set it in `self.twofa`, and run this method again.
+        if status_code == 412:
+            self.needs_twofa = True
+            return None
+        else:
+            self.needs_twofa = False
+
+        if not login_response_dict["status"] == 1:
+            self.login_errors = login_response_dict["errors"]
+            self._record_error("login")
+            return None
+
+        # else...
+        self.secret = login_response_dict["secret"]
+
+        if rewrite_creds_file:
+            self.write_credentials_file()
+
+        return self.secret
+
+    def _prepare_device_registration(self, device_name, secret):
+
+        if not device_name:
+            device_name = generate_new_device_name()
+
+        if not secret:
+            secret = self.secret
+
+        self.device_registration_response = None
+        self.device_registration_response_data = None
+        self.device_registration_errors = None
+
+        device_registration_payload =\
+            self._get_device_registration_payload(device_name=device_name,
+                                                  secret=secret)
+
+        return device_registration_payload
+
+    def _process_device_registration_response(
+            self, device_registration_response,
+            device_registration_response_dict, rewrite_creds_file):
+
+        self.device_registration_response = device_registration_response
+        self.device_registration_response_data =\
+                 device_registration_response_dict
+
+        if not device_registration_response_dict["status"] == 1:
+            self.device_registration_errors =\
+                device_registration_response_dict["errors"]
+            self._record_error("devices")
+            return None
+
+        # else...
+        self.device_id = device_registration_response_dict["id"]
+
+        if rewrite_creds_file:
+            self.write_credentials_file()
+
+        return self.device_id
+
+    def _prepare_message_downloading(self, secret, device_id):
+
+        if not secret:
+            secret = self.secret
+
+        if not device_id:
+            device_id = self.device_id
+
+        self.message_downloading_response = None
+        self.message_downloading_response_data = None
+        self.message_downloading_errors = None
+
+        message_downloading_params =\
+            self._get_message_downloading_params(secret=secret,
+                                                 device_id=device_id)
+
+        return message_downloading_params
+
+    def _process_message_downloading_response(self,
+                                              message_downloading_response,
+                                              message_downloading_dict):
+
+        self.message_downloading_response = message_downloading_response
+        self.message_downloading_response_data = message_downloading_dict
+
+        if not message_downloading_dict["status"] == 1:
+            self.message_downloading_errors =\
+                message_downloading_dict["errors"]
+            self._record_error("messages")
+            return False
+
+        messages = message_downloading_dict["messages"]
+
+        # else...
+        return self._accept_downloaded_messages(messages)
+
+    def _accept_downloaded_messages(self, messages):
+        # journals and stores downloaded messages; returns the ones which
+        # were not processed yet.
+
+        if self.journal:
+            # messages processed before a restart, but not yet deleted from
+            # the server, are downloaded again.
+            messages = [message for message in messages
+                        if not self.journal.is_processed(message["id"])]
+            self.journal.append(messages)
+
+        previous_highest_message_id = self.highest_message_id
+        highest_message_id = previous_highest_message_id
+
+        for message in messages:
+            message_id = message["id"]
+            self.messages.add(message)
+
+            if message_id > highest_message_id:
+                highest_message_id = message_id
+
+        self.highest_message_id = highest_message_id
+
+        if self.history is not None and messages:
+            self.history.add(messages)
+
+        if self.attachment_fetcher is not None and messages:
+            self.attachment_fetcher.prefetch(messages)
+
+        if self.sinks and highest_message_id > previous_highest_message_id:
+            # messages not yet acknowledged are downloaded again by the next
+            # syncs; only forward them the first time.
+            new_messages = [message for message in messages
+                            if message["id"] > previous_highest_message_id]
+
+            for sink in self.sinks:
+                sink.put(new_messages)
+
+        return messages
+
+    def stop_sinks(self, timeout=SINK_STOP_TIMEOUT):
+        """Writes the messages buffered by the sinks, and closes them."""
+
+        for sink in self.sinks:
+            sink.stop(timeout=timeout)
+
+    def _prepare_delete_messages(self, device_id, secret, last_message_id):
+
+        if not device_id:
+            device_id = self.device_id
+
+        if not secret:
+            secret = self.secret
+
+        if self.journal and last_message_id:
+            self.journal.prepare_ack()
+
+        self.update_highest_message_response = None
+        self.update_highest_message_response_data = None
+        self.update_highest_message_errors = None
+
+        delete_messages_payload =\
+            self._get_delete_messages_payload(secret=secret,
+                                              message=last_message_id)
+
+        update_highest_message_endpoint =\
+            self._get_endpoint_url(ENDPOINT_UPDATE_HIGHEST_MESSAGE,
+                                   device_id=device_id)
+
+        return update_highest_message_endpoint, delete_messages_payload
+
+    def _process_update_highest_message_response(
+            self, update_highest_message_response,
+            update_highest_message_dict, last_message_id):
+
+        self.update_highest_message_response = update_highest_message_response
+        self.update_highest_message_data = update_highest_message_dict
+
+        if not update_highest_message_dict["status"] == 1:
+            self.update_highest_message_errors =\
+                update_highest_message_dict["errors"]
+            self._record_error("update_highest_message")
+            return False
+
+        # else...
+        if last_message_id and last_message_id > self.acked_message_id:
+            self.acked_message_id = last_message_id
+
+        if self.journal and last_message_id:
+            self.journal.record_ack(last_message_id)
+
+        return True
+
+    def _prepare_emergency_acknowledgement(self, receipt, secret):
+
+        if not secret:
+            secret = self.secret
+
+        self.emergency_acknowledgement_response = None
+        self.emergency_acknowledgement_response_data = None
+        self.emergency_acknowledgement_errors = None
+
+        acknowledge_emergency_payload = {"secret": secret}
+
+        acknowledge_emergency_endpoint =\
+            self._get_endpoint_url(ENDPOINT_ACKNOWLEDGE_EMERGENCY,
+                                   receipt=receipt)
+
+        return acknowledge_emergency_endpoint, acknowledge_emergency_payload
+
+    def _process_emergency_acknowledgement_response(
+            self, emergency_acknowledgement_response,
+            emergency_acknowledgement_dict):
+
+        self.emergency_acknowledgement_response =\
+            emergency_acknowledgement_response
+        self.emergency_acknowledgement_response_data =\
+            emergency_acknowledgement_dict
+
+        if not emergency_acknowledgement_dict["status"] == 1:
+            self.emergency_acknowledgement_errors =\
+                emergency_acknowledgement_dict["errors"]
+            self._record_error("acknowledge_emergency")
+            return False
+
+        return True
+
+    def _can_relogin_after(self, errors):
+        # errors are a list of messages, or `{ field: [messages] }`.
+        if not self.relogin_on_secret_error or not errors:
+            return False
+
+        if not self.email or not self.password:
+            return False
+
+        if isinstance(errors, dict):
+            return "secret" in errors
+
+        return any("secret" in str(error) for error in errors)
+
+    def _relogin_after_secret_error(self, errors):
+        # logs in again if `errors` tell the secret was rejected; returns
+        # whether a new secret was achieved, so that the call is retried.
+
+        if not self._can_relogin_after(errors):
+            return False
+
+        logger.info("The API rejected the secret; logging in again.")
+
+        self.relogins += 1
+
+        return bool(self.login())
+
+    def write_credentials_file(self, file_path=None):
+        """
+        Writes the credentials to `file_path`, readable by the user only;
+        the file is replaced atomically, so it is never left half-written.
+        """
+
+        if not file_path:
+            file_path = self.credentials_filename
+
+        credentials = self._get_credentials_dict()
+
+        import tempfile
+
+        file_descriptor, temporary_file_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(file_path)),
+            prefix=".pushover-open-client-creds-", suffix=".json")
+
+        try:
+            with os.fdopen(file_descriptor, "w") as credentials_file:
+                json.dump(credentials, credentials_file, indent=2)
+                credentials_file.flush()
+                os.fsync(credentials_file.fileno())
+
+            # `mkstemp()` already creates it with mode 0600
+            os.chmod(temporary_file_path, 0o600)
+            os.replace(temporary_file_path, file_path)
+        except BaseException:
+            os.unlink(temporary_file_path)
+            raise
+
+    def get_websocket_login_string(self):
+        websocket_login_string = PUSHOVER_WEBSOCKET_LOGIN \
+            .format(device_id=self.device_id, secret=self.secret)
+        return websocket_login_string
+
+    def set_twofa(self, twofa):
+        self.twofa = twofa
+
+    def _get_endpoint_url(self, endpoint, **kwargs):
+        return endpoint.format(api_url=self.api_url, **kwargs)
+
+    def _record_request_time(self, endpoint_name, start_time):
+        if self.metrics is None:
+            return
+
+        self.metrics.observe("pushover_api_request_seconds",
+                             time.perf_counter() - start_time,
+                             endpoint=endpoint_name)
+
+    def _record_error(self, endpoint_name):
+        if self.metrics is None:
+            return
+
+        self.metrics.increment("pushover_api_errors_total",
+                               endpoint=endpoint_name)
+
+    def _collect_metrics(self):
+        labels = {"device": self.device_id}
+
+        collected = [
+            ("pushover_messages_stored", labels, len(self.messages)),
+            ("pushover_messages_evicted_total", labels,
+             self.messages.evictions),
+            ("pushover_highest_message_id", labels, self.highest_message_id),
+            ("pushover_acked_message_id", labels, self.acked_message_id)
+        ]
+
+        connection_stats = self.connection_stats
+
+        if connection_stats is not None:
+            collected.extend([
+                ("pushover_http_requests_total", labels,
+                 connection_stats.requests),
+                ("pushover_http_connections_total", labels,
+                 connection_stats.connections)
+            ])
+
+        for sink in self.sinks:
+            sink_labels = dict(labels, sink=sink.name)
+
+            collected.extend([
+                ("pushover_sink_sent_total", sink_labels, sink.sent),
+                ("pushover_sink_errors_total", sink_labels, sink.errors),
+                ("pushover_sink_dropped_total", sink_labels, sink.dropped),
+                ("pushover_sink_buffered", sink_labels, sink.buffered)
+            ])
+
+        return collected
+
+    def _get_timeout(self, endpoint_name):
+        # `self.session` may be a plain `requests.Session`
+        timeouts = getattr(self.session, "timeouts", HTTP_TIMEOUTS)
+
+        return timeouts.get(endpoint_name, HTTP_DEFAULT_TIMEOUT)
+
+    def _get_credentials_dict(self):
+        credentials_dict = dict()
+
+        if self.email: credentials_dict.update({"email": self.email})
+        if self.password: credentials_dict.update({"password": self.password})
+        if self.secret: credentials_dict.update({"secret": self.secret})
+        if self.device_id: credentials_dict.update({"device_id":
+                                                        self.device_id})
+
+        return credentials_dict
+
+    def _get_login_payload(self, email, password, twofa):
+        login_payload = {
+            "email": email,
+            "password": password
+        }
+
+        if twofa:
+            login_payload.update({"twofa": twofa})
+
+        return login_payload
+
+    def _get_device_registration_payload(self, device_name, secret):
+
+        device_registration_payload = {
+            "name": device_name,
+            "os": "O",
+            "secret": secret
+        }
+
+        return device_registration_payload
+
+    def _get_message_downloading_params(self, secret, device_id):
+
+        message_downloading_params = {
+            "secret": secret,
+            "device_id": device_id
+        }
+
+        return message_downloading_params
+
+    def _get_delete_messages_payload(self, message, secret):
+
+        delete_messages_payload = {
+            "message": message,
+            "secret": secret
+        }
+
+        return delete_messages_payload
+
+class PushoverParser:
+    """A registered parser stage; see `register_parser()`."""
+
+    def __init__(self, function, name=None, order=0):
+        self.function = function
+        self.name = name or function.__name__
+        self.order = order
+
+class _TimedIterator:
+    # measures the time spent getting items from `iterator`, which includes
+    # the time spent in the stages before it.
+
+    __slots__ = ("iterator", "elapsed", "count")
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.elapsed = 0.0
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start_time = time.perf_counter()
+
+        try:
+            item = next(self.iterator)
+        finally:
+            self.elapsed += time.perf_counter() - start_time
+
+        self.count += 1
+
+        return item
+
+class PushoverParserPipeline:
+    """
+    Runs each batch of downloaded messages through the parser stages.
+
+    Stages are chained generators, so each message goes through all stages
+    before the next message is read. `stats` keeps, for each stage, the
+    number of runs, of messages yielded, and the time spent in the stage
+    itself.
+    """
+
+    def __init__(self, registry=PARSING_FUNCTIONS_REGISTRY, stages=None):
+        # `stages`, if given, is a list of `PushoverParser`s or of functions,
+        # used instead of the registry.
+
+        self.registry = registry
+        self.fixed_stages = None
+
+        if stages is not None:
+            self.fixed_stages = [stage if isinstance(stage, PushoverParser)
+                                 else PushoverParser(stage)
+                                 for stage in stages]
+
+        self.stats = dict()  # { name: {"runs", "messages", "time"} }
+
+    @property
+    def stages(self):
+        if self.fixed_stages is not None:
+            return self.fixed_stages
+
+        # `sorted()` is stable, so equal orders keep the registration order
+        return sorted(self.registry.values(), key=lambda stage: stage.order)
+
+    def iterate(self, messages):
+        """Yields the messages coming out of the last stage."""
+
+        stages = self.stages
+        timed_iterators = list()
+
+        iterator = iter(messages)
+
+        for stage in stages:
+            iterator = _TimedIterator(stage.function(iterator))
+            timed_iterators.append(iterator)
+
+        try:
+            yield from iterator
+        finally:
+            self._record_stats(stages, timed_iterators)
+
+    def run(self, messages):
+        """Returns a list of the messages coming out of the last stage."""
+        return list(self.iterate(messages))
+
+    def _record_stats(self, stages, timed_iterators):
+        upstream_elapsed = 0.0
+
+        for stage, timed_iterator in zip(stages, timed_iterators):
+            stage_stats = self.stats.setdefault(stage.name,
+                                                {"runs": 0, "messages": 0,
+                                                 "time": 0.0})
+
+            stage_stats["runs"] += 1
+            stage_stats["messages"] += timed_iterator.count
+            stage_stats["time"] += timed_iterator.elapsed - upstream_elapsed
+
+            upstream_elapsed = timed_iterator.elapsed
+
+class PushoverCommandError(Exception):
+    """The words of a notification don't match the command's parameters."""
+
+def _convert_bool(word):
+    return word.lower() in ("1", "true", "yes", "y", "on")
+
+class PushoverCommand:
+    """
+    A registered command function, with its argument parsing precompiled
+    from the function's signature when it is registered.
+    """
+
+    # converters for annotated parameters; others are kept as `str`.
+    CONVERTERS = {
+        int: int,
+        float: float,
+        bool: _convert_bool,
+        str: str
+    }
+
+    def __init__(self, function, name=None, aliases=()):
+        self.function = function
+        self.name = (name or function.__name__).lower()
+        self.aliases = tuple(alias.lower() for alias in aliases)
+
+        self.converters = list()  # one per positional parameter
+        self.required = 0  # number of positional parameters without default
+        self.variadic_converter = None  # converter for `*args`, if any
+        self.wants_message = False
+
+        import inspect
+
+        for parameter in inspect.signature(function).parameters.values():
+            converter = self.CONVERTERS.get(parameter.annotation, str)
+
+            if parameter.kind in (parameter.POSITIONAL_ONLY,
+                                  parameter.POSITIONAL_OR_KEYWORD):
+                self.converters.append(converter)
+
+                if parameter.default is parameter.empty:
+                    self.required += 1
+
+            elif parameter.kind == parameter.VAR_POSITIONAL:
+                self.variadic_converter = converter
+
+            elif parameter.kind == parameter.KEYWORD_ONLY \
+                    and parameter.name == "message":
+                self.wants_message = True
+
+    def parse_arguments(self, words):
+        """Converts the notification's words to the function's arguments."""
+
+        if len(words) < self.required or \
+                (len(words) > len(self.converters)
+                 and not self.variadic_converter):
+            raise PushoverCommandError("Command '{name}' got {number} "
+                                       "arguments.".format(name=self.name,
+                                                           number=len(words)))
+
+        converters = self.converters
+
+        try:
+            arguments = [converter(word)
+                         for converter, word in zip(converters, words)]
+
+            if len(words) > len(converters):
+                arguments.extend(self.variadic_converter(word)
+                                 for word in words[len(converters):])
+
+        except ValueError as exception:
+            raise PushoverCommandError("Command '{name}': {exception}"
+                                       .format(name=self.name,
+                                               exception=exception)) \
+                from exception
+
+        return arguments
+
+    def get_call_arguments(self, words, message=None):
+        """Returns `(arguments, keyword_arguments)` to call the function."""
+
+        arguments = self.parse_arguments(words)
+
+        if self.wants_message:
+            return arguments, {"message": message}
+
+        return arguments, dict()
+
+    def __call__(self, words, message=None):
+        arguments, keyword_arguments = self.get_call_arguments(words, message)
+
+        return self.function(*arguments, **keyword_arguments)
+
+class PushoverCommandStats:
+    """Counters and timings of the commands dispatched."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.dispatched = 0
+        self.unknown = 0
+        self.errors = 0
+
+        self.calls = collections.Counter()  # { command_name: calls }
+        self.time = collections.Counter()  # { command_name: seconds }
+
+        # { priority: PushoverHistogram } of the time from the dispatch of a
+        # message to the start of its command.
+        self.latency = dict()
+
+    def record_call(self, command_name, elapsed):
+        with self.lock:
+            self.dispatched += 1
+            self.calls[command_name] += 1
+            self.time[command_name] += elapsed
+
+    def record_latency(self, priority, latency):
+        with self.lock:
+            histogram = self.latency.get(priority)
+
+            if histogram is None:
+                histogram = PushoverHistogram()
+                self.latency[priority] = histogram
+
+            histogram.observe(latency)
+
+    def record_unknown(self):
+        with self.lock:
+            self.unknown += 1
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def as_dict(self):
+        stats_dict = {
+            "dispatched": self.dispatched,
+            "unknown": self.unknown,
+            "errors": self.errors,
+            "calls": dict(self.calls),
+            "time": dict(self.time),
+            "latency": {priority: histogram.as_dict()
+                        for priority, histogram in self.latency.items()}
+        }
+
+        return stats_dict
+
+class PushoverCommandDispatcher:
+    """
+    Runs the registered command named by the first word of each
+    notification, with the other words as its arguments.
+
+    Commands are found with a dict lookup in `registry`. With
+    `prefix_matching`, an unknown word which is the prefix of exactly one
+    command (or alias) runs that command; prefixes are looked up in a trie
+    built from the registry.
+    """
+
+    def __init__(self, registry=COMMAND_FUNCTIONS_REGISTRY,
+                 prefix_matching=False, executor=None, metrics=None):
+
+        self.registry = registry
+        self.prefix_matching = prefix_matching
+
+        # with an `executor` (a `PushoverCommandExecutor`), commands are run
+        # by its workers instead of by the thread calling `dispatch()`.
+        self.executor = executor
+
+        self.stats = PushoverCommandStats()
+
+        # a `PushoverMetrics` where the time taken by each command is
+        # recorded, if any.
+        self.metrics = metrics
+
+        self.trie = None
+        self.trie_registry_size = None
+
+    def find_command(self, word):
+        word = word.lower()
+
+        command = self.registry.get(word)
+
+        if command is None and self.prefix_matching:
+            command = self._find_command_by_prefix(word)
+
+        return command
+
+    def parse(self, message):
+        """
+        Returns `(command, words)` for a message (a dict or a
+        `PushoverMessage`), or `(None, words)` if it names no command.
+        """
+
+        text = message.get("message") or ""
+        words = text.split()
+
+        if not words:
+            return None, words
+
+        return self.find_command(words[0]), words[1:]
+
+    def dispatch(self, message, dispatch_time=None, done_callback=None):
+        """
+        Runs the command of a message; returns the command's result, or, with
+        an executor, whether the command was queued.
+
+        The time from `dispatch_time` (a `time.monotonic()`, by default now)
+        to the start of the command is recorded by the message's priority.
+
+        `done_callback`, if given, is called as `done_callback(message,
+        is_processed)` once the message was handled: after its command ran
+        (or failed), or at once if it names no command; `is_processed` is
+        False if the executor dropped the command without running it.
+        """
+
+        if dispatch_time is None:
+            dispatch_time = time.monotonic()
+
+        command, words = self.parse(message)
+
+        if command is None:
+            self.stats.record_unknown()
+
+            if done_callback is not None:
+                done_callback(message, True)
+
+            return None
+
+        priority = message.get("priority") or 0
+
+        if self.executor is None:
+            self._record_latency(priority, time.monotonic() - dispatch_time)
+
+            try:
+                return self.run(command=command, words=words, message=message)
+            finally:
+                if done_callback is not None:
+                    done_callback(message, True)
+
+        try:
+            arguments, keyword_arguments =\
+                command.get_call_arguments(words, message=message)
+        except PushoverCommandError as exception:
+            self.stats.record_error()
+            logger.warning("%s", exception)
+
+            if done_callback is not None:
+                done_callback(message, True)
+
+            return False
+
+        callback = functools.partial(self._record_execution,
+                                     priority=priority,
+                                     dispatch_time=dispatch_time,
+                                     message=message,
+                                     done_callback=done_callback)
+
+        drop_callback = None
+
+        if done_callback is not None:
+            drop_callback = functools.partial(
+                lambda command_name, message: done_callback(message, False),
+                message=message)
+
+        return self.executor.submit(command.name, command.function,
+                                    arguments, keyword_arguments,
+                                    callback=callback, priority=priority,
+                                    drop_callback=drop_callback)
+
+    def _record_latency(self, priority, latency):
+        self.stats.record_latency(priority, latency)
+
+        if self.metrics is not None:
+            self.metrics.observe("pushover_message_latency_seconds", latency,
+                                 priority=priority)
+
+    def _record_execution(self, command_name, elapsed, exception,
+                          priority=0, dispatch_time=None, message=None,
+                          done_callback=None):
+        try:
+            if dispatch_time is not None:
+                # the command started `elapsed` seconds ago
+                self._record_latency(
+                    priority, time.monotonic() - elapsed - dispatch_time)
+
+            self.stats.record_call(command_name, elapsed)
+
+            if self.metrics is not None:
+                self.metrics.observe("pushover_command_seconds", elapsed,
+                                     command=command_name)
+
+            if exception is not None:
+                self.stats.record_error()
+                logger.error("Error running command '%s'.", command_name,
+                             exc_info=exception)
+        finally:
+            if done_callback is not None:
+                done_callback(message, True)
+
+    def run(self, command, words, message):
+        start_time = time.perf_counter()
+
+        try:
+            return command(words, message=message)
+        except PushoverCommandError as exception:
+            self.stats.record_error()
+            logger.warning("%s", exception)
+        except Exception:
+            self.stats.record_error()
+            logger.exception("Error running command '%s'.", command.name)
+        finally:
+            elapsed = time.perf_counter() - start_time
+
+            self.stats.record_call(command.name, elapsed)
+
+            if self.metrics is not None:
+                self.metrics.observe("pushover_command_seconds", elapsed,
+                                     command=command.name)
+
+    def dispatch_all(self, messages, done_callback=None):
+        """Dispatches `messages`, highest priority first."""
+
+        dispatch_time = time.monotonic()
+
+        messages = sorted(messages,
+                          key=lambda message: -(message.get("priority") or 0))
+
+        for message in messages:
+            self.dispatch(message, dispatch_time=dispatch_time,
+                          done_callback=done_callback)
+
+    def _find_command_by_prefix(self, prefix):
+        # the registry is a plain dict, so the trie is rebuilt whenever
+        # commands were registered since it was built.
+        if self.trie is None or self.trie_registry_size != len(self.registry):
+            self._build_trie()
+
+        node = self.trie
+
+        for character in prefix:
+            node = node["children"].get(character)
+
+            if node is None:
+                return None
+
+        if len(node["commands"]) != 1:  # unknown or ambiguous
+            return None
+
+        command, = node["commands"]
+
+        return command
+
+    def _build_trie(self):
+        # each node: { "children": { character: node }, "commands": set() },
+        # where `commands` are the commands whose names start with the path.
+        trie = {"children": dict(), "commands": set()}
+
+        for command_name, command in self.registry.items():
+            node = trie
+
+            for character in command_name:
+                node = node["children"].setdefault(
+                    character, {"children": dict(), "commands": set()})
+                node["commands"].add(command)
+
+        self.trie = trie
+        self.trie_registry_size = len(self.registry)
+
+class PushoverCommandExecutor:
+    """
+    Runs command functions in a pool of worker threads (or processes), so
+    that slow commands don't hold up receiving and syncing messages.
+
+    Commands wait in a queue of at most `queue_size` (one or more) entries;
+    when it is full, `policy` decides whether the new command is dropped
+    ("drop"), the oldest queued command is dropped ("oldest"), or the caller
+    waits ("block").
+    `concurrency_limits` maps command names to the maximum number of their
+    calls running at once.
+
+    With a `timeout`, commands which waited longer than it in the queue are
+    dropped; commands running longer than it are counted in `timed_out` (and,
+    with `processes`, abandoned, since threads can't be interrupted.) With
+    `processes`, command functions and their arguments must be picklable.
+
+    Commands are submitted with the `priority` of their message, and run
+    highest priority first; when the queue is full, a command of lower
+    priority is dropped to make room for a higher one, whatever the
+    `policy`. `reserved_workers` more workers run only commands with a
+    priority of at least `reserved_priority`.
+    """
+
+    POLICIES = ("drop", "oldest", "block")
+
+    def __init__(self, workers=EXECUTOR_WORKERS, queue_size=EXECUTOR_QUEUE_SIZE,
+                 policy=EXECUTOR_POLICY, timeout=EXECUTOR_TIMEOUT,
+                 concurrency_limits=None, processes=False,
+                 reserved_workers=EXECUTOR_RESERVED_WORKERS,
+                 reserved_priority=EXECUTOR_RESERVED_PRIORITY):
+
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown policy '{policy}'; should be one of "
+                             "{policies}.".format(policy=policy,
+                                                  policies=self.POLICIES))
+
+        # a full queue must hold a command to drop, or to wait for.
+        if queue_size < 1:
+            raise ValueError("queue_size should be at least 1, not "
+                             "{queue_size}.".format(queue_size=queue_size))
+
+        self.workers = workers
+        self.queue_size = queue_size
+        self.policy = policy
+        self.timeout = timeout
+        self.concurrency_limits = dict(concurrency_limits or {})
+        self.processes = processes
+        self.reserved_workers = reserved_workers
+        self.reserved_priority = reserved_priority
+
+        self.condition = threading.Condition()
+        self.queues = {priority: collections.deque()
+                       for priority in MESSAGE_PRIORITIES}  # highest first
+        self.queued = 0
+        self.running_commands = collections.Counter()  # { name: running }
+
+        self.threads = list()
+        self.process_pool = None
+        self.running = False
+
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0  # because the queue was full
+        self.expired = 0  # because they waited longer than `timeout`
+        self.timed_out = 0  # because they ran longer than `timeout`
+
+    @property
+    def queue_depth(self):
+        return self.queued
+
+    def get_queue_depths(self):
+        """Returns `{ priority: queued commands }`."""
+
+        return {priority: len(queue)
+                for priority, queue in self.queues.items()}
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+
+            self.running = True
+
+        if self.processes:
+            import concurrent.futures
+
+            self.process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers + self.reserved_workers)
+
+        self.threads = [threading.Thread(target=self._run,
+                                         name="pushover-command-worker",
+                                         daemon=True)
+                        for _ in range(self.workers)]
+
+        self.threads.extend(
+            threading.Thread(target=self._run,
+                             args=(self.reserved_priority,),
+                             name="pushover-command-worker-reserved",
+                             daemon=True)
+            for _ in range(self.reserved_workers))
+
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, wait=True):
+        """Stops the workers; queued commands are run first if `wait`."""
+
+        dropped_tasks = list()
+
+        with self.condition:
+            if wait:
+                while self.queued and self.running:
+                    self.condition.wait()
+            else:
+                self.dropped += self.queued
+
+                for queue in self.queues.values():
+                    dropped_tasks.extend(queue)
+                    queue.clear()
+
+                self.queued = 0
+
+            self.running = False
+            self.condition.notify_all()
+
+        self._call_drop_callbacks(dropped_tasks)
+
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+        if self.process_pool:
+            self.process_pool.shutdown(wait=wait)
+            self.process_pool = None
+
+    def submit(self, command_name, function, arguments=(),
+               keyword_arguments=None, callback=None, priority=0,
+               drop_callback=None):
+        """
+        Queues `function(*arguments, **keyword_arguments)`; `callback`, if
+        given, is called as `callback(command_name, elapsed, exception)` after
+        it runs, and `drop_callback` as `drop_callback(command_name)` if it
+        is dropped instead (now or later, from the queue.) Returns False if
+        the command was dropped.
+        """
+
+        if not self.running:
+            self.start()
+
+        if priority not in self.queues:
+            priority = 0
+
+        task = (command_name, function, arguments, keyword_arguments or {},
+                callback, time.monotonic(), drop_callback)
+
+        dropped_tasks = list()
+        is_dropped = False
+
+        with self.condition:
+            self.submitted += 1
+
+            if self.queued >= self.queue_size:
+                lowest_priority = self._get_lowest_queued_priority()
+
+                if lowest_priority < priority:
+                    dropped_tasks.append(
+                        self.queues[lowest_priority].popleft())
+                    self.queued -= 1
+                    self.dropped += 1
+
+                elif self.policy == "drop" or (self.policy == "oldest" and
+                                               lowest_priority > priority):
+                    self.dropped += 1
+                    dropped_tasks.append(task)
+                    is_dropped = True
+
+                elif self.policy == "oldest":
+                    dropped_tasks.append(self.queues[priority].popleft())
+                    self.queued -= 1
+                    self.dropped += 1
+
+                else:  # "block"
+                    while self.queued >= self.queue_size and self.running:
+                        self.condition.wait()
+
+                    # stopped while waiting: the workers are gone, so the
+                    # command would never run.
+                    if not self.running:
+                        self.dropped += 1
+                        dropped_tasks.append(task)
+                        is_dropped = True
+
+            if not is_dropped:
+                self.queues[priority].append(task)
+                self.queued += 1
+                self.condition.notify_all()
+
+        self._call_drop_callbacks(dropped_tasks)
+
+        return not is_dropped
+
+    def _call_drop_callbacks(self, tasks):
+        # called without `self.condition` held, since the callbacks may take
+        # locks of their own.
+
+        for task in tasks:
+            command_name, drop_callback = task[0], task[6]
+
+            if drop_callback is None:
+                continue
+
+            try:
+                drop_callback(command_name)
+            except Exception:
+                logger.exception("Error in the drop callback of command "
+                                 "'%s'.", command_name)
+
+    def _get_lowest_queued_priority(self):
+        # only called when the queue is full, so never empty (`queue_size`
+        # is at least 1.)
+
+        for priority in reversed(MESSAGE_PRIORITIES):
+            if self.queues[priority]:
+                return priority
+
+        raise RuntimeError("The command queue is empty.")
+
+    def as_dict(self):
+        stats_dict = {
+            "queue_depth": self.queue_depth,
+            "queue_depths": self.get_queue_depths(),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "timed_out": self.timed_out
+        }
+
+        return stats_dict
+
+    def _take_task(self, minimum_priority=None):
+        # returns the first queued task of the highest priority (of at least
+        # `minimum_priority`) whose command is under its concurrency limit,
+        # waiting for one; None when stopped.
+
+        with self.condition:
+            while self.running:
+                for priority, queue in self.queues.items():
+                    if minimum_priority is not None and \
+                            priority < minimum_priority:
+                        break
+
+                    for index, task in enumerate(queue):
+                        command_name = task[0]
+                        limit = self.concurrency_limits.get(command_name)
+
+                        if limit is None or \
+                                self.running_commands[command_name] < limit:
+                            del queue[index]
+                            self.queued -= 1
+                            self.running_commands[command_name] += 1
+                            self.condition.notify_all()
+                            return task
+
+                self.condition.wait()
+
+            return None
+
+    def _run(self, minimum_priority=None):
+        while True:
+            task = self._take_task(minimum_priority)
+
+            if task is None:
+                return
+
+            command_name, function, arguments, keyword_arguments, callback, \
+                submit_time, _ = task
+
+            try:
+                if self.timeout is not None and \
+                        time.monotonic() - submit_time > self.timeout:
+                    with self.condition:
+                        self.expired += 1
+                    self._call_drop_callbacks([task])
+                    continue
+
+                elapsed, exception = self._execute(function, arguments,
+                                                   keyword_arguments)
+
+                if self.timeout is not None and elapsed > self.timeout:
+                    with self.condition:
+                        self.timed_out += 1
+                    logger.warning("Command '%s' took %.3f seconds.",
+                                   command_name, elapsed)
+
+                with self.condition:
+                    self.completed += 1
+
+                if callback:
+                    callback(command_name, elapsed, exception)
+
+            except Exception:
+                logger.exception("Error in command worker.")
+
+            finally:
+                with self.condition:
+                    self.running_commands[command_name] -= 1
+                    self.condition.notify_all()
+
+    def _execute(self, function, arguments, keyword_arguments):
+        # returns `(elapsed, exception)`.
+
+        start_time = time.perf_counter()
+        exception = None
+
+        try:
+            if self.process_pool:
+                future = self.process_pool.submit(function, *arguments,
+                                                  **keyword_arguments)
+                future.result(timeout=self.timeout)
+            else:
+                function(*arguments, **keyword_arguments)
+        except Exception as raised_exception:
+            exception = raised_exception
+
+        return time.perf_counter() - start_time, exception
+
+class PushoverSyncScheduler:
+    """
+    Coalesces sync requests, running `sync_function` in a background thread.
+
+    At most one sync is running and at most one more is pending: requests
+    which arrive while one is pending are merged into it. A pending sync
+    waits until no request arrived for `debounce` seconds, but no more than
+    `max_delay` seconds after its first request, so a burst of notifications
+    results in a handful of syncs.
+    """
+
+    def __init__(self, sync_function, debounce=SYNC_DEBOUNCE,
+                 max_delay=SYNC_MAX_DELAY):
+
+        self.sync_function = sync_function
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+        self.pending_since = None  # time of the first request pending
+        self.last_request_time = None
+
+        self.requests = 0  # number of calls to `request_sync()`
+        self.syncs = 0  # number of times `sync_function` was run
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+
+            self.running = True
+
+        self.thread = threading.Thread(target=self._run,
+                                       name="pushover-sync-scheduler",
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def request_sync(self):
+        with self.condition:
+            now = time.monotonic()
+
+            self.requests += 1
+            self.last_request_time = now
+
+            if self.pending_since is None:
+                self.pending_since = now
+
+            self.condition.notify_all()
+
+    def _wait_for_sync(self):
+        # returns False when stopped.
+
+        with self.condition:
+            while self.running and self.pending_since is None:
+                self.condition.wait()
+
+            while self.running:
+                deadline = min(self.last_request_time + self.debounce,
+                               self.pending_since + self.max_delay)
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                self.condition.wait(remaining)
+
+            self.pending_since = None
+
+            return self.running
+
+    def _run(self):
+        while self._wait_for_sync():
+            self.syncs += 1
+
+            try:
+                self.sync_function()
+            except Exception:
+                logger.exception("Error while syncing messages.")
+
+class PushoverMessageTracker:
+    """
+    Tracks which downloaded messages were processed (their commands ran),
+    so that the journal and the server are only told about messages up to
+    `processed_message_id`, below which all were.
+
+    A message whose command the executor dropped stays unprocessed, and is
+    dispatched again when downloaded again (see `is_dropped()`); until then,
+    it holds `processed_message_id` back.
+    """
+
+    def __init__(self, processed_message_id=0):
+        self.lock = threading.Lock()
+
+        self.processed_message_id = processed_message_id
+        self.highest_message_id = processed_message_id  # of those begun
+
+        self.pending = set()  # ids of messages being processed
+        self.dropped = set()  # ids of messages to dispatch again
+
+    def begin(self, message_ids):
+        with self.lock:
+            for message_id in message_ids:
+                self.pending.add(message_id)
+                self.dropped.discard(message_id)
+
+                if message_id > self.highest_message_id:
+                    self.highest_message_id = message_id
+
+    def finish(self, message_id, is_processed=True):
+        """
+        Records that a message begun was handled; returns the new
+        `processed_message_id` if it moved forward, else None.
+        """
+
+        with self.lock:
+            if message_id not in self.pending:
+                return None
+
+            self.pending.discard(message_id)
+
+            if not is_processed:
+                self.dropped.add(message_id)
+
+            unfinished = self.pending | self.dropped
+
+            if unfinished:
+                processed_message_id = min(unfinished) - 1
+            else:
+                processed_message_id = self.highest_message_id
+
+            if processed_message_id <= self.processed_message_id:
+                return None
+
+            self.processed_message_id = processed_message_id
+
+            return processed_message_id
+
+    def is_dropped(self, message_id):
+        return message_id in self.dropped
+
+    def as_dict(self):
+        stats_dict = {
+            "processed_message_id": self.processed_message_id,
+            "pending": len(self.pending),
+            "dropped": len(self.dropped)
+        }
+
+        return stats_dict
+
+class PushoverMessageAcknowledger:
+    """
+    Acknowledges downloaded messages in batches.
+
+    `note_download()` is called after each download; the client's highest
+    message id is then acknowledged with `delete_all_messages()` at most once
+    per `interval` seconds, or as soon as `max_downloads` downloads are left
+    unacknowledged. Downloads in between are acknowledged by a timer at the
+    end of the window, or by `flush()`.
+
+    Once `note_processed()` was called, only messages up to the id it was
+    given are acknowledged, so that messages whose commands did not run yet
+    stay on the server.
+    """
+
+    def __init__(self, pushover_open_client, interval=ACK_INTERVAL,
+                 max_downloads=ACK_MAX_DOWNLOADS):
+
+        self.pushover_open_client = pushover_open_client
+        self.interval = interval
+        self.max_downloads = max_downloads
+
+        self.lock = threading.RLock()
+        self.timer = None
+
+        self.downloads_since_ack = 0
+        self.last_ack_time = None
+
+        # acknowledged instead of the client's highest message id, if set
+        self.processed_message_id = None
+
+        self.acks = 0  # number of successful acknowledgements
+        self.errors = 0
+
+    @property
+    def ack_message_id(self):
+        if self.processed_message_id is not None:
+            return self.processed_message_id
+
+        return self.pushover_open_client.highest_message_id
+
+    @property
+    def needs_ack(self):
+        return self.ack_message_id > self.pushover_open_client.acked_message_id
+
+    def note_download(self):
+        with self.lock:
+            if not self.needs_ack:
+                return
+
+            self.downloads_since_ack += 1
+
+            if self.last_ack_time is None:
+                elapsed = self.interval
+            else:
+                elapsed = time.monotonic() - self.last_ack_time
+
+            if self.downloads_since_ack < self.max_downloads \
+                    and elapsed < self.interval:
+
+                if not self.timer:
+                    self.timer = threading.Timer(self.interval - elapsed,
+                                                 self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+
+                return
+
+            self.flush()
+
+    def note_processed(self, processed_message_id):
+        """
+        Allows messages up to `processed_message_id` to be acknowledged, at
+        the end of the current window (never right away, since it is called
+        from command workers.)
+        """
+
+        with self.lock:
+            self.processed_message_id = processed_message_id
+
+            if not self.needs_ack or self.timer:
+                return
+
+            if self.last_ack_time is None:
+                elapsed = self.interval
+            else:
+                elapsed = time.monotonic() - self.last_ack_time
+
+            self.timer = threading.Timer(max(self.interval - elapsed, 0),
+                                         self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Acknowledges the highest message id now, if needed."""
+
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+            if not self.needs_ack:
+                return True
+
+            ack_message_id = self.ack_message_id
+
+            try:
+                is_success = self.pushover_open_client.delete_all_messages(
+                    last_message_id=ack_message_id)
+            except Exception:
+                logger.exception("Error acknowledging messages.")
+                is_success = False
+
+            self.last_ack_time = time.monotonic()
+
+            if not is_success:
+                self.errors += 1
+                return False
+
+            self.acks += 1
+            self.downloads_since_ack = 0
+
+            return True
+
+    def cancel(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+class AsyncPushoverMessageAcknowledger(PushoverMessageAcknowledger):
+    """
+    asyncio counterpart of `PushoverMessageAcknowledger`, for an
+    `AsyncPushoverOpenClient`: the window is a timer of the event loop, and
+    `flush()` is a coroutine. `note_processed()` may be called from any
+    thread once `loop` is set (see `AsyncPushoverOpenClientRealTime`.)
+    """
+
+    def __init__(self, pushover_open_client, interval=ACK_INTERVAL,
+                 max_downloads=ACK_MAX_DOWNLOADS):
+
+        import asyncio
+
+        super().__init__(pushover_open_client=pushover_open_client,
+                         interval=interval, max_downloads=max_downloads)
+
+        self.loop = None  # the event loop running the client
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+
+    def note_download(self):
+        if not self.needs_ack:
+            return
+
+        self.downloads_since_ack += 1
+
+        if self.downloads_since_ack < self.max_downloads \
+                and self._get_elapsed() < self.interval:
+
+            self._schedule_flush(self.interval - self._get_elapsed())
+            return
+
+        self.cancel()
+        self._start_flush()
+
+    def note_processed(self, processed_message_id):
+        """
+        Allows messages up to `processed_message_id` to be acknowledged, at
+        the end of the current window.
+        """
+
+        if self.loop is None:
+            self.processed_message_id = processed_message_id
+            return
+
+        self.loop.call_soon_threadsafe(self._note_processed,
+                                       processed_message_id)
+
+    async def flush(self):
+        """Acknowledges the highest message id now, if needed."""
+
+        self.cancel()
+
+        async with self.flush_lock:
+            if not self.needs_ack:
+                return True
+
+            ack_message_id = self.ack_message_id
+
+            try:
+                is_success = await self.pushover_open_client\
+                    .delete_all_messages(last_message_id=ack_message_id)
+            except Exception:
+                logger.exception("Error acknowledging messages.")
+                is_success = False
+
+            self.last_ack_time = time.monotonic()
+
+            if not is_success:
+                self.errors += 1
+                return False
+
+            self.acks += 1
+            self.downloads_since_ack = 0
+
+            return True
+
+    def cancel(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def _note_processed(self, processed_message_id):
+        self.processed_message_id = processed_message_id
+
+        if self.needs_ack:
+            self._schedule_flush(max(self.interval - self._get_elapsed(), 0))
+
+    def _get_elapsed(self):
+        if self.last_ack_time is None:
+            return self.interval
+
+        return time.monotonic() - self.last_ack_time
+
+    def _schedule_flush(self, delay):
+        import asyncio
+
+        if self.timer:
+            return
+
+        self.timer = asyncio.get_running_loop().call_later(delay,
+                                                           self._start_flush)
+
+    def _start_flush(self):
+        import asyncio
+
+        self.timer = None
+        self.flush_task = asyncio.ensure_future(self.flush())
+
+class PushoverReconnectBackoff:
+    """
+    Exponential backoff with full jitter: each delay is random, between zero
+    and `initial * factor ** attempts`, capped at `maximum`.
+    """
+
+    def __init__(self, initial=RECONNECT_BACKOFF_INITIAL,
+                 factor=RECONNECT_BACKOFF_FACTOR, maximum=RECONNECT_BACKOFF_MAX):
+
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+
+        self.attempts = 0
+
+    def next_delay(self):
+        delay_limit = min(self.maximum,
+                          self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+
+        return random.uniform(0, delay_limit)
+
+    def reset(self):
+        self.attempts = 0
+
+class PushoverRecoveryStats:
+    """Reconnections of a realtime session, and the time they took."""
+
+    def __init__(self):
+        self.reconnects = 0
+        self.disconnected_since = None  # time.monotonic(), while disconnected
+
+        self.recoveries = 0
+        self.last_time_to_recover = None  # seconds
+        self.max_time_to_recover = 0.0  # seconds
+        self.total_time_to_recover = 0.0  # seconds
+
+    def record_disconnection(self):
+        if self.disconnected_since is None:
+            self.disconnected_since = time.monotonic()
+
+    def record_reconnect(self):
+        self.reconnects += 1
+
+    def record_connection(self):
+        # returns True if the connection recovers from a disconnection.
+
+        if self.disconnected_since is None:
+            return False
+
+        time_to_recover = time.monotonic() - self.disconnected_since
+        self.disconnected_since = None
+
+        self.recoveries += 1
+        self.last_time_to_recover = time_to_recover
+        self.max_time_to_recover = max(self.max_time_to_recover,
+                                       time_to_recover)
+        self.total_time_to_recover += time_to_recover
+
+        return True
+
+    @property
+    def average_time_to_recover(self):
+        if not self.recoveries:
+            return None
+
+        return self.total_time_to_recover / self.recoveries
+
+    def as_dict(self):
+        stats_dict = {
+            "reconnects": self.reconnects,
+            "recoveries": self.recoveries,
+            "last_time_to_recover": self.last_time_to_recover,
+            "average_time_to_recover": self.average_time_to_recover,
+            "max_time_to_recover": self.max_time_to_recover
+        }
+
+        return stats_dict
+
+class PushoverKeepAliveWatchdog:
+    """
+    Watches the frames received by a `PushoverOpenClientRealTime`, and
+    reconnects it when no frame arrived for `timeout` seconds, so a stalled
+    connection is noticed within `timeout + check_interval` seconds.
+    """
+
+    def __init__(self, realtime, timeout=KEEP_ALIVE_TIMEOUT,
+                 check_interval=WATCHDOG_CHECK_INTERVAL):
+
+        self.realtime = realtime
+        self.timeout = timeout
+        self.check_interval = check_interval
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.stalls = 0  # number of stalled connections found
+
+    def start(self):
+        self.stop_event.clear()
+
+        self.thread = threading.Thread(target=self._run,
+                                       name="pushover-keep-alive-watchdog",
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def check(self):
+        """Reconnects the websocket if it is stalled; returns if it was."""
+
+        last_frame_age = self.realtime.last_frame_age
+
+        if not self.realtime.connected or last_frame_age is None \
+                or last_frame_age < self.timeout:
+            return False
+
+        self.stalls += 1
+
+        logger.warning("No frame received for %.1f seconds; reconnecting.",
+                       last_frame_age)
+
+        self.realtime.reconnect(graceful=False)
+
+        return True
+
+    def _run(self):
+        while not self.stop_event.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Error in keep-alive watchdog.")
+
+class _PushoverRealTimeBase:
+    # what the sync and asyncio realtime clients share: handing downloaded
+    # messages to the parser pipeline and the command dispatcher, and
+    # tracking which were processed. Subclasses set `pushover_open_client`,
+    # `parser_pipeline`, `command_dispatcher`, `acknowledger` and
+    # `message_tracker`.
+
+    def _get_processed_message_id(self):
+        # messages up to the client's highest id are taken as processed,
+        # unless the journal knows better.
+
+        pushover_open_client = self.pushover_open_client
+        processed_message_id = pushover_open_client.highest_message_id
+
+        if pushover_open_client.journal:
+            processed_message_id = min(
+                processed_message_id,
+                pushover_open_client.journal.last_processed_id)
+
+        return processed_message_id
+
+    def _prepare_dispatch(self, messages, previous_highest_message_id):
+        # returns `(new_messages, emergency_messages, other_messages)`: the
+        # messages to handle, and the parsed ones to dispatch.
+
+        pushover_open_client = self.pushover_open_client
+        message_tracker = self.message_tracker
+
+        # messages stay on the server until they are acknowledged, so the
+        # ones handled by a previous sync are downloaded again; only those
+        # whose command was dropped are handled again.
+        candidate_messages = [
+            message for message in messages
+            if message["id"] > previous_highest_message_id
+            or message_tracker.is_dropped(message["id"])]
+
+        message_tracker.begin(message["id"]
+                              for message in candidate_messages)
+
+        # the dedup index also skips messages which other clients sharing it
+        # handled, on other devices.
+        new_messages = [message for message in candidate_messages
+                        if message["id"] <= previous_highest_message_id]
+        new_messages.extend(pushover_open_client.dedup_index.filter_new(
+            message for message in candidate_messages
+            if message["id"] > previous_highest_message_id))
+
+        parsed_messages = self.parser_pipeline.run(new_messages)
+
+        # skipped, or consumed by a parser stage: nothing more to do.
+        parsed_message_ids = {message.get("id") for message in parsed_messages}
+
+        for message in candidate_messages:
+            if message["id"] not in parsed_message_ids:
+                self._on_message_done(message, True)
+
+        emergency_messages = list()
+        other_messages = list()
+
+        for message in parsed_messages:
+            if (message.get("priority") or 0) >= PRIORITY_EMERGENCY:
+                emergency_messages.append(message)
+            else:
+                other_messages.append(message)
+
+        return new_messages, emergency_messages, other_messages
+
+    def replay(self, messages):
+        """
+        Dispatches the messages which were downloaded but not processed
+        before a restart, as returned by
+        `PushoverOpenClient.resume_from_journal()`; to be called before
+        `run_forever()`, since syncs only dispatch newer messages.
+        """
+
+        new_messages, emergency_messages, other_messages =\
+            self._prepare_dispatch(messages,
+                                   self.message_tracker.processed_message_id)
+
+        self.command_dispatcher.dispatch_all(
+            emergency_messages, done_callback=self._on_message_done)
+        self.command_dispatcher.dispatch_all(
+            other_messages, done_callback=self._on_message_done)
+
+        return new_messages
+
+    def _init_frame_handlers(self):
+        # frames are one byte each (the server may send several together);
+        # handlers and counters are indexed by the byte's value.
+        self.frame_handlers = [None] * 256
+        self.frame_counts = [0] * 256
+
+        for frame, handler in self.pushover_websocket_server_commands.items():
+            self.frame_handlers[frame[0]] = handler
+
+        self.unknown_frames = 0
+
+    def _get_frame_handlers(self, message):
+        # returns the handlers of the frames of `message`, in order.
+
+        frame_handlers = self.frame_handlers
+        frame_counts = self.frame_counts
+        is_debug_enabled = logger.isEnabledFor(logging.DEBUG)
+
+        handlers = list()
+
+        for frame in message:
+            frame_counts[frame] += 1
+
+            if is_debug_enabled:
+                logger.debug("%r %s", bytes((frame,)),
+                             PUSHOVER_WEBSOCKET_SERVER_MESSAGES_MEANING.get(
+                                 bytes((frame,)), "Unknown frame."))
+
+            handler = frame_handlers[frame]
+
+            if handler is None:
+                self.unknown_frames += 1
+                logger.warning("Unknown frame received: %r",
+                               bytes((frame,)))
+                continue
+
+            handlers.append(handler)
+
+        return handlers
+
+    def get_frame_counts(self):
+        """Returns `{ frame: count }` of the frames received."""
+
+        frame_counts = {bytes((frame,)): count
+                        for frame, count in enumerate(self.frame_counts)
+                        if count}
+
+        return frame_counts
+
+    def _on_message_done(self, message, is_processed):
+        # called by the command dispatcher, possibly from a worker thread.
+
+        message_id = message.get("id")
+
+        if message_id is None:
+            return
+
+        processed_message_id = self.message_tracker.finish(message_id,
+                                                           is_processed)
+
+        if processed_message_id is None:
+            return
+
+        if self.pushover_open_client.journal:
+            self.pushover_open_client.journal.mark_processed(
+                processed_message_id)
+
+        if self.acknowledger is not None:
+            self.acknowledger.note_processed(processed_message_id)
+
+class PushoverOpenClientRealTime(_PushoverRealTimeBase):
+    """
+    Receives notifications from the Pushover websocket server, and syncs
+    messages when told to.
+
+    `run_forever()` reconnects after network errors (with jittered
+    exponential backoff) and on reload requests (`R` frames), and performs a
+    sync each time it connects, to catch up with messages sent while
+    disconnected. It stops on `E` and `A` frames, which mean the device must
+    not reconnect automatically, or when `stop()` is called.
+
+    A `PushoverKeepAliveWatchdog` reconnects connections which received no
+    frame for `keep_alive_timeout` seconds; `last_frame_age` tells how long
+    ago the last frame was received.
+
+    `metrics` (by default, the one of `pushover_open_client`) is a
+    `PushoverMetrics` where syncs and commands are timed, and where frame
+    counts, queue depths and reconnections are collected.
+
+    Downloaded messages are dispatched highest priority first; emergency
+    messages are dispatched before the others, and, with `ack_emergency`,
+    acknowledged right after, so that the server stops retrying them.
+
+    Messages are marked processed in the journal, and acknowledged, only
+    once their commands ran (see `PushoverMessageTracker`); those whose
+    command the executor dropped are dispatched again on the next sync.
+    """
+
+    pushover_websocket_server_commands = dict()
+
+    def __init__(self, pushover_open_client=None,
+                 pushover_websocket_server_url=PUSHOVER_WEBSOCKET_SERVER_URL,
+                 sync_debounce=SYNC_DEBOUNCE, sync_max_delay=SYNC_MAX_DELAY,
+                 auto_ack=True, ack_interval=ACK_INTERVAL,
+                 ack_max_downloads=ACK_MAX_DOWNLOADS,
+                 command_dispatcher=None, parser_pipeline=None,
+                 reconnect_backoff=None,
+                 keep_alive_timeout=KEEP_ALIVE_TIMEOUT, metrics=None,
+                 ack_emergency=False):
+
+        if not pushover_open_client:
+            pushover_open_client =\
+                PushoverOpenClient().load_from_credentials_file()
+        self.pushover_open_client = pushover_open_client
+
+        if metrics is None:
+            metrics = pushover_open_client.metrics
+        self.metrics = metrics
+
+        if command_dispatcher is None:
+            command_dispatcher =\
+                PushoverCommandDispatcher(executor=PushoverCommandExecutor())
+        self.command_dispatcher = command_dispatcher
+
+        if metrics is not None and command_dispatcher.metrics is None:
+            command_dispatcher.metrics = metrics
+
+        self.ack_emergency = ack_emergency
+        self.emergency_acks = 0
+
+        if parser_pipeline is None:
+            parser_pipeline = PushoverParserPipeline()
+        self.parser_pipeline = parser_pipeline
+
+        # if `auto_ack` is False, messages are left on the server, and
+        # `delete_all_messages()` should be called by the implementor.
+        self.acknowledger = None
+
+        if auto_ack:
+            self.acknowledger =\
+                PushoverMessageAcknowledger(
+                    pushover_open_client=pushover_open_client,
+                    interval=ack_interval, max_downloads=ack_max_downloads)
+
+        self.message_tracker =\
+            PushoverMessageTracker(processed_message_id=\
+                                       self._get_processed_message_id())
+
+        if self.acknowledger is not None:
+            self.acknowledger.processed_message_id =\
+                self.message_tracker.processed_message_id
+
+        self.sync_scheduler = PushoverSyncScheduler(sync_function=self.sync,
+                                                    debounce=sync_debounce,
+                                                    max_delay=sync_max_delay)
+
+        self.pushover_websocket_server_commands =\
+        {
+            b'#': self.message_keep_alive,
+            b'!': self.message_do_sync,
+            b'R': self.message_reload_request,
+            b'E': self.message_error_permanent,
+            b'A': self.message_error
+        }
+
+        self._init_frame_handlers()
+
+        self.pushover_websocket_login_string = \
+            pushover_open_client.get_websocket_login_string()
+
+        if reconnect_backoff is None:
+            reconnect_backoff = PushoverReconnectBackoff()
+        self.reconnect_backoff = reconnect_backoff
+
+        self.recovery_stats = PushoverRecoveryStats()
+
+        self.stopped = False
+        self.stop_event = threading.Event()  # interrupts the backoff delay
+
+        # set by the frames; see `run_forever()`.
+        self.reload_requested = False
+        self.permanent_error = None  # the `E` or `A` frame, if received
+
+        self.last_error = None  # last exception from the websocket
+
+        self.connected = False
+        self.last_frame_time = None  # time.monotonic()
+
+        self.keep_alive_watchdog =\
+            PushoverKeepAliveWatchdog(realtime=self,
+                                      timeout=keep_alive_timeout)
+
+        self.pushover_websocket_server_url = pushover_websocket_server_url
+        self.websocketapp = self._create_websocketapp()
+
+        if metrics is not None:
+            metrics.add_collector(self._collect_metrics)
+
+    def message_keep_alive(self):
+        pass
+
+    def message_do_sync(self):
+        self.sync_scheduler.request_sync()
+
+    def message_reload_request(self):
+        self.reconnect()
+
+    def message_error_permanent(self):
+        self.permanent_error = b'E'
+        self.websocketapp.close()
+
+    def message_error(self):
+        self.permanent_error = b'A'
+        self.websocketapp.close()
+
+    def send_login(self, pushover_websocket_connection,
+                   pushover_websocket_login_string):
+        pushover_websocket_connection.send(pushover_websocket_login_string)
+
+    def sync(self):
+        """
+        Downloads the new messages. Called by `self.sync_scheduler` after one
+        or more `!` frames.
+        """
+        pushover_open_client = self.pushover_open_client
+
+        start_time = time.perf_counter()
+
+        previous_highest_message_id = pushover_open_client.highest_message_id
+
+        messages = pushover_open_client.download_messages()
+
+        if messages:
+            new_messages, emergency_messages, other_messages =\
+                self._prepare_dispatch(messages, previous_highest_message_id)
+
+            # messages are marked processed in the journal, and acknowledged,
+            # once their commands ran; see `_on_message_done()`.
+            self.command_dispatcher.dispatch_all(
+                emergency_messages, done_callback=self._on_message_done)
+
+            if self.ack_emergency:
+                self.acknowledge_emergency_messages(new_messages)
+
+            self.command_dispatcher.dispatch_all(
+                other_messages, done_callback=self._on_message_done)
+
+        if self.acknowledger and messages:
+            self.acknowledger.note_download()
+
+        if self.metrics is not None:
+            self.metrics.observe("pushover_sync_seconds",
+                                 time.perf_counter() - start_time)
+
+        return messages
+
+    def acknowledge_emergency_messages(self, messages):
+        """Acknowledges the emergency messages which were not yet."""
+
+        pushover_open_client = self.pushover_open_client
+
+        for message in messages:
+            if (message.get("priority") or 0) < PRIORITY_EMERGENCY or \
+                    not message.get("receipt") or message.get("acked"):
+                continue
+
+            if pushover_open_client.acknowledge_emergency_message(
+                    message["receipt"]):
+                message["acked"] = 1
+                self.emergency_acks += 1
+            else:
+                logger.warning(
+                    "Could not acknowledge emergency message %s: %r",
+                    message["id"],
+                    pushover_open_client.emergency_acknowledgement_errors)
+
+    @property
+    def last_frame_age(self):
+        """Seconds since the last frame (or the connection), or None."""
+
+        if self.last_frame_time is None:
+            return None
+
+        return time.monotonic() - self.last_frame_time
+
+    def reconnect(self, graceful=True):
+        """
+        Drops the connection; `run_forever()` reconnects at once. Unless
+        `graceful`, the socket is shut down without waiting for the server
+        to acknowledge the closing, as on a stalled connection.
+        """
+
+        self.reload_requested = True
+        self.connected = False
+        self.recovery_stats.record_disconnection()
+
+        if graceful:
+            self.websocketapp.close()
+            return
+
+        self.websocketapp.keep_running = False
+
+        # shutting the socket down wakes up the thread blocked reading it.
+        websocket_connection = self.websocketapp.sock
+
+        if websocket_connection and websocket_connection.sock:
+            import socket
+
+            try:
+                websocket_connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:  # already disconnected
+                pass
+
+    def run_forever(self):
+        """Receives notifications, reconnecting as needed, until stopped."""
+
+        self.sync_scheduler.start()
+        self.keep_alive_watchdog.start()
+
+        try:
+            while True:
+                self.websocketapp.run_forever()
+
+                self.recovery_stats.record_disconnection()
+
+                if self.stopped or self.permanent_error:
+                    break
+
+                if self.reload_requested:
+                    self.reload_requested = False
+                    delay = 0
+                else:
+                    delay = self.reconnect_backoff.next_delay()
+                    logger.warning("Websocket disconnected (%r); "
+                                   "reconnecting in %.1f seconds.",
+                                   self.last_error, delay)
+
+                if self.stop_event.wait(delay):
+                    break
+
+                self.recovery_stats.record_reconnect()
+                self.websocketapp = self._create_websocketapp()
+
+            if self.permanent_error:
+                logger.error("%s",
+                             PUSHOVER_WEBSOCKET_SERVER_MESSAGES_MEANING[
+                                 self.permanent_error])
+        finally:
+            self.keep_alive_watchdog.stop()
+            self.sync_scheduler.stop()
+
+            if self.command_dispatcher.executor:
+                self.command_dispatcher.executor.stop()
+
+            if self.acknowledger:
+                self.acknowledger.flush()
+
+    def stop(self):
+        """Closes the connection and makes `run_forever()` return."""
+
+        self.stopped = True
+        self.stop_event.set()
+        self.websocketapp.close()
+
+    def _create_websocketapp(self):
+        import websocket
+
+        websocketapp = \
+            websocket.WebSocketApp(self.pushover_websocket_server_url,
+                                   on_open=self._on_open,
+                                   on_message=self._on_message,
+                                   on_error=self._on_error,
+                                   on_close=self._on_close)
+
+        return websocketapp
+
+    def _on_open(self, websocketapp):
+        # the secret may have changed since the last connection, if the
+        # client logged in again.
+        self.pushover_websocket_login_string =\
+            self.pushover_open_client.get_websocket_login_string()
+        pushover_websocket_login_string = self.pushover_websocket_login_string
+
+        self.send_login(pushover_websocket_connection=websocketapp,
+                        pushover_websocket_login_string=\
+                            pushover_websocket_login_string)
+
+        self.connected = True
+        self.last_frame_time = time.monotonic()
+
+        self.recovery_stats.record_connection()
+
+        # catch up with messages which arrived while disconnected.
+        self.sync_scheduler.request_sync()
+
+    def _on_message(self, websocketapp, message):
+        self.last_frame_time = time.monotonic()
+
+        # the server accepted the login, so the connection is healthy.
+        if self.reconnect_backoff.attempts:
+            self.reconnect_backoff.reset()
+
+        if isinstance(message, str):  # sent as a text frame
+            message = message.encode()
+
+        for handler in self._get_frame_handlers(message):
+            handler()
+
+    def _collect_metrics(self):
+        labels = {"device": self.pushover_open_client.device_id}
+
+        collected = [
+            ("pushover_websocket_frames_total",
+             dict(labels, frame=frame.decode(errors="replace")), count)
+            for frame, count in self.get_frame_counts().items()
+        ]
+
+        last_frame_age = self.last_frame_age
+
+        collected.extend([
+            ("pushover_websocket_unknown_frames_total", labels,
+             self.unknown_frames),
+            ("pushover_websocket_connected", labels, int(self.connected)),
+            ("pushover_websocket_last_frame_age_seconds", labels,
+             last_frame_age if last_frame_age is not None else -1),
+            ("pushover_websocket_reconnects_total", labels,
+             self.recovery_stats.reconnects),
+            ("pushover_websocket_recoveries_total", labels,
+             self.recovery_stats.recoveries),
+            ("pushover_websocket_stalls_total", labels,
+             self.keep_alive_watchdog.stalls),
+            ("pushover_sync_requests_total", labels,
+             self.sync_scheduler.requests),
+            ("pushover_syncs_total", labels, self.sync_scheduler.syncs),
+            ("pushover_emergency_acks_total", labels, self.emergency_acks),
+            ("pushover_commands_unknown_total", labels,
+             self.command_dispatcher.stats.unknown),
+            ("pushover_command_errors_total", labels,
+             self.command_dispatcher.stats.errors)
+        ])
+
+        executor = self.command_dispatcher.executor
+
+        if executor is not None:
+            collected.extend(
+                ("pushover_executor_queue_depth",
+                 dict(labels, priority=priority), queue_depth)
+                for priority, queue_depth
+                in executor.get_queue_depths().items())
+
+            collected.extend([
+                ("pushover_executor_submitted_total", labels,
+                 executor.submitted),
+                ("pushover_executor_completed_total", labels,
+                 executor.completed),
+                ("pushover_executor_dropped_total", labels,
+                 executor.dropped + executor.expired)
+            ])
+
+        if self.acknowledger is not None:
+            collected.extend([
+                ("pushover_acks_total", labels, self.acknowledger.acks),
+                ("pushover_ack_errors_total", labels,
+                 self.acknowledger.errors)
+            ])
+
+        return collected
+
+    def _on_error(self, websocketapp, exception):
+        self.last_error = exception
+
+    def _on_close(self, websocketapp, close_status_code, close_msg):
+        self.connected = False
+        self.recovery_stats.record_disconnection()
+
+class AsyncPushoverOpenClient(PushoverOpenClient):
+    """
+    asyncio counterpart of `PushoverOpenClient`: `login()`,
+    `register_device()`, `download_messages()` and `delete_all_messages()` are
+    coroutines. Needs the `aiohttp` package.
+
+    `session` is an `aiohttp.ClientSession`; if not given, one is created on
+    first use and closed by `close()`. Passing the same session to many
+    clients makes them share its connection pool.
+
+    Writes to the journal, the history and the sinks run in the event loop's
+    default executor, so that they don't hold up the other clients of the
+    loop.
+    """
+
+    def __init__(self, session=None, api_url=PUSHOVER_API_URL, timeouts=None,
+                 messages=None, journal=None, json_decoder=None,
+                 metrics=None, dedup_index=None, attachment_fetcher=None,
+                 sinks=None, history=None):
+
+        super().__init__(session=session, api_url=api_url, messages=messages,
+                         journal=journal, json_decoder=json_decoder,
+                         metrics=metrics, dedup_index=dedup_index,
+                         attachment_fetcher=attachment_fetcher, sinks=sinks,
+                         history=history)
+
+        self.owns_session = session is None
+
+        self.timeouts = dict(HTTP_TIMEOUTS)
+
+        if timeouts:
+            self.timeouts.update(timeouts)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _create_session(self):
+        # the aiohttp session must be created from inside the event loop,
+        # see `get_session()`.
+        return None
+
+    def get_session(self):
+        if self.session is None:
+            self.session = create_aiohttp_session()
+
+        return self.session
+
+    async def close(self):
+        if self.owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def login(self, email=None, password=None, twofa=None,
+                    rewrite_creds_file=True):
+        """
+        Logs in with email and password, achieving a `secret` from the API.
+
+        As specified in https://pushover.net/api/client#login
+        """
+
+        login_payload = self._prepare_login(email=email, password=password,
+                                            twofa=twofa)
+
+        if not login_payload:
+            return False
+
+        login_response, login_response_dict =\
+            await self._request("POST", self._get_endpoint_url(ENDPOINT_LOGIN),
+                                endpoint_name="login", data=login_payload)
+
+        return self._process_login_response(
+            login_response=login_response,
+            login_response_dict=login_response_dict,
+            status_code=login_response.status,
+            rewrite_creds_file=rewrite_creds_file)
+
+    async def ensure_device(self, device_name=None, rewrite_creds_file=True):
+        """
+        Logs in and registers a device only if there is no stored `secret`
+        and `device_id`; see `PushoverOpenClient.ensure_device()`.
+        """
+
+        if not self.secret:
+            await self.login(rewrite_creds_file=rewrite_creds_file)
+
+        if self.secret and not self.device_id:
+            await self.register_device(device_name=device_name,
+                                       rewrite_creds_file=rewrite_creds_file)
+
+        return bool(self.secret and self.device_id)
+
+    async def register_device(self, device_name=None, secret=None,
+                              rewrite_creds_file=True):
+        """
+        Registers a new client device on the Pushover account.
+
+        As specified in https://pushover.net/api/client#register
+        """
+
+        device_id = await self._register_device(
+            device_name=device_name, secret=secret,
+            rewrite_creds_file=rewrite_creds_file)
+
+        if not device_id and not secret and\
+                await self._relogin_after_secret_error(
+                    self.device_registration_errors):
+
+            device_id = await self._register_device(
+                device_name=device_name, secret=secret,
+                rewrite_creds_file=rewrite_creds_file)
+
+        return device_id
+
+    async def _register_device(self, device_name, secret,
+                               rewrite_creds_file):
+
+        device_registration_payload =\
+            self._prepare_device_registration(device_name=device_name,
+                                              secret=secret)
+
+        device_registration_response, device_registration_response_dict =\
+            await self._request("POST",
+                                self._get_endpoint_url(ENDPOINT_DEVICES),
+                                endpoint_name="devices",
+                                data=device_registration_payload)
+
+        return self._process_device_registration_response(
+            device_registration_response=device_registration_response,
+            device_registration_response_dict=\
+                device_registration_response_dict,
+            rewrite_creds_file=rewrite_creds_file)
+
+    async def download_messages(self, secret=None, device_id=None):
+        """
+        Downloads all messages currently on this device.
+
+        As specified in https://pushover.net/api/client#download
+        """
+
+        messages = await self._download_messages(secret=secret,
+                                                 device_id=device_id)
+
+        if messages is False and not secret and\
+                await self._relogin_after_secret_error(
+                    self.message_downloading_errors):
+
+            messages = await self._download_messages(secret=secret,
+                                                     device_id=device_id)
+
+        return messages
+
+    async def _download_messages(self, secret, device_id):
+
+        message_downloading_params =\
+            self._prepare_message_downloading(secret=secret,
+                                              device_id=device_id)
+
+        message_downloading_response, message_downloading_dict =\
+            await self._request("GET",
+                                self._get_endpoint_url(ENDPOINT_MESSAGES),
+                                endpoint_name="messages",
+                                params=message_downloading_params)
+
+        return await self._run_blocking(
+            self._process_message_downloading_response,
+            message_downloading_response=message_downloading_response,
+            message_downloading_dict=message_downloading_dict)
+
+    def iter_messages(self, *arguments, **keyword_arguments):
+        raise TypeError("AsyncPushoverOpenClient streams messages with "
+                        "`aiter_messages()`.")
+
+    async def aiter_messages(self, secret=None, device_id=None,
+                             ack_every=None, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                             before_ack=None):
+        """
+        asyncio counterpart of `PushoverOpenClient.iter_messages()`, to be
+        used with `async for`; `before_ack`, if given, is a coroutine
+        function.
+        """
+
+        async for message in self._aiter_messages(
+                secret=secret, device_id=device_id, ack_every=ack_every,
+                chunk_size=chunk_size, before_ack=before_ack):
+            yield message
+
+        # a rejected secret comes with no messages, so none were yielded.
+        if self.message_downloading_errors and not secret and\
+                await self._relogin_after_secret_error(
+                    self.message_downloading_errors):
+
+            async for message in self._aiter_messages(
+                    secret=secret, device_id=device_id, ack_every=ack_every,
+                    chunk_size=chunk_size, before_ack=before_ack):
+                yield message
+
+    async def _aiter_messages(self, secret, device_id, ack_every, chunk_size,
+                              before_ack):
+        import aiohttp
+
+        message_downloading_params =\
+            self._prepare_message_downloading(secret=secret,
+                                              device_id=device_id)
+
+        connect_timeout, read_timeout = self._get_timeout("messages")
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                        sock_read=read_timeout)
+
+        start_time = time.perf_counter()
+
+        messages_parser = PushoverMessagesStreamParser()
+        message_acknowledger = _AsyncProgressiveAcknowledger(
+            self, ack_every, before_ack=before_ack)
+
+        async with self.get_session().get(
+                self._get_endpoint_url(ENDPOINT_MESSAGES),
+                params=message_downloading_params,
+                timeout=timeout) as message_downloading_response:
+
+            self.message_downloading_response = message_downloading_response
+
+            async for chunk in message_downloading_response.content\
+                    .iter_chunked(chunk_size):
+
+                # the messages of each chunk are journaled, stored and
+                # forwarded together, in a single batch.
+                messages = await self._run_blocking(
+                    self._accept_downloaded_messages,
+                    messages=list(messages_parser.feed(chunk)))
+
+                for message in messages:
+                    yield message
+
+                    await message_acknowledger.note_message(message["id"])
+
+            message_downloading_dict = messages_parser.close()
+
+        # includes the time the caller took to consume the messages.
+        self._record_request_time("messages", start_time)
+
+        self.message_downloading_response_data = message_downloading_dict
+
+        if not message_downloading_dict.get("status") == 1:
+            self.message_downloading_errors =\
+                message_downloading_dict.get("errors")
+            self._record_error("messages")
+            return
+
+        await message_acknowledger.flush()
+
+    async def delete_all_messages(self, device_id=None, secret=None,
+                                  last_message_id=None):
+        """
+        Deletes all messages for this device. If not deleted, tey keep
+        being downloaded again.
+
+        As specified in https://pushover.net/api/client#delete
+        """
+
+        if not last_message_id:
+            last_message_id = self._get_highest_message_id()
+
+        is_deleted = await self._delete_all_messages(
+            device_id=device_id, secret=secret,
+            last_message_id=last_message_id)
+
+        if not is_deleted and not secret and\
+                await self._relogin_after_secret_error(
+                    self.update_highest_message_errors):
+
+            is_deleted = await self._delete_all_messages(
+                device_id=device_id, secret=secret,
+                last_message_id=last_message_id)
+
+        return is_deleted
+
+    async def _delete_all_messages(self, device_id, secret, last_message_id):
+
+        # the journal is fsync'ed before, and updated after, the request.
+        update_highest_message_endpoint, delete_messages_payload =\
+            await self._run_blocking(self._prepare_delete_messages,
+                                     device_id=device_id, secret=secret,
+                                     last_message_id=last_message_id)
+
+        update_highest_message_response, update_highest_message_dict =\
+            await self._request("POST", update_highest_message_endpoint,
+                                endpoint_name="update_highest_message",
+                                data=delete_messages_payload)
+
+        return await self._run_blocking(
+            self._process_update_highest_message_response,
+            update_highest_message_response=update_highest_message_response,
+            update_highest_message_dict=update_highest_message_dict,
+            last_message_id=last_message_id)
+
+    async def acknowledge_emergency_message(self, receipt, secret=None):
+        """
+        Acknowledges an emergency-priority message by its `receipt`.
+
+        As specified in https://pushover.net/api/client#p2
+        """
+
+        acknowledge_emergency_endpoint, acknowledge_emergency_payload =\
+            self._prepare_emergency_acknowledgement(receipt=receipt,
+                                                    secret=secret)
+
+        emergency_acknowledgement_response, emergency_acknowledgement_dict =\
+            await self._request("POST", acknowledge_emergency_endpoint,
+                                endpoint_name="acknowledge_emergency",
+                                data=acknowledge_emergency_payload)
+
+        return self._process_emergency_acknowledgement_response(
+            emergency_acknowledgement_response=\
+                emergency_acknowledgement_response,
+            emergency_acknowledgement_dict=emergency_acknowledgement_dict)
+
+    async def _run_blocking(self, function, **keyword_arguments):
+        # the journal, the history and the sinks block on disk and sockets,
+        # so they run in the default executor, out of the event loop which
+        # drives the other devices.
+
+        import asyncio
+
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(function, **keyword_arguments))
+
+    async def get_highest_message_id(self, redownload=False):
+
+        if redownload:
+            await self.download_messages()
+
+        return self._get_highest_message_id()
+
+    async def _relogin_after_secret_error(self, errors):
+        if not self._can_relogin_after(errors):
+            return False
+
+        logger.info("The API rejected the secret; logging in again.")
+
+        self.relogins += 1
+
+        return bool(await self.login())
+
+    async def _request(self, method, url, endpoint_name, **kwargs):
+        import aiohttp
+
+        connect_timeout, read_timeout = self._get_timeout(endpoint_name)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                        sock_read=read_timeout)
+
+        start_time = time.perf_counter()
+
+        async with self.get_session().request(method, url, timeout=timeout,
+                                              **kwargs) as response:
+            response_dict = self.json_decoder.decode(await response.read())
+
+        self._record_request_time(endpoint_name, start_time)
+
+        return response, response_dict
+
+    def _get_timeout(self, endpoint_name):
+        return self.timeouts.get(endpoint_name, HTTP_DEFAULT_TIMEOUT)
+
+class AsyncPushoverOpenClientRealTime(_PushoverRealTimeBase):
+    """
+    asyncio counterpart of `PushoverOpenClientRealTime`.
+
+    Each websocket frame is dispatched to a coroutine; since a connection only
+    costs a socket and a task, one event loop can drive many devices, for
+    example with `asyncio.gather(*(realtime.run_forever() for ...))`.
+
+    `run_forever()` raises `asyncio.TimeoutError` if no frame is received for
+    `keep_alive_timeout` seconds, so stalled connections are noticed. It can
+    be called again to reconnect; each connection starts with a sync, to
+    catch up with messages sent while disconnected.
+
+    Syncs run as a task beside the frame loop; `!` frames received during a
+    sync are coalesced into one more sync. As with `PushoverOpenClientRealTime`
+    messages go through `parser_pipeline` and `command_dispatcher` (whose
+    executor keeps commands off the event loop), and are acknowledged in
+    batches once their commands ran. `stop()` waits for the commands and the
+    last acknowledgement.
+    """
+
+    def __init__(self, pushover_open_client,
+                 pushover_websocket_server_url=PUSHOVER_WEBSOCKET_SERVER_URL,
+                 health=None, keep_alive_timeout=KEEP_ALIVE_TIMEOUT,
+                 auto_ack=True, ack_interval=ACK_INTERVAL,
+                 ack_max_downloads=ACK_MAX_DOWNLOADS,
+                 command_dispatcher=None, parser_pipeline=None,
+                 ack_emergency=False):
+
+        self.pushover_open_client = pushover_open_client
+        self.pushover_websocket_server_url = pushover_websocket_server_url
+        self.keep_alive_timeout = keep_alive_timeout
+
+        self.metrics = pushover_open_client.metrics
+
+        if health is None:
+            health = PushoverDeviceHealth()
+        self.health = health
+
+        # an executor created here is stopped by `stop()`; a given
+        # dispatcher may be shared with other devices.
+        self.owns_command_dispatcher = command_dispatcher is None
+
+        if command_dispatcher is None:
+            command_dispatcher =\
+                PushoverCommandDispatcher(executor=PushoverCommandExecutor())
+        self.command_dispatcher = command_dispatcher
+
+        if parser_pipeline is None:
+            parser_pipeline = PushoverParserPipeline()
+        self.parser_pipeline = parser_pipeline
+
+        self.ack_emergency = ack_emergency
+        self.emergency_acks = 0
+
+        # if `auto_ack` is False, messages are left on the server, and
+        # `delete_all_messages()` should be called by the implementor.
+        self.acknowledger = None
+
+        if auto_ack:
+            self.acknowledger =\
+                AsyncPushoverMessageAcknowledger(
+                    pushover_open_client=pushover_open_client,
+                    interval=ack_interval, max_downloads=ack_max_downloads)
+
+        self.message_tracker =\
+            PushoverMessageTracker(processed_message_id=\
+                                       self._get_processed_message_id())
+
+        if self.acknowledger is not None:
+            self.acknowledger.processed_message_id =\
+                self.message_tracker.processed_message_id
+
+        self.sync_task = None
+        self.sync_requested = False  # a `!` frame came during a sync
+
+        # set by `E` and `A` frames; the device should not be reconnected.
+        self.permanent_error = False
+
+        self.pushover_websocket_server_commands =\
+        {
+            b'#': self.message_keep_alive,
+            b'!': self.message_do_sync,
             b'R': self.message_reload_request,
             b'E': self.message_error_permanent,
             b'A': self.message_error
         }
 
+        self._init_frame_handlers()
+
         self.pushover_websocket_login_string = \
             pushover_open_client.get_websocket_login_string()
 
-        self.websocketapp = \
-            websocket.WebSocketApp(pushover_websocket_server_url,
-                                   on_open=self._on_open,
-                                   on_message=self._on_message,
-                                   on_error=self._on_error,
-                                   on_close=self._on_close)
+        self.websocket = None  # aiohttp.ClientWebSocketResponse
 
-    def message_keep_alive(self):
+    async def message_keep_alive(self):
         pass
 
-    def message_do_sync(self):
-        pass
+    async def message_do_sync(self):
+        self.request_sync()
 
-    def message_reload_request(self):
-        pass
+    async def message_reload_request(self):
+        await self.close()
 
-    def message_error_permanent(self):
-        pass
+    async def message_error_permanent(self):
+        self.permanent_error = True
+        await self.close()
 
-    def message_error(self):
-        pass
+    async def message_error(self):
+        self.permanent_error = True
+        await self.close()
 
-    def send_login(self, pushover_websocket_connection,
-                   pushover_websocket_login_string):
-        pushover_websocket_connection.send(pushover_websocket_login_string)
+    def request_sync(self):
+        """
+        Starts a sync task, or, if one is running, makes it sync once more
+        when done.
+        """
+
+        import asyncio
+
+        if self.sync_task is not None and not self.sync_task.done():
+            self.sync_requested = True
+            return
+
+        self.sync_requested = False
+        self.sync_task = asyncio.ensure_future(self._run_syncs())
+
+    async def sync(self):
+        """Downloads the new messages, and dispatches them."""
+
+        pushover_open_client = self.pushover_open_client
+
+        start_time = time.perf_counter()
+
+        previous_highest_message_id = pushover_open_client.highest_message_id
+
+        messages = await pushover_open_client.download_messages()
+
+        if messages:
+            # parsers, the journal and a full executor queue (with the
+            # "block" policy) block, so they run out of the event loop.
+            run_blocking = pushover_open_client._run_blocking
+
+            new_messages, emergency_messages, other_messages =\
+                await run_blocking(self._prepare_dispatch, messages=messages,
+                                   previous_highest_message_id=\
+                                       previous_highest_message_id)
+
+            # messages are marked processed in the journal, and acknowledged,
+            # once their commands ran; see `_on_message_done()`.
+            await run_blocking(self.command_dispatcher.dispatch_all,
+                               messages=emergency_messages,
+                               done_callback=self._on_message_done)
+
+            try:
+                if self.ack_emergency:
+                    await self.acknowledge_emergency_messages(new_messages)
+            finally:
+                await run_blocking(self.command_dispatcher.dispatch_all,
+                                   messages=other_messages,
+                                   done_callback=self._on_message_done)
+
+        if self.acknowledger and messages:
+            self.acknowledger.note_download()
+
+        if self.metrics is not None:
+            self.metrics.observe("pushover_sync_seconds",
+                                 time.perf_counter() - start_time)
+
+        return messages
+
+    async def acknowledge_emergency_messages(self, messages):
+        """Acknowledges the emergency messages which were not yet."""
+
+        pushover_open_client = self.pushover_open_client
+
+        for message in messages:
+            if (message.get("priority") or 0) < PRIORITY_EMERGENCY or \
+                    not message.get("receipt") or message.get("acked"):
+                continue
+
+            if await pushover_open_client.acknowledge_emergency_message(
+                    message["receipt"]):
+                message["acked"] = 1
+                self.emergency_acks += 1
+            else:
+                logger.warning(
+                    "Could not acknowledge emergency message %s: %r",
+                    message["id"],
+                    pushover_open_client.emergency_acknowledgement_errors)
+
+    async def run_forever(self):
+        """Connects, logs in and dispatches frames until disconnected."""
+
+        import asyncio
+        import aiohttp
+
+        if self.acknowledger is not None:
+            self.acknowledger.loop = asyncio.get_running_loop()
+
+        session = self.pushover_open_client.get_session()
+
+        # the secret may have changed since the last connection, if the
+        # client logged in again.
+        self.pushover_websocket_login_string =\
+            self.pushover_open_client.get_websocket_login_string()
+
+        self.health.set_state("connecting")
+
+        try:
+            async with session.ws_connect(
+                    self.pushover_websocket_server_url,
+                    receive_timeout=self.keep_alive_timeout) \
+                    as pushover_websocket_connection:
+
+                self.websocket = pushover_websocket_connection
+                self.health.set_state("connected")
+
+                await pushover_websocket_connection.send_str(
+                    self.pushover_websocket_login_string)
+
+                # catch up with messages which arrived while disconnected.
+                self.request_sync()
+
+                async for frame in pushover_websocket_connection:
+                    if frame.type == aiohttp.WSMsgType.BINARY:
+                        await self._on_message(frame.data)
+                    elif frame.type == aiohttp.WSMsgType.TEXT:
+                        await self._on_message(frame.data.encode())
+                    else:  # closing, closed or error
+                        break
+        finally:
+            self.websocket = None
+
+            if self.permanent_error:
+                self.health.set_state("failed")
+            else:
+                self.health.set_state("disconnected")
+
+            # a sync interrupted halfway would leave messages neither
+            # dispatched nor dropped.
+            if self.sync_task is not None:
+                await asyncio.wait([self.sync_task])
+
+    async def stop(self):
+        """
+        Closes the connection, waits for the commands being run, if the
+        executor was created here, and acknowledges what was processed.
+        """
+
+        import asyncio
+
+        await self.close()
+
+        if self.sync_task is not None:
+            await asyncio.wait([self.sync_task])
+
+        executor = self.command_dispatcher.executor
+
+        if self.owns_command_dispatcher and executor is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(executor.stop, wait=True))
+
+        if self.acknowledger is not None:
+            # let the completions the executor posted run first.
+            await asyncio.sleep(0)
+            await self.acknowledger.flush()
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+
+    async def _run_syncs(self):
+        while True:
+            self.sync_requested = False
+
+            try:
+                await self.sync()
+            except Exception as exception:
+                logger.exception("Error syncing messages.")
+                self.health.record_error(exception)
+
+            if not self.sync_requested:
+                return
+
+    async def _on_message(self, message):
+        self.health.record_frame(message)
+
+        for handler in self._get_frame_handlers(message):
+            await handler()
+
+class PushoverDeviceHealth:
+    """
+    Health of one device's realtime session: connection state, frames
+    received, (re)connections and errors.
+    """
+
+    # "stopped", "connecting", "connected", "disconnected" or "failed"
+    state = "stopped"
+
+    def __init__(self):
+        self.state_since = time.time()
+
+        self.frames = 0
+        self.syncs = 0
+        self.connections = 0
+        self.last_frame_time = None
+
+        self.errors = 0
+        self.last_error = None
+
+    def set_state(self, state):
+        self.state = state
+        self.state_since = time.time()
+
+        if state == "connected":
+            self.connections += 1
+
+    def record_frame(self, message):
+        # a websocket message may hold several one-byte frames.
+
+        self.frames += len(message)
+        self.last_frame_time = time.time()
+        self.syncs += message.count(b'!')
+
+    def record_error(self, exception):
+        self.errors += 1
+        self.last_error = repr(exception)
+
+    @property
+    def last_frame_age(self):
+        if self.last_frame_time is None:
+            return None
+
+        return time.time() - self.last_frame_time
+
+    def as_dict(self):
+        health_dict = {
+            "state": self.state,
+            "state_since": self.state_since,
+            "frames": self.frames,
+            "syncs": self.syncs,
+            "connections": self.connections,
+            "last_frame_age": self.last_frame_age,
+            "errors": self.errors,
+            "last_error": self.last_error
+        }
+
+        return health_dict
+
+class PushoverOpenClientSupervisor:
+    """
+    Runs the realtime sessions of many devices in a single process.
+
+    All devices are driven by one asyncio event loop, and their HTTP and
+    websocket connections come from a single shared `aiohttp.ClientSession`,
+    so the cost of an extra device is a socket and a task instead of a
+    process. Each device is added from its own credentials file, and is
+    reconnected after `restart_delay` seconds unless the server told it not
+    to (`E` and `A` frames.) Needs the `aiohttp` package.
+
+    Downloaded messages go through `parser_pipeline` and `command_dispatcher`,
+    shared by all devices (by default, a dispatcher with its own
+    `PushoverCommandExecutor`, stopped when `run()` returns), and are
+    acknowledged on each device once their commands ran. Devices added from
+    credentials files share `dedup_index`, so a message sent to several of
+    them is handled once.
+    """
+
+    def __init__(self, credentials_files=(), api_url=PUSHOVER_API_URL,
+                 pushover_websocket_server_url=PUSHOVER_WEBSOCKET_SERVER_URL,
+                 pool_maxsize=HTTP_POOL_MAXSIZE,
+                 restart_delay=SUPERVISOR_RESTART_DELAY,
+                 command_dispatcher=None, parser_pipeline=None,
+                 dedup_index=None):
+
+        self.api_url = api_url
+        self.pushover_websocket_server_url = pushover_websocket_server_url
+        self.pool_maxsize = pool_maxsize
+        self.restart_delay = restart_delay
+
+        self.owns_command_dispatcher = command_dispatcher is None
+
+        if command_dispatcher is None:
+            command_dispatcher =\
+                PushoverCommandDispatcher(executor=PushoverCommandExecutor())
+        self.command_dispatcher = command_dispatcher
+
+        if parser_pipeline is None:
+            parser_pipeline = PushoverParserPipeline()
+        self.parser_pipeline = parser_pipeline
+
+        if dedup_index is None:
+            dedup_index = PushoverDedupIndex()
+        self.dedup_index = dedup_index
+
+        self.session = None  # aiohttp.ClientSession, created in `run()`
+
+        self.clients = dict()  # { device_name: AsyncPushoverOpenClient }
+        self.realtimes = dict()  # { device_name: realtime_session }
+        self.device_health = dict()  # { device_name: PushoverDeviceHealth }
+
+        for credentials_file in credentials_files:
+            self.add_credentials_file(credentials_file)
+
+    def add_credentials_file(self, file_path, device_name=None):
+
+        if not device_name:
+            device_name = file_path
+
+        client = AsyncPushoverOpenClient(api_url=self.api_url,
+                                         dedup_index=self.dedup_index)
+        client.load_from_credentials_file(file_path=file_path)
+
+        return self.add_client(client=client, device_name=device_name)
+
+    def add_client(self, client, device_name):
+        if device_name in self.clients:
+            raise Exception("Device '{device_name}' is already supervised."
+                            .format(device_name=device_name))
+
+        self.clients.update({device_name: client})
+        self.device_health.update({device_name: PushoverDeviceHealth()})
+
+        return client
+
+    def health(self):
+        """Returns `{ device_name: {health_dict...}, }` for all devices."""
+
+        health = {device_name: device_health.as_dict()
+                  for device_name, device_health in self.device_health.items()}
+
+        return health
+
+    async def run(self):
+        """Runs all devices until every one of them has failed."""
+
+        import asyncio
+
+        self.session = create_aiohttp_session(pool_maxsize=self.pool_maxsize)
+
+        for client in self.clients.values():
+            client.session = self.session
+            client.owns_session = False
+
+        try:
+            await asyncio.gather(*(self._supervise(device_name)
+                                   for device_name in self.clients))
+        finally:
+            executor = self.command_dispatcher.executor
+
+            if self.owns_command_dispatcher and executor is not None:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(executor.stop, wait=True))
+
+            # let the completions the executor posted run first.
+            await asyncio.sleep(0)
+
+            for realtime in self.realtimes.values():
+                if realtime.acknowledger is not None:
+                    await realtime.acknowledger.flush()
+
+            await self.session.close()
+            self.session = None
 
     def run_forever(self):
-        self.websocketapp.run_forever()
+        import asyncio
 
-    def _on_open(self, websocketapp):
-        pushover_websocket_login_string = self.pushover_websocket_login_string
+        asyncio.run(self.run())
 
-        self.send_login(pushover_websocket_connection=websocketapp,
-                        pushover_websocket_login_string=\
-                            pushover_websocket_login_string)
+    async def _supervise(self, device_name):
+        import asyncio
 
-    def _on_message(self, websocketapp, message):
-        if message in self.pushover_websocket_server_commands:
-            self.pushover_websocket_server_commands[message]()
+        client = self.clients[device_name]
+        health = self.device_health[device_name]
 
-        print(message, PUSHOVER_WEBSOCKET_SERVER_MESSAGES_MEANING[message])
+        # kept across reconnections, so that messages whose commands are
+        # still running (or were dropped) are tracked until processed.
+        realtime = None
 
-    def _on_error(self, websocketapp, exception):
-        pass
+        while True:
+            try:
+                if not await client.ensure_device():
+                    health.record_error(client.login_errors
+                                        or client.device_registration_errors)
+                    health.set_state("failed")
+                    return
 
-    def _on_close(self, websocketapp, close_status_code, close_msg):
+                if realtime is None:
+                    realtime = AsyncPushoverOpenClientRealTime(
+                        pushover_open_client=client,
+                        pushover_websocket_server_url=\
+                            self.pushover_websocket_server_url,
+                        health=health,
+                        command_dispatcher=self.command_dispatcher,
+                        parser_pipeline=self.parser_pipeline)
+                    self.realtimes.update({device_name: realtime})
+
+                await realtime.run_forever()
+
+                if realtime.permanent_error:
+                    return
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as exception:
+                health.record_error(exception)
+                health.set_state("disconnected")
+
+            await asyncio.sleep(self.restart_delay)
+
+# command line interface; see `main()`.
+
+def _load_cli_client(arguments, metrics=None):
+    # returns a `PushoverOpenClient` with the credentials file loaded, if
+    # it exists.
+
+    pushover_open_client = PushoverOpenClient(api_url=arguments.api_url,
+                                              metrics=metrics)
+    pushover_open_client.credentials_filename = arguments.credentials
+
+    if os.path.isfile(arguments.credentials):
+        pushover_open_client.load_from_credentials_file(
+            file_path=arguments.credentials)
+
+    return pushover_open_client
+
+def _ensure_cli_device(pushover_open_client):
+    # logs in and registers a device only if the credentials file has no
+    # secret or device_id; returns whether the client can be used.
+
+    import sys
+
+    can_login = pushover_open_client.email and pushover_open_client.password
+
+    if not pushover_open_client.secret and not can_login:
+        print("No secret; run the `login` command, or add `email` and "
+              "`password` to '{file_path}'.".format(
+                  file_path=pushover_open_client.credentials_filename),
+              file=sys.stderr)
+        return False
+
+    if pushover_open_client.ensure_device():
+        return True
+
+    if pushover_open_client.needs_twofa:
+        print("Two-factor authentication is enabled; run the `login` "
+              "command with --twofa first.", file=sys.stderr)
+    else:
+        print_data_errors(pushover_open_client.login_errors
+                          or pushover_open_client.device_registration_errors,
+                          file=sys.stderr)
+
+    return False
+
+def _import_handler_module(module_name):
+    # handler modules register commands and parsers when imported; they are
+    # given as module names, or as paths of .py files.
+
+    import importlib
+
+    if not module_name.endswith(".py"):
+        return importlib.import_module(module_name)
+
+    module_spec = importlib.util.spec_from_file_location(
+        os.path.splitext(os.path.basename(module_name))[0], module_name)
+    module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(module)
+
+    return module
+
+def _get_cli_sinks(arguments):
+    sinks = list()
+
+    sinks.extend(PushoverUnixSocketSink(socket_path)
+                 for socket_path in arguments.sink_socket)
+    sinks.extend(PushoverNamedPipeSink(pipe_path)
+                 for pipe_path in arguments.sink_pipe)
+    sinks.extend(PushoverRotatingFileSink(file_path)
+                 for file_path in arguments.sink_file)
+    sinks.extend(PushoverWebhookSink(url) for url in arguments.sink_webhook)
+
+    return sinks
+
+def _parse_cli_time(value):
+    # a unix timestamp, or an ISO 8601 date (and time, in local time unless
+    # an offset is given.)
+
+    import datetime
+
+    try:
+        return int(value)
+    except ValueError:
         pass
 
+    try:
+        return int(datetime.datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        import argparse
+
+        raise argparse.ArgumentTypeError(
+            "'{value}' is neither a unix timestamp nor an ISO 8601 date"
+            .format(value=value))
+
+def _write_cli_messages(messages, output):
+    # one JSON document per line, so that the output can be piped.
+
+    for message in messages:
+        output.write(json.dumps(message, separators=(",", ":")))
+        output.write("\n")
+
+    output.flush()
+
+def _cli_login(arguments):
+    import sys
+
+    pushover_open_client = _load_cli_client(arguments)
+
+    if arguments.email:
+        pushover_open_client.email = arguments.email
+
+    if arguments.password:
+        pushover_open_client.password = arguments.password
+
+    secret = pushover_open_client.login(twofa=arguments.twofa)
+
+    if not secret:
+        if pushover_open_client.needs_twofa:
+            print("Two-factor authentication is enabled; run again with "
+                  "--twofa.", file=sys.stderr)
+        else:
+            print_data_errors(pushover_open_client.login_errors,
+                              file=sys.stderr)
+        return 1
+
+    print("Logged in; the secret was written to '{file_path}'."
+          .format(file_path=arguments.credentials), file=sys.stderr)
+
+    return 0
+
+def _cli_register(arguments):
+    import sys
+
+    pushover_open_client = _load_cli_client(arguments)
+
+    if not pushover_open_client.secret:
+        print("No secret; run the `login` command first.", file=sys.stderr)
+        return 1
+
+    device_id = pushover_open_client.register_device(
+        device_name=arguments.name)
+
+    if not device_id:
+        print_data_errors(pushover_open_client.device_registration_errors,
+                          file=sys.stderr)
+        return 1
+
+    print(device_id)
+
+    return 0
+
+def _cli_fetch(arguments):
+    import sys
+
+    pushover_open_client = _load_cli_client(arguments)
+
+    if not _ensure_cli_device(pushover_open_client):
+        return 1
+
+    if arguments.history:
+        pushover_open_client.history =\
+            PushoverMessageHistory(file_path=arguments.history)
+
+    ack_every = arguments.ack_every
+
+    if arguments.ack and not ack_every:
+        ack_every = float("inf")  # only once all messages were written
+
+    output = sys.stdout
+
+    try:
+        # messages are only acknowledged once written out.
+        _write_cli_messages(
+            pushover_open_client.iter_messages(ack_every=ack_every,
+                                               before_ack=output.flush),
+            output)
+    except BrokenPipeError:
+        # the reader went away; messages not yet acknowledged stay on the
+        # server.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), output.fileno())
+        return 1
+    finally:
+        if pushover_open_client.history is not None:
+            pushover_open_client.history.close()
+
+    if pushover_open_client.message_downloading_errors:
+        print_data_errors(pushover_open_client.message_downloading_errors,
+                          file=sys.stderr)
+        return 1
+
+    return 0
+
+def _cli_ack(arguments):
+    import sys
+
+    pushover_open_client = _load_cli_client(arguments)
+
+    if not _ensure_cli_device(pushover_open_client):
+        return 1
+
+    last_message_id = arguments.message_id
+
+    if not last_message_id:
+        last_message_id = pushover_open_client.get_highest_message_id(
+            redownload=True)
+
+        if pushover_open_client.message_downloading_errors:
+            print_data_errors(pushover_open_client.message_downloading_errors,
+                              file=sys.stderr)
+            return 1
+
+        if not last_message_id:  # nothing to acknowledge
+            return 0
+
+    if not pushover_open_client.delete_all_messages(
+            last_message_id=last_message_id):
+        print_data_errors(pushover_open_client.update_highest_message_errors,
+                          file=sys.stderr)
+        return 1
+
+    return 0
+
+def _cli_history(arguments):
+    import sys
+
+    if not os.path.isfile(arguments.file):
+        print("No history in '{file_path}'; run `fetch` or `listen` with "
+              "--history first.".format(file_path=arguments.file),
+              file=sys.stderr)
+        return 1
+
+    message_history = PushoverMessageHistory(file_path=arguments.file)
+
+    try:
+        messages = message_history.search(
+            text=arguments.search, app=arguments.app, title=arguments.title,
+            priority=arguments.priority,
+            minimum_priority=arguments.minimum_priority,
+            since=arguments.since, until=arguments.until,
+            limit=arguments.limit)
+    finally:
+        message_history.close()
+
+    try:
+        _write_cli_messages(messages, sys.stdout)
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+
+    return 0
+
+def _cli_listen(arguments):
+    import signal
+
+    for module_name in arguments.handlers:
+        _import_handler_module(module_name)
+
+    metrics = None
+
+    if arguments.prometheus_file or arguments.statsd:
+        metrics = PushoverMetrics()
+
+        if arguments.prometheus_file:
+            metrics.add_exporter(
+                PushoverPrometheusFileExporter(arguments.prometheus_file))
+
+        if arguments.statsd:
+            metrics.add_exporter(PushoverStatsDExporter())
+
+    pushover_open_client = _load_cli_client(arguments, metrics=metrics)
+    pushover_open_client.sinks = _get_cli_sinks(arguments)
+
+    if arguments.history:
+        pushover_open_client.history =\
+            PushoverMessageHistory(file_path=arguments.history)
+
+    resumed_messages = list()
+
+    if arguments.journal:
+        pushover_open_client.journal =\
+            PushoverMessageJournal(file_path=arguments.journal)
+        resumed_messages = pushover_open_client.resume_from_journal()
+
+    if not _ensure_cli_device(pushover_open_client):
+        return 1
+
+    realtime = PushoverOpenClientRealTime(
+        pushover_open_client=pushover_open_client,
+        pushover_websocket_server_url=arguments.websocket_url,
+        auto_ack=not arguments.no_ack, metrics=metrics,
+        ack_emergency=arguments.ack_emergency)
+
+    # `stop()` is safe to call from the signal handler: it only closes the
+    # websocket, and `run_forever()` returns.
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: realtime.stop())
+
+    if metrics is not None:
+        metrics.start()
+
+    try:
+        # messages journaled before a restart, whose commands did not run.
+        realtime.replay(resumed_messages)
+
+        realtime.run_forever()
+    except KeyboardInterrupt:
+        realtime.stop()
+    finally:
+        pushover_open_client.stop_sinks()
+
+        if metrics is not None:
+            metrics.stop()
+
+        if pushover_open_client.journal:
+            pushover_open_client.journal.close()
+
+        if pushover_open_client.history is not None:
+            pushover_open_client.history.close()
+
+    if realtime.permanent_error:
+        return 1
+
+    return 0
+
+def main(argv=None):
+    """
+    Command line interface:
+
+        python pushover_client_python.py login [--email E --password P]
+        python pushover_client_python.py register [--name NAME]
+        python pushover_client_python.py fetch [--ack] > messages.ndjson
+        python pushover_client_python.py ack [--message-id ID]
+        python pushover_client_python.py listen --handlers my_commands
+        python pushover_client_python.py history --search "disk full"
+
+    `fetch` and `history` write each message as a line of JSON; `listen`
+    runs until stopped, running the commands registered by the `--handlers`
+    modules. With `--history`, `fetch` and `listen` keep the messages in a
+    searchable history, which `history` queries.
+    """
+
+    import argparse
+
+    argument_parser = argparse.ArgumentParser(
+        prog="pushover_client_python.py",
+        description="Pushover Open Client.")
+    argument_parser.add_argument(
+        "--credentials", default=CREDENTIALS_FILENAME,
+        help="credentials file (default: %(default)s)")
+    argument_parser.add_argument("--api-url", default=PUSHOVER_API_URL)
+    argument_parser.add_argument("-v", "--verbose", action="count",
+                                 default=0)
+
+    subparsers = argument_parser.add_subparsers(dest="command",
+                                                required=True)
+
+    login_parser = subparsers.add_parser(
+        "login", help="log in, writing the secret to the credentials file")
+    login_parser.add_argument("--email")
+    login_parser.add_argument("--password")
+    login_parser.add_argument("--twofa", help="two-factor authentication code")
+    login_parser.set_defaults(function=_cli_login)
+
+    register_parser = subparsers.add_parser(
+        "register", help="register a new device, printing its device_id")
+    register_parser.add_argument("--name", help="device name (up to 25 "
+                                                "characters, [A-Za-z0-9_-])")
+    register_parser.set_defaults(function=_cli_register)
+
+    fetch_parser = subparsers.add_parser(
+        "fetch", help="write the messages to stdout, as one JSON per line")
+    fetch_parser.add_argument("--ack", action="store_true",
+                              help="delete the messages from the server "
+                                   "once written")
+    fetch_parser.add_argument("--ack-every", type=int, metavar="N",
+                              help="delete the messages from the server "
+                                   "each N messages written")
+    fetch_parser.add_argument("--history", nargs="?", const=HISTORY_FILENAME,
+                              metavar="FILE",
+                              help="keep the messages in this history "
+                                   "(default: %(const)s)")
+    fetch_parser.set_defaults(function=_cli_fetch)
+
+    ack_parser = subparsers.add_parser(
+        "ack", help="delete messages from the server, up to the highest one "
+                    "(or --message-id)")
+    ack_parser.add_argument("--message-id", type=int)
+    ack_parser.set_defaults(function=_cli_ack)
+
+    listen_parser = subparsers.add_parser(
+        "listen", help="receive notifications and run commands until "
+                       "stopped")
+    listen_parser.add_argument("--handlers", nargs="+", default=[],
+                               metavar="MODULE",
+                               help="modules (or .py files) registering "
+                                    "commands and parsers")
+    listen_parser.add_argument("--websocket-url",
+                               default=PUSHOVER_WEBSOCKET_SERVER_URL)
+    listen_parser.add_argument("--journal", metavar="FILE",
+                               help="SQLite journal of the messages")
+    listen_parser.add_argument("--history", nargs="?",
+                               const=HISTORY_FILENAME, metavar="FILE",
+                               help="keep the messages in this history "
+                                    "(default: %(const)s)")
+    listen_parser.add_argument("--no-ack", action="store_true",
+                               help="leave the messages on the server")
+    listen_parser.add_argument("--ack-emergency", action="store_true",
+                               help="acknowledge emergency messages once "
+                                    "their commands are dispatched")
+    listen_parser.add_argument("--prometheus-file", metavar="FILE",
+                               help="export metrics to this file")
+    listen_parser.add_argument("--statsd", action="store_true",
+                               help="export metrics to StatsD on localhost")
+    listen_parser.add_argument("--sink-socket", action="append", default=[],
+                               metavar="PATH",
+                               help="forward messages to this Unix socket, "
+                                    "as one JSON per line (repeatable)")
+    listen_parser.add_argument("--sink-pipe", action="append", default=[],
+                               metavar="PATH",
+                               help="forward messages to this named pipe "
+                                    "(repeatable)")
+    listen_parser.add_argument("--sink-file", action="append", default=[],
+                               metavar="FILE",
+                               help="append messages to this rotated file "
+                                    "(repeatable)")
+    listen_parser.add_argument("--sink-webhook", action="append", default=[],
+                               metavar="URL",
+                               help="POST messages to this URL "
+                                    "(repeatable)")
+    listen_parser.set_defaults(function=_cli_listen)
+
+    history_parser = subparsers.add_parser(
+        "history", help="write the messages of the history matching all the "
+                        "criteria given, newest first, as one JSON per line")
+    history_parser.add_argument("--file", default=HISTORY_FILENAME,
+                                help="history file (default: %(default)s)")
+    history_parser.add_argument("--search", metavar="WORDS",
+                                help="words in the title or message")
+    history_parser.add_argument("--app")
+    history_parser.add_argument("--title")
+    history_parser.add_argument("--priority", type=int,
+                                choices=MESSAGE_PRIORITIES)
+    history_parser.add_argument("--minimum-priority", type=int,
+                                choices=MESSAGE_PRIORITIES)
+    history_parser.add_argument("--since", type=_parse_cli_time,
+                                metavar="DATE",
+                                help="unix timestamp or ISO 8601 date")
+    history_parser.add_argument("--until", type=_parse_cli_time,
+                                metavar="DATE",
+                                help="unix timestamp or ISO 8601 date")
+    history_parser.add_argument("--limit", type=int, default=100)
+    history_parser.set_defaults(function=_cli_history)
+
+    arguments = argument_parser.parse_args(argv)
+
+    if arguments.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG if arguments.verbose > 1 else logging.INFO)
+
+    return arguments.function(arguments)
+
+if __name__ == "__main__":
+    import sys
+
+    # run the importable module's `main()` rather than this `__main__` copy,
+    # so that handler modules register their commands into the registries
+    # which are used.
+    import pushover_client_python
+
+    sys.exit(pushover_client_python.main())
@@ -0,0 +1,602 @@
+#!/usr/bin/env python
+
+# Local stand-in for the Pushover Open Client API, to test and benchmark
+# pushover_client_python offline.
+#
+# It implements the login, devices, messages and update_highest_message
+# endpoints, the websocket push server, and icons and attachments (of
+# deterministic content), following https://pushover.net/api/client ;
+# latency and errors can be injected.
+#
+# usage: python pushover_fake_server.py [port]
+
+import base64
+import hashlib
+import http.server
+import json
+import random
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+WEBSOCKET_OPCODE_TEXT = 0x1
+WEBSOCKET_OPCODE_BINARY = 0x2
+WEBSOCKET_OPCODE_CLOSE = 0x8
+WEBSOCKET_OPCODE_PING = 0x9
+WEBSOCKET_OPCODE_PONG = 0xA
+
+UPDATE_HIGHEST_MESSAGE_PATH_REGEX = re.compile(
+    r"^/1/devices/(?P<device_id>[^/]+)/update_highest_message\.json$")
+ACKNOWLEDGE_EMERGENCY_PATH_REGEX = re.compile(
+    r"^/1/receipts/(?P<receipt>[^/]+)/acknowledge\.json$")
+FILE_PATH_REGEX = re.compile(r"^/(?P<kind>icons|attachments)/(?P<name>[^/]+)$")
+
+FILE_SIZE = 16 * 1024  # bytes, of the served icons and attachments
+
+def read_websocket_frame(connection_file):
+    """
+    Reads a (masked) frame sent by a client; returns `(opcode, payload)`, or
+    `(None, None)` if the connection was closed.
+    """
+
+    header = connection_file.read(2)
+
+    if len(header) < 2:
+        return None, None
+
+    opcode = header[0] & 0x0f
+    is_masked = header[1] & 0x80
+    length = header[1] & 0x7f
+
+    if length == 126:
+        length, = struct.unpack("!H", connection_file.read(2))
+    elif length == 127:
+        length, = struct.unpack("!Q", connection_file.read(8))
+
+    mask = connection_file.read(4) if is_masked else bytes(4)
+    payload = connection_file.read(length)
+
+    payload = bytes(byte ^ mask[index % 4]
+                    for index, byte in enumerate(payload))
+
+    return opcode, payload
+
+def get_websocket_frame(opcode, payload):
+    """Returns an (unmasked) server frame."""
+
+    length = len(payload)
+
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 2**16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+
+    return header + payload
+
+class PushoverFakeDevice:
+
+    def __init__(self, device_id, name, secret, email):
+        self.device_id = device_id
+        self.name = name
+        self.secret = secret  # the one it was registered with
+        self.email = email  # any secret of this account is accepted
+
+        self.messages = list()  # message dicts not deleted yet
+        self.highest_message_id = 0  # acknowledged by the client
+
+        self.websocket_connections = list()  # PushoverFakeHandler
+
+class PushoverFakeServer:
+    """
+    Fake Pushover API and push server, running in background threads.
+
+    Any email and password log in, unless given in `accounts` (a dict of
+    `{ email: password }`.) Every REST response is delayed by `latency`
+    seconds (plus up to `latency_jitter`), and fails with an HTTP 500 error
+    with probability `error_rate`. Connected websockets receive a keep-alive
+    frame every `keep_alive_interval` seconds.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, accounts=None, latency=0.0,
+                 latency_jitter=0.0, error_rate=0.0, keep_alive_interval=30.0):
+
+        self.accounts = accounts
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.keep_alive_interval = keep_alive_interval
+
+        self.lock = threading.Lock()
+
+        self.secrets = dict()  # { secret: email }
+        self.devices = dict()  # { device_id: PushoverFakeDevice }
+        self.last_message_id = 0
+        self.receipts = dict()  # { receipt: acknowledged }, of emergencies
+
+        self.requests = 0
+        self.injected_errors = 0
+        self.file_requests = 0  # of icons and attachments
+
+        self.http_server = http.server.ThreadingHTTPServer(
+            (host, port), PushoverFakeHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.pushover_fake_server = self
+
+        self.stop_event = threading.Event()
+        self.threads = list()
+
+    @property
+    def address(self):
+        host, port = self.http_server.server_address[:2]
+        return "{host}:{port}".format(host=host, port=port)
+
+    @property
+    def api_url(self):
+        return "http://{address}/1".format(address=self.address)
+
+    @property
+    def websocket_url(self):
+        return "ws://{address}/push".format(address=self.address)
+
+    @property
+    def icon_url(self):
+        return "http://{address}/icons/{{icon}}.png".format(
+            address=self.address)
+
+    def get_attachment_url(self, name):
+        return "http://{address}/attachments/{name}".format(
+            address=self.address, name=name)
+
+    def start(self):
+        self.threads = [
+            threading.Thread(target=self.http_server.serve_forever,
+                             name="pushover-fake-server", daemon=True),
+            threading.Thread(target=self._send_keep_alives,
+                             name="pushover-fake-keep-alive", daemon=True)
+        ]
+
+        for thread in self.threads:
+            thread.start()
+
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+        with self.lock:
+            connections = [connection
+                           for device in self.devices.values()
+                           for connection in device.websocket_connections]
+
+        for connection in connections:
+            connection.close_websocket()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def add_device(self, secret=None, name="fake-device"):
+        """Creates a device directly; returns it (with its secret.)"""
+
+        if not secret:
+            secret = uuid.uuid4().hex
+
+        with self.lock:
+            email = self.secrets.setdefault(secret, "fake@example.com")
+
+            device_id = uuid.uuid4().hex[:25]
+            device = PushoverFakeDevice(device_id=device_id, name=name,
+                                        secret=secret, email=email)
+            self.devices.update({device_id: device})
+
+        return device
+
+    def revoke_secret(self, secret):
+        """Makes the API reject `secret`, as if it expired."""
+
+        with self.lock:
+            self.secrets.pop(secret, None)
+
+    def push_message(self, message, device_id=None, title="Fake",
+                     app="pushover_fake_server", priority=0, **fields):
+        """
+        Adds a message to a device (or to all devices) and notifies its
+        websocket connections with a `!` frame. Returns the message ids.
+
+        Emergency messages (priority 2) get a `receipt`, to acknowledge
+        them; see `receipts`.
+        """
+
+        message_ids = list()
+
+        with self.lock:
+            if device_id:
+                devices = [self.devices[device_id]]
+            else:
+                devices = list(self.devices.values())
+
+            for device in devices:
+                self.last_message_id += 1
+                message_id = self.last_message_id
+
+                message_dict = {
+                    "id": message_id,
+                    "id_str": str(message_id),
+                    "umid": message_id,
+                    "umid_str": str(message_id),
+                    "title": title,
+                    "message": message,
+                    "app": app,
+                    "aid": 1,
+                    "aid_str": "1",
+                    "icon": "pushover",
+                    "date": int(time.time()),
+                    "priority": priority,
+                    "acked": 0
+                }
+                message_dict.update(fields)
+
+                if priority == 2 and "receipt" not in message_dict:
+                    receipt = uuid.uuid4().hex
+                    message_dict.update({"receipt": receipt})
+                    self.receipts.update({receipt: False})
+
+                device.messages.append(message_dict)
+                message_ids.append(message_id)
+
+            connections = [connection for device in devices
+                           for connection in device.websocket_connections]
+
+        for connection in connections:
+            connection.send_websocket_frame(b'!')
+
+        return message_ids
+
+    def send_frame(self, frame, device_id=None):
+        """Sends a frame (`#`, `!`, `R`, `E` or `A`) to websockets."""
+
+        with self.lock:
+            connections = [connection
+                           for device in self.devices.values()
+                           if not device_id or device.device_id == device_id
+                           for connection in device.websocket_connections]
+
+        for connection in connections:
+            connection.send_websocket_frame(frame)
+
+    def _send_keep_alives(self):
+        while not self.stop_event.wait(self.keep_alive_interval):
+            self.send_frame(b'#')
+
+    # endpoints; each returns `(http_status, response_dict)`
+
+    def login(self, form):
+        email = form.get("email")
+        password = form.get("password")
+
+        if not email or not password or (self.accounts is not None and
+                                         self.accounts.get(email) != password):
+            return 400, {"status": 0,
+                         "errors": ["invalid email and/or password"]}
+
+        secret = uuid.uuid4().hex
+
+        with self.lock:
+            self.secrets.update({secret: email})
+
+        return 200, {"status": 1, "id": uuid.uuid4().hex, "secret": secret}
+
+    def register_device(self, form):
+        secret = form.get("secret")
+
+        if secret not in self.secrets:
+            return 400, {"status": 0, "errors": {"secret": ["is invalid"]}}
+
+        device = self.add_device(secret=secret, name=form.get("name"))
+
+        return 200, {"status": 1, "id": device.device_id}
+
+    def download_messages(self, query):
+        device, error = self._get_device(query.get("device_id"),
+                                         query.get("secret"))
+
+        if error:
+            return error
+
+        with self.lock:
+            messages = list(device.messages)
+
+        return 200, {"status": 1, "messages": messages,
+                     "user": {"quiet_hours": False},
+                     "device": {"name": device.name}}
+
+    def update_highest_message(self, device_id, form):
+        device, error = self._get_device(device_id, form.get("secret"))
+
+        if error:
+            return error
+
+        try:
+            highest_message_id = int(form.get("message"))
+        except (TypeError, ValueError):
+            return 400, {"status": 0, "errors": {"message": ["is invalid"]}}
+
+        with self.lock:
+            device.highest_message_id = max(device.highest_message_id,
+                                            highest_message_id)
+            device.messages = [message for message in device.messages
+                               if message["id"] > device.highest_message_id]
+
+        return 200, {"status": 1}
+
+    def acknowledge_emergency(self, receipt, form):
+        if form.get("secret") not in self.secrets:
+            return 400, {"status": 0, "errors": {"secret": ["is invalid"]}}
+
+        with self.lock:
+            if receipt not in self.receipts:
+                return 404, {"status": 0,
+                             "errors": {"receipt": ["not found"]}}
+
+            self.receipts.update({receipt: True})
+
+            # the message is shown as acknowledged from now on
+            for device in self.devices.values():
+                for message in device.messages:
+                    if message.get("receipt") == receipt:
+                        message.update({"acked": 1})
+
+        return 200, {"status": 1}
+
+    def get_file(self, kind, name):
+        """
+        Returns the content of an icon or attachment: `FILE_SIZE` bytes
+        derived from its name, so that the same name has the same content.
+        """
+
+        with self.lock:
+            self.file_requests += 1
+
+        seed = hashlib.sha256("{kind}/{name}".format(kind=kind, name=name)
+                              .encode()).digest()
+
+        return seed * (FILE_SIZE // len(seed))
+
+    def _get_device(self, device_id, secret):
+        # returns `(device, error)`
+
+        device = self.devices.get(device_id)
+
+        if secret not in self.secrets:
+            return None, (400, {"status": 0,
+                                "errors": {"secret": ["is invalid"]}})
+
+        if not device or self.secrets[secret] != device.email:
+            return None, (400, {"status": 0,
+                                "errors": {"device_id": ["is invalid"]}})
+
+        return device, None
+
+    def _inject_latency_and_errors(self):
+        # returns True if this request should fail
+
+        with self.lock:
+            self.requests += 1
+
+        delay = self.latency + random.uniform(0, self.latency_jitter)
+
+        if delay:
+            time.sleep(delay)
+
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.injected_errors += 1
+            return True
+
+        return False
+
+class PushoverFakeHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # headers and body are written apart
+
+    websocket_device = None
+    websocket_lock = None
+
+    @property
+    def pushover_fake_server(self):
+        return self.server.pushover_fake_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+
+        if url.path == "/push":
+            return self._handle_websocket()
+
+        if url.path == "/1/messages.json":
+            query = dict(urllib.parse.parse_qsl(url.query))
+            return self._respond(self.pushover_fake_server.download_messages,
+                                 query)
+
+        match = FILE_PATH_REGEX.match(url.path)
+
+        if match:
+            return self._send_file(match.group("kind"), match.group("name"))
+
+        self._send_json(404, {"status": 0, "errors": ["not found"]})
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+
+        length = int(self.headers.get("Content-Length", 0))
+        form = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+
+        if url.path == "/1/users/login.json":
+            return self._respond(self.pushover_fake_server.login, form)
+
+        if url.path == "/1/devices.json":
+            return self._respond(self.pushover_fake_server.register_device,
+                                 form)
+
+        match = UPDATE_HIGHEST_MESSAGE_PATH_REGEX.match(url.path)
+
+        if match:
+            return self._respond(
+                self.pushover_fake_server.update_highest_message,
+                match.group("device_id"), form)
+
+        match = ACKNOWLEDGE_EMERGENCY_PATH_REGEX.match(url.path)
+
+        if match:
+            return self._respond(
+                self.pushover_fake_server.acknowledge_emergency,
+                match.group("receipt"), form)
+
+        self._send_json(404, {"status": 0, "errors": ["not found"]})
+
+    def _respond(self, endpoint_function, *args):
+        if self.pushover_fake_server._inject_latency_and_errors():
+            return self._send_json(500, {"status": 0,
+                                         "errors": ["injected error"]})
+
+        status_code, response_dict = endpoint_function(*args)
+        self._send_json(status_code, response_dict)
+
+    def _send_file(self, kind, name):
+        if self.pushover_fake_server._inject_latency_and_errors():
+            return self._send_json(500, {"status": 0,
+                                         "errors": ["injected error"]})
+
+        body = self.pushover_fake_server.get_file(kind, name)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status_code, response_dict):
+        body = json.dumps(response_dict).encode("utf-8")
+
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # websocket
+
+    def send_websocket_frame(self, payload, opcode=WEBSOCKET_OPCODE_BINARY):
+        try:
+            with self.websocket_lock:
+                self.wfile.write(get_websocket_frame(opcode, payload))
+                self.wfile.flush()
+        except OSError:  # the client is gone
+            pass
+
+    def close_websocket(self):
+        self.send_websocket_frame(b"", opcode=WEBSOCKET_OPCODE_CLOSE)
+
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _handle_websocket(self):
+        key = self.headers.get("Sec-WebSocket-Key")
+
+        if not key or self.headers.get("Upgrade", "").lower() != "websocket":
+            return self._send_json(400, {"status": 0,
+                                         "errors": ["not a websocket"]})
+
+        accept = base64.b64encode(
+            hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        self.websocket_lock = threading.Lock()
+        self.close_connection = True
+
+        try:
+            self._receive_websocket_frames()
+        finally:
+            device = self.websocket_device
+
+            if device:
+                with self.pushover_fake_server.lock:
+                    device.websocket_connections.remove(self)
+
+    def _receive_websocket_frames(self):
+        pushover_fake_server = self.pushover_fake_server
+
+        while True:
+            opcode, payload = read_websocket_frame(self.rfile)
+
+            if opcode is None or opcode == WEBSOCKET_OPCODE_CLOSE:
+                if opcode is not None:
+                    self.send_websocket_frame(payload[:2],
+                                              opcode=WEBSOCKET_OPCODE_CLOSE)
+                return
+
+            if opcode == WEBSOCKET_OPCODE_PING:
+                self.send_websocket_frame(payload,
+                                          opcode=WEBSOCKET_OPCODE_PONG)
+                continue
+
+            if opcode != WEBSOCKET_OPCODE_TEXT or self.websocket_device:
+                continue
+
+            # "login:{device_id}:{secret}\n"
+            _, device_id, secret = (payload.decode().strip().split(":", 2)
+                                    + [None, None])[:3]
+
+            device, error = pushover_fake_server._get_device(device_id,
+                                                             secret)
+
+            if error:
+                self.send_websocket_frame(b'E')
+                continue
+
+            with pushover_fake_server.lock:
+                device.websocket_connections.append(self)
+
+            self.websocket_device = device
+
+def main(arguments):
+    port = int(arguments[0]) if arguments else 8080
+
+    pushover_fake_server = PushoverFakeServer(port=port).start()
+
+    print("Pushover fake server running; api_url:",
+          pushover_fake_server.api_url, "websocket_url:",
+          pushover_fake_server.websocket_url)
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pushover_fake_server.stop()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+# the client is a single module at the root of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pushover_client_python import PushoverOpenClient
+from pushover_fake_server import PushoverFakeServer
+
+@pytest.fixture
+def pushover_fake_server():
+    with PushoverFakeServer() as pushover_fake_server:
+        yield pushover_fake_server
+
+@pytest.fixture
+def credentials_filename(tmp_path):
+    return str(tmp_path / "pushover_open_client_credentials.json")
+
+@pytest.fixture
+def pushover_open_client(pushover_fake_server, credentials_filename):
+    # logged in, with a registered device, and able to log in again.
+
+    pushover_open_client =\
+        PushoverOpenClient(api_url=pushover_fake_server.api_url)
+    pushover_open_client.credentials_filename = credentials_filename
+    pushover_open_client.email = "test@example.com"
+    pushover_open_client.password = "password"
+
+    assert pushover_open_client.login()
+    assert pushover_open_client.register_device(device_name="test")
+
+    yield pushover_open_client
+
+    pushover_open_client.session.close()
+
+@pytest.fixture
+def push_messages(pushover_fake_server, pushover_open_client):
+    # pushes `count` messages to the client's device; returns their ids.
+
+    def push_messages(count, **fields):
+        message_ids = list()
+
+        for number in range(count):
+            message_ids.extend(pushover_fake_server.push_message(
+                "message {number}".format(number=number),
+                device_id=pushover_open_client.device_id, **fields))
+
+        return message_ids
+
+    return push_messages
@@ -0,0 +1,197 @@
+import threading
+import time
+
+import pytest
+
+from pushover_client_python import PushoverCommandExecutor
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+@pytest.fixture
+def blocked_executor():
+    # one worker, busy with a command until `release` is set, and a queue
+    # of two commands.
+
+    def make(policy):
+        executor = PushoverCommandExecutor(workers=1, reserved_workers=0,
+                                           queue_size=2, policy=policy)
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocker():
+            started.set()
+            release.wait()
+
+        executors.append((executor, release))
+
+        executor.submit("blocker", blocker)
+        assert started.wait(5)
+
+        return executor, release
+
+    executors = list()
+
+    yield make
+
+    for executor, release in executors:
+        release.set()
+        executor.stop(wait=True)
+
+def test_queue_size_must_be_positive():
+    with pytest.raises(ValueError):
+        PushoverCommandExecutor(queue_size=0)
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        PushoverCommandExecutor(policy="random")
+
+def test_drop_policy_drops_new_command(blocked_executor):
+    executor, release = blocked_executor("drop")
+    dropped = list()
+
+    assert executor.submit("a", print)
+    assert executor.submit("b", print)
+    assert not executor.submit("c", print, drop_callback=dropped.append)
+
+    assert dropped == ["c"]
+    assert executor.dropped == 1
+
+def test_oldest_policy_drops_oldest_command(blocked_executor):
+    executor, release = blocked_executor("oldest")
+    dropped = list()
+    ran = list()
+
+    for name in ("a", "b", "c"):
+        assert executor.submit(name, ran.append, arguments=(name,),
+                               drop_callback=dropped.append)
+
+    assert dropped == ["a"]
+
+    release.set()
+    executor.stop(wait=True)
+
+    assert ran == ["b", "c"]
+
+def test_higher_priority_evicts_lower(blocked_executor):
+    executor, release = blocked_executor("drop")
+    dropped = list()
+    ran = list()
+
+    for name, priority in (("low", -1), ("normal", 0), ("emergency", 2)):
+        assert executor.submit(name, ran.append, arguments=(name,),
+                               priority=priority,
+                               drop_callback=dropped.append)
+
+    assert dropped == ["low"]
+
+    release.set()
+    executor.stop(wait=True)
+
+    # highest priority first
+    assert ran == ["emergency", "normal"]
+
+def test_block_policy_waits_for_room(blocked_executor):
+    executor, release = blocked_executor("block")
+    ran = list()
+
+    assert executor.submit("a", ran.append, arguments=("a",))
+    assert executor.submit("b", ran.append, arguments=("b",))
+
+    results = list()
+    submitter = threading.Thread(
+        target=lambda: results.append(
+            executor.submit("c", ran.append, arguments=("c",))))
+    submitter.start()
+
+    time.sleep(0.05)
+    assert not results  # still waiting
+
+    release.set()
+    submitter.join(5)
+
+    assert results == [True]
+
+    executor.stop(wait=True)
+
+    assert ran == ["a", "b", "c"]
+
+def test_block_policy_drops_command_on_stop(blocked_executor):
+    executor, release = blocked_executor("block")
+    dropped = list()
+
+    assert executor.submit("a", print)
+    assert executor.submit("b", print)
+
+    results = list()
+    submitter = threading.Thread(
+        target=lambda: results.append(
+            executor.submit("c", print, drop_callback=dropped.append)))
+    submitter.start()
+
+    time.sleep(0.05)
+    executor.stop(wait=False)
+    submitter.join(5)
+
+    assert results == [False]
+    assert "c" in dropped
+
+def test_stop_waits_for_queued_commands(blocked_executor):
+    executor, release = blocked_executor("drop")
+    ran = list()
+
+    executor.submit("a", ran.append, arguments=("a",))
+    executor.submit("b", ran.append, arguments=("b",))
+
+    release.set()
+    executor.stop(wait=True)
+
+    assert ran == ["a", "b"]
+    assert not executor.running
+
+def test_stop_without_waiting_drops_queued_commands(blocked_executor):
+    executor, release = blocked_executor("drop")
+    dropped = list()
+
+    executor.submit("a", print, drop_callback=dropped.append)
+    executor.submit("b", print, drop_callback=dropped.append)
+
+    executor.stop(wait=False)
+
+    assert sorted(dropped) == ["a", "b"]
+
+def test_callback_after_command_runs():
+    executor = PushoverCommandExecutor(workers=1, reserved_workers=0)
+    finished = list()
+
+    def failing():
+        raise RuntimeError("failed")
+
+    executor.submit("ok", print, callback=lambda name, elapsed, exception:
+                    finished.append((name, exception)))
+    executor.submit("failing", failing,
+                    callback=lambda name, elapsed, exception:
+                    finished.append((name, type(exception))))
+
+    executor.stop(wait=True)
+
+    assert finished == [("ok", None), ("failing", RuntimeError)]
+
+def test_expired_commands_are_dropped(blocked_executor):
+    executor, release = blocked_executor("drop")
+    executor.timeout = 0.01
+    dropped = list()
+
+    executor.submit("late", print, drop_callback=dropped.append)
+
+    time.sleep(0.05)
+    release.set()
+
+    wait_until(lambda: dropped)
+
+    assert dropped == ["late"]
+    assert executor.expired == 1
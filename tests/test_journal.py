@@ -0,0 +1,148 @@
+import sqlite3
+import time
+
+import pytest
+
+from pushover_client_python import PushoverCommand
+from pushover_client_python import PushoverCommandDispatcher
+from pushover_client_python import PushoverCommandExecutor
+from pushover_client_python import PushoverMessageJournal
+from pushover_client_python import PushoverOpenClientRealTime
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "journal.db")
+
+def read_state(journal_path):
+    # as another process would see the journal.
+
+    connection = sqlite3.connect(journal_path)
+
+    try:
+        message_count, = connection.execute(
+            "SELECT COUNT(*) FROM messages").fetchone()
+        state = dict(connection.execute("SELECT key, value FROM state"))
+    finally:
+        connection.close()
+
+    return message_count, state
+
+def test_resume_after_reopening(journal_path):
+    journal = PushoverMessageJournal(journal_path)
+    journal.append([{"id": message_id, "message": str(message_id)}
+                    for message_id in (1, 2, 3)])
+    journal.mark_processed(1)
+    journal.close()
+
+    journal = PushoverMessageJournal(journal_path)
+
+    assert journal.last_processed_id == 1
+    assert [message["id"] for message in journal.resume()] == [2, 3]
+    assert journal.is_processed(1) and not journal.is_processed(2)
+    assert journal.get_highest_message_id() == 3
+
+    journal.close()
+
+def test_appending_twice_keeps_one_copy(journal_path):
+    journal = PushoverMessageJournal(journal_path)
+    journal.append([{"id": 1}])
+    journal.append([{"id": 1}])
+
+    assert journal.resume() == [{"id": 1}]
+
+    journal.close()
+
+def test_record_ack_survives_reopening(journal_path):
+    journal = PushoverMessageJournal(journal_path)
+    journal.append([{"id": message_id} for message_id in (1, 2, 3)])
+    journal.mark_processed(2)
+    journal.prepare_ack()
+    journal.record_ack(3)
+    journal.close()
+
+    journal = PushoverMessageJournal(journal_path)
+
+    assert journal.last_acked_id == 3
+    # acknowledged and processed messages are deleted.
+    assert [message["id"] for message in journal.resume()] == [3]
+    assert read_state(journal_path)[0] == 1
+
+    journal.close()
+
+def test_writes_are_committed_by_the_timer(journal_path):
+    journal = PushoverMessageJournal(journal_path, commit_interval=0.05)
+    journal.append([{"id": 1}, {"id": 2}])
+    journal.mark_processed(1)
+
+    time.sleep(0.3)
+
+    assert read_state(journal_path) == (2, {"last_processed_id": 1})
+
+    journal.mark_processed(2)
+    time.sleep(0.3)
+
+    assert read_state(journal_path)[1] == {"last_processed_id": 2}
+
+    journal.close()
+
+def test_failed_delete_does_not_record_ack(pushover_open_client,
+                                           push_messages, journal_path):
+    pushover_open_client.journal = PushoverMessageJournal(journal_path)
+    push_messages(2)
+    pushover_open_client.download_messages()
+
+    pushover_open_client.relogin_on_secret_error = False
+    secret = pushover_open_client.secret
+    pushover_open_client.secret = "rejected"
+
+    assert not pushover_open_client.delete_all_messages()
+    assert pushover_open_client.journal.last_acked_id == 0
+
+    pushover_open_client.secret = secret
+
+    assert pushover_open_client.delete_all_messages()
+    assert pushover_open_client.journal.last_acked_id == 2
+
+    pushover_open_client.journal.close()
+
+def test_client_replays_unprocessed_messages(pushover_open_client,
+                                             push_messages, journal_path):
+    # a crash after downloading messages, before their commands ran.
+    pushover_open_client.journal = PushoverMessageJournal(journal_path)
+    push_messages(2)
+    pushover_open_client.download_messages()
+    pushover_open_client.journal.close()
+
+    pushover_open_client.highest_message_id = 0
+    pushover_open_client.journal = PushoverMessageJournal(journal_path)
+    resumed_messages = pushover_open_client.resume_from_journal()
+
+    assert [message["id"] for message in resumed_messages] == [1, 2]
+    assert pushover_open_client.highest_message_id == 2
+
+    ran = list()
+
+    def message(*words):
+        ran.append(" ".join(words))
+
+    command_dispatcher = PushoverCommandDispatcher(
+        registry={"message": PushoverCommand(message)},
+        executor=PushoverCommandExecutor())
+
+    realtime = PushoverOpenClientRealTime(
+        pushover_open_client=pushover_open_client,
+        command_dispatcher=command_dispatcher)
+
+    realtime.replay(resumed_messages)
+
+    command_dispatcher.executor.stop(wait=True)
+    realtime.acknowledger.flush()
+
+    assert sorted(ran) == ["0", "1"]
+    assert pushover_open_client.journal.last_processed_id == 2
+    assert pushover_open_client.acked_message_id == 2
+
+    # handled once: the next sync doesn't dispatch them again.
+    assert realtime.sync() == []
+
+    pushover_open_client.journal.close()
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from pushover_client_python import AsyncPushoverOpenClient
+
+def test_download_messages_after_revoke_secret(pushover_fake_server,
+                                               pushover_open_client,
+                                               push_messages):
+    message_ids = push_messages(2)
+    revoked_secret = pushover_open_client.secret
+    pushover_fake_server.revoke_secret(revoked_secret)
+
+    messages = pushover_open_client.download_messages()
+
+    assert [message["id"] for message in messages] == message_ids
+    assert pushover_open_client.relogins == 1
+    assert pushover_open_client.secret != revoked_secret
+
+def test_iter_messages_after_revoke_secret(pushover_fake_server,
+                                           pushover_open_client,
+                                           push_messages):
+    message_ids = push_messages(3)
+    pushover_fake_server.revoke_secret(pushover_open_client.secret)
+
+    messages = list(pushover_open_client.iter_messages(ack_every=2))
+
+    assert [message["id"] for message in messages] == message_ids
+    assert pushover_open_client.relogins == 1
+    assert pushover_open_client.message_downloading_errors is None
+    assert pushover_open_client.acked_message_id == message_ids[-1]
+
+def test_delete_all_messages_after_revoke_secret(pushover_fake_server,
+                                                 pushover_open_client,
+                                                 push_messages):
+    push_messages(2)
+    pushover_open_client.download_messages()
+    pushover_fake_server.revoke_secret(pushover_open_client.secret)
+
+    assert pushover_open_client.delete_all_messages()
+    assert pushover_open_client.relogins == 1
+    assert pushover_open_client.download_messages() == []
+
+def test_no_relogin_without_password(pushover_fake_server,
+                                     pushover_open_client, push_messages):
+    push_messages(1)
+    pushover_open_client.password = ""
+    pushover_fake_server.revoke_secret(pushover_open_client.secret)
+
+    assert list(pushover_open_client.iter_messages()) == []
+    assert pushover_open_client.relogins == 0
+    assert "secret" in pushover_open_client.message_downloading_errors
+
+def test_async_aiter_messages_after_revoke_secret(pushover_fake_server,
+                                                  pushover_open_client,
+                                                  push_messages,
+                                                  credentials_filename):
+    pytest.importorskip("aiohttp")
+
+    message_ids = push_messages(3)
+    pushover_fake_server.revoke_secret(pushover_open_client.secret)
+
+    async def aiter_messages():
+        async with AsyncPushoverOpenClient(
+                api_url=pushover_fake_server.api_url) as async_client:
+
+            async_client.load_from_credentials_file(
+                file_path=credentials_filename)
+            async_client.credentials_filename = credentials_filename
+
+            messages = [message async for message
+                        in async_client.aiter_messages(ack_every=2)]
+
+            return messages, async_client.relogins
+
+    messages, relogins = asyncio.run(aiter_messages())
+
+    assert [message["id"] for message in messages] == message_ids
+    assert relogins == 1
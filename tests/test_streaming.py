@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from pushover_client_python import PushoverDecodeError
+from pushover_client_python import PushoverMessagesStreamParser
+
+MESSAGES = [
+    {"id": 1, "title": "brackets ] and braces }", "message": "a, b"},
+    {"id": 2, "title": "non-ascii", "message": "café ✓ \U0001f600"},
+    {"id": 3, "title": "escapes", "message": "quote \" backslash \\ \n"},
+]
+
+def get_payload(messages=MESSAGES, indent=None):
+    response_dict = {"messages": messages, "user": {"quiet_hours": False},
+                     "device": {"name": "test"}, "status": 1,
+                     "request": "0000"}
+
+    return json.dumps(response_dict, indent=indent,
+                      ensure_ascii=False).encode("utf-8")
+
+def parse_in_chunks(payload, chunk_size):
+    messages_parser = PushoverMessagesStreamParser()
+    messages = list()
+
+    for position in range(0, len(payload), chunk_size):
+        messages.extend(
+            messages_parser.feed(payload[position:position + chunk_size]))
+
+    return messages, messages_parser.close()
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 100000])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_messages_across_chunk_boundaries(chunk_size, indent):
+    messages, response_dict = parse_in_chunks(get_payload(indent=indent),
+                                              chunk_size)
+
+    assert messages == MESSAGES
+    assert response_dict["status"] == 1
+    assert response_dict["messages"] == []
+    assert response_dict["device"] == {"name": "test"}
+
+def test_no_messages():
+    messages, response_dict = parse_in_chunks(get_payload(messages=[]), 5)
+
+    assert messages == []
+    assert response_dict["status"] == 1
+
+def test_error_response():
+    payload = json.dumps({"status": 0, "errors": {"secret": ["is invalid"]},
+                          "request": "0000"}).encode()
+
+    messages, response_dict = parse_in_chunks(payload, 4)
+
+    assert messages == []
+    assert response_dict["errors"] == {"secret": ["is invalid"]}
+
+def test_truncated_response():
+    payload = get_payload()
+    truncated_payload = payload[:payload.index(b'"id": 3')]
+
+    with pytest.raises(PushoverDecodeError):
+        parse_in_chunks(truncated_payload, 16)
+
+def test_iter_messages_in_small_chunks(pushover_open_client, push_messages):
+    message_ids = push_messages(20, title="café")
+
+    messages = list(pushover_open_client.iter_messages(chunk_size=7))
+
+    assert [message["id"] for message in messages] == message_ids
+    assert messages[0]["title"] == "café"
+    assert pushover_open_client.highest_message_id == message_ids[-1]
+    assert pushover_open_client.acked_message_id == 0
+
+def test_iter_messages_acks_every_n(pushover_open_client, push_messages):
+    message_ids = push_messages(5)
+    acked_message_ids = list()
+
+    for message in pushover_open_client.iter_messages(ack_every=2):
+        acked_message_ids.append(pushover_open_client.acked_message_id)
+
+    # each message is acknowledged only once consumed.
+    assert acked_message_ids == [0, 0, message_ids[1], message_ids[1],
+                                 message_ids[3]]
+    assert pushover_open_client.acked_message_id == message_ids[-1]
+    assert pushover_open_client.download_messages() == []
+
+def test_iter_messages_before_ack_failure_keeps_messages(
+        pushover_open_client, push_messages):
+    push_messages(3)
+
+    def before_ack():
+        raise BrokenPipeError()
+
+    with pytest.raises(BrokenPipeError):
+        for message in pushover_open_client.iter_messages(
+                ack_every=float("inf"), before_ack=before_ack):
+            pass
+
+    assert pushover_open_client.acked_message_id == 0
+    assert len(pushover_open_client.download_messages()) == 3
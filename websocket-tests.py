@@ -14,7 +14,7 @@ from pushover_client_python import print_data_errors
 
 now = datetime.datetime.now()
 current_time = now.strftime("%Y%m%d_%H%M%S")
-dummy_device_name = "python-{current_time}".format(current_time=CURRENT_TIME)
+dummy_device_name = "python-{current_time}".format(current_time=current_time)
 
 pushover_client = PushoverOpenClient().load_from_credentials_file()
 
@@ -47,7 +47,9 @@ def dummy_login():
     print("Login ok. secret:", secret)
 
     return secret
-secret = dummy_login()
+# the secret and device_id stored in the credentials file are reused, and
+# checked by the first call which needs them.
+secret = pushover_client.secret or dummy_login()
 
 def dummy_register_device():
     print("Registering new device...")
@@ -68,7 +70,7 @@ def dummy_register_device():
     print("Device registered. device_id:", device_id)
 
     return device_id
-device_id = dummy_register_device()
+device_id = pushover_client.device_id or dummy_register_device()
 
 def dummy_message_downloading():
     print("Downloading messages...")